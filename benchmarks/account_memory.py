@@ -0,0 +1,63 @@
+"""
+Mede a memória ocupada por conta bancária antes e depois do AccountStore.
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.account_memory [--accounts N]
+
+"Antes" reproduz o layout antigo: uma dataclass Account por cliente, com __dict__,
+referência à Currency e um Lock próprio, guardada em uma lista. "Depois" é o
+AccountStore usado pelo Bank: arrays de inteiros contíguos e mutexes listrados.
+"""
+import argparse
+import tracemalloc
+from dataclasses import dataclass, field
+from threading import Lock
+
+from payment_system.account import AccountStore
+from utils.currency import Currency
+
+
+@dataclass
+class _LegacyAccount:
+    _id: int
+    _bank_id: int
+    currency: Currency
+    balance: int = 0
+    overdraft_limit: int = 0
+    lock: Lock = field(default_factory=Lock)
+
+
+def _measure(build) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del keep
+    return after - before
+
+
+def _legacy(n: int):
+    # valores acima de 2**30 para que os ints não venham do cache de inteiros pequenos
+    return [_LegacyAccount(i, 0, Currency.USD, 2**31 + i, 2**31 + i) for i in range(n)]
+
+
+def _store(n: int):
+    store = AccountStore(0, Currency.USD)
+    for i in range(n):
+        store.append(2**31 + i, 2**31 + i)
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", "-n", type=int, default=1_000_000,
+                        help="Número de contas criadas em cada layout")
+    args = parser.parse_args()
+
+    legacy = _measure(lambda: _legacy(args.accounts))
+    store = _measure(lambda: _store(args.accounts))
+    print(f"contas:            {args.accounts}")
+    print(f"antes (dataclass): {legacy / args.accounts:8.1f} bytes/conta")
+    print(f"depois (store):    {store / args.accounts:8.1f} bytes/conta")
+    print(f"redução:           {legacy / store:8.1f}x")
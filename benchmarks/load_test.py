@@ -0,0 +1,274 @@
+"""
+Benchmark de carga reproduzível do sistema de pagamentos.
+
+Uso (a partir da raiz do repositório):
+    python -m benchmarks.load_test [--quick] [--output results.json]
+                                   [--baseline baseline.json] [--save_baseline baseline.json]
+
+Cada configuração da varredura (carga de trabalho x processadores por banco x bancos x
+contas por banco) roda em um subprocesso próprio, com Bank, TransactionGenerator e
+PaymentProcessor reais e números aleatórios semeados, de modo que uma configuração não
+herda memória, threads ou contadores de outra. O resultado é um JSON com, por
+configuração:
+  * tx_per_s: transações liquidadas por segundo de relógio de parede;
+  * latency_ms: percentis p50/p99/p999 da latência total (criação -> finalização), no
+    tempo da simulação;
+  * lock_wait_ms: tempo total esperando pelos mutexes das contas (e por transação);
+  * peak_rss_kb: pico de memória residente do subprocesso;
+  * journal_commits: group commits do journal (configurações com journal).
+Com --trace, os geradores reproduzem um trace gravado com `main.py --capture` (ver
+utils/trace.py) na velocidade máxima, em vez de sortear as transferências: a carga de
+trabalho é a do trace, e cada banco recebe as contas que o trace usa.
+Com --journal on, as contas são registradas em um journal temporário
+(payment_system/journal.py); com --journal both, cada configuração roda com e sem journal,
+para medir o custo da durabilidade.
+Com o relógio virtual (padrão), as latências simuladas não custam tempo de parede: a vazão
+mede o custo do código de geração e liquidação, e as latências são reproduzíveis.
+Com --baseline, cada configuração é comparada com a do arquivo; uma queda de vazão ou um
+aumento do p99 acima de --tolerance é reportado como regressão (código de saída 1).
+"""
+import argparse
+import itertools
+import json
+import platform
+import resource
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from random import Random
+from typing import Dict, List
+
+# Valores padrão da varredura
+default_workloads = ["uniform", "hot_account", "cross_border_heavy", "overdraft_heavy"]
+default_processors = [1, 3, 6]
+default_banks = [2, 6]
+default_accounts = [100, 10000]
+
+# Duração de cada configuração, em unidades de tempo da simulação
+default_duration = 2000
+
+# Variação relativa tolerada antes de reportar uma regressão
+default_tolerance = 0.10
+
+
+def config_name(config: Dict) -> str:
+    workload = (f"trace:{os.path.basename(config['trace'])}" if config.get("trace")
+                else config["workload"])
+    return (f"{workload}-p{config['processors']}-b{config['banks']}"
+            f"-a{config['accounts']}{'-batch' if config['batch'] else ''}"
+            f"{'-journal' if config.get('journal') else ''}")
+
+
+def run_config(config: Dict) -> Dict:
+    """
+    Executa uma configuração no processo atual e retorna as suas medidas.
+    """
+    from logging import WARNING
+
+    from globals import banks
+    from payment_system import journal
+    from payment_system.bank import Bank
+    from payment_system.payment_processor import PaymentProcessor
+    from payment_system.transaction_generator import ReplayGenerator, TransactionGenerator
+    from payment_system.workloads import WORKLOADS, generator_rng
+    from utils import clock
+    from utils.currency import Currency
+    from utils.histogram import Histogram
+    from utils.logger import CH, LOGGER
+    from utils.metrics import LOCK_WAIT_NS, SETTLED_TRANSACTIONS, enable_lock_timing
+    from utils.trace import TraceReader
+
+    LOGGER.setLevel(WARNING)
+    CH.setLevel(WARNING)
+    enable_lock_timing()
+    time_unit = config["time_unit"]
+    clock.use(clock.VirtualClock(time_unit) if config["clock"] == "virtual"
+              else clock.RealClock(time_unit))
+
+    wal = None
+    if config.get("journal"):
+        fd, path = tempfile.mkstemp(prefix="payment-journal-")
+        os.close(fd)
+        wal = journal.Journal(path)
+        journal.use(wal)
+        wal.start()
+
+    needed = {}
+    if config.get("trace"):
+        with TraceReader(config["trace"]) as reader:
+            needed = reader.accounts_needed()
+
+    rng = Random(config["seed"])
+    for i in range(config["banks"]):
+        bank = Bank(_id=i, currency=Currency(i + 1))
+        if wal is not None:
+            wal.attach(bank)
+        for reserve in bank.reserves:
+            reserve.deposit(rng.randint(100_000_000, 10_000_000_000))
+        balances = [rng.randint(10000, 100000)
+                    for _ in range(max(config["accounts"], needed.get(i, 0)))]
+        bank.new_accounts(len(balances), balances, balances)
+        bank.open()
+        banks.append(bank)
+
+    if config.get("trace"):
+        generators = [ReplayGenerator(_id=bank._id, bank=bank, path=config["trace"], speed=0)
+                      for bank in banks]
+    else:
+        workload = WORKLOADS[config["workload"]]
+        generators = [TransactionGenerator(_id=bank._id, bank=bank,
+                                           rng=generator_rng(config["seed"], bank._id),
+                                           workload=workload)
+                      for bank in banks]
+    processors = [PaymentProcessor(_id=bank._id + k * len(banks), bank=bank,
+                                   batch_settlement=config["batch"])
+                  for k in range(config["processors"]) for bank in banks]
+
+    started = time.perf_counter()
+    with clock.actor():
+        for thread in generators + processors:
+            thread.start()
+        clock.sleep_units(config["duration"])
+        for bank in banks:
+            bank.stop_accepting()
+        for bank in banks:
+            bank.close()
+    for thread in generators + processors:
+        thread.join()
+    if wal is not None:
+        # o último group commit faz parte do custo medido
+        wal.close()
+        os.remove(wal.path)
+    wall = time.perf_counter() - started
+
+    latency = Histogram()
+    for bank in banks:
+        latency.merge(bank.latency["total"])
+    p = latency.percentiles((50, 99, 99.9))
+    settled = SETTLED_TRANSACTIONS.value()
+    lock_wait_ms = LOCK_WAIT_NS.value() / 1e6
+    return {
+        "name": config_name(config),
+        "config": config,
+        "settled": settled,
+        "wall_s": round(wall, 4),
+        "tx_per_s": round(settled / wall, 2) if wall else 0.0,
+        "latency_ms": {"p50": p[50] / 1e6, "p99": p[99] / 1e6, "p999": p[99.9] / 1e6},
+        "lock_wait_ms": round(lock_wait_ms, 3),
+        "lock_wait_ms_per_tx": round(lock_wait_ms / settled, 6) if settled else 0.0,
+        # no Linux, ru_maxrss é em KB
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "journal_commits": wal.commits if wal is not None else 0,
+    }
+
+
+def run_in_subprocess(config: Dict) -> Dict:
+    result = subprocess.run([sys.executable, "-m", "benchmarks.load_test",
+                             "--run", json.dumps(config)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{config_name(config)} falhou:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """
+    Compara `results` com `baseline` e retorna as regressões encontradas.
+    """
+    by_name = {entry["name"]: entry for entry in baseline}
+    regressions = []
+    for entry in results:
+        base = by_name.get(entry["name"])
+        if base is None:
+            print(f"{entry['name']:45} sem baseline")
+            continue
+        throughput = entry["tx_per_s"] / base["tx_per_s"] if base["tx_per_s"] else 1.0
+        p99 = (entry["latency_ms"]["p99"] / base["latency_ms"]["p99"]
+               if base["latency_ms"]["p99"] else 1.0)
+        print(f"{entry['name']:45} vazão {throughput:6.2f}x   p99 {p99:6.2f}x")
+        if throughput < 1 - tolerance:
+            regressions.append(f"{entry['name']}: vazão caiu para {throughput:.2f}x do baseline")
+        if p99 > 1 + tolerance:
+            regressions.append(f"{entry['name']}: p99 subiu para {p99:.2f}x do baseline")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workloads", nargs="+", default=default_workloads,
+                        help="Cargas de trabalho (ver payment_system/workloads.py)")
+    parser.add_argument("--processors", nargs="+", type=int, default=default_processors,
+                        help="Números de processadores por banco")
+    parser.add_argument("--banks", nargs="+", type=int, default=default_banks,
+                        help="Números de bancos (até 6)")
+    parser.add_argument("--accounts", nargs="+", type=int, default=default_accounts,
+                        help="Números de contas iniciais por banco")
+    parser.add_argument("--batch", action="store_true",
+                        help="Liquidar as transações em lote")
+    parser.add_argument("--trace",
+                        help="Reproduzir este trace (main.py --capture) em vez das cargas de trabalho")
+    parser.add_argument("--journal", choices=["off", "on", "both"], default="off",
+                        help="Registrar as contas em um journal temporário (both: com e sem)")
+    parser.add_argument("--duration", type=int, default=default_duration,
+                        help="Duração de cada configuração, em unidades de tempo")
+    parser.add_argument("--time_unit", type=float, default=0.01,
+                        help="Valor da unidade de tempo de simulação, em segundos")
+    parser.add_argument("--clock", choices=["virtual", "real"], default="virtual",
+                        help="Relógio da simulação")
+    parser.add_argument("--seed", type=int, default=2022)
+    parser.add_argument("--quick", action="store_true",
+                        help="Varredura reduzida: uma configuração por carga de trabalho")
+    parser.add_argument("--output", "-o", help="Arquivo JSON com os resultados")
+    parser.add_argument("--baseline", help="Arquivo JSON de resultados para comparação")
+    parser.add_argument("--save_baseline", help="Grava os resultados como novo baseline")
+    parser.add_argument("--tolerance", type=float, default=default_tolerance,
+                        help="Variação relativa tolerada antes de reportar regressão")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # subprocesso: executa uma única configuração e imprime o resultado
+        print(json.dumps(run_config(json.loads(args.run))))
+        sys.exit(0)
+
+    if args.quick:
+        args.processors, args.banks, args.accounts = [3], [6], [1000]
+    journal_modes = {"off": [False], "on": [True], "both": [False, True]}[args.journal]
+    if args.trace:
+        args.workloads = ["trace"]
+    configs = [{"workload": workload, "processors": processors, "banks": n_banks,
+                "accounts": accounts, "batch": args.batch, "duration": args.duration,
+                "time_unit": args.time_unit, "clock": args.clock, "seed": args.seed,
+                "journal": with_journal, "trace": args.trace}
+               for workload, processors, n_banks, accounts, with_journal in itertools.product(
+                   args.workloads, args.processors, args.banks, args.accounts, journal_modes)]
+
+    results = []
+    for config in configs:
+        entry = run_in_subprocess(config)
+        results.append(entry)
+        print(f"{entry['name']:45} {entry['tx_per_s']:10.1f} tx/s   "
+              f"p99 {entry['latency_ms']['p99']:9.2f} ms   "
+              f"lock wait {entry['lock_wait_ms']:8.2f} ms   "
+              f"rss {entry['peak_rss_kb']} KB", file=sys.stderr)
+
+    report = {"python": platform.python_version(), "machine": platform.machine(),
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSÃO: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
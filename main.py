@@ -1,7 +1,9 @@
 import argparse
+import os
 import time
 import sys
 from logging import INFO, DEBUG
+import random
 from random import randint
 from datetime import datetime, timedelta
 
@@ -9,9 +11,26 @@ from datetime import datetime, timedelta
 from globals import *
 from payment_system.bank import Bank
 from payment_system.payment_processor import PaymentProcessor
-from payment_system.transaction_generator import TransactionGenerator
+from payment_system.processor_pool import ProcessorPool
+from payment_system.autoscaler import Autoscaler, default_target_latency
+from payment_system.async_engine import AsyncEngine
+from payment_system.international import InternationalPipeline
+from payment_system import journal
+from payment_system.journal import Journal, journal_commit_interval
+from payment_system import reserve_cache, snapshot
+from payment_system.snapshot import Checkpointer, snapshot_interval
+from payment_system.sharded import default_shards, release_banks, run_sharded
+from payment_system.transaction_generator import ReplayGenerator, TransactionGenerator
+from payment_system.workloads import WORKLOADS, generator_rng
+from utils import clock
+from utils.clock import RealClock, VirtualClock
+from utils import lockprof
 from utils.currency import Currency
-from utils.logger import CH, LOGGER
+from utils.logger import CH, LOGGER, set_overflow_policy, set_sampling
+from utils.trace import TraceReader, TraceWriter
+from utils.metrics import (LOCK_ACQUISITIONS, RESERVES_PULLED, RESERVES_RETURNED,
+                           RESERVES_SPENT, SETTLED_TRANSACTIONS, MetricsServer,
+                           SnapshotWriter, register_collector)
 
 
 if __name__ == "__main__":
@@ -27,7 +46,81 @@ if __name__ == "__main__":
                         help="Valor da unidade de tempo de simulação")
     parser.add_argument("--total_time", "-t", help="Tempo total de simulação")
     parser.add_argument("--debug", "-d", help="Printar logs em nível DEBUG")
+    parser.add_argument("--log_policy", choices=["drop", "block"], default="drop",
+                        help="O que fazer quando o buffer de logs estiver cheio")
+    parser.add_argument("--log_sample", type=int, default=1,
+                        help="Emitir apenas 1 a cada N logs INFO do caminho crítico das transações")
+    parser.add_argument("--drain", type=float, nargs="?", const=30.0, default=None,
+                        help="Ao final, liquidar as transações pendentes (esperando no máximo DRAIN segundos) em vez de descartá-las")
+    parser.add_argument("--pool", action="store_true",
+                        help="Usar um pool de processadores compartilhado entre os bancos, com roubo de trabalho")
+    parser.add_argument("--autoscale", type=int, nargs=2, metavar=("MIN", "MAX"),
+                        help="Ajustar o número de processadores por banco entre MIN e MAX conforme a fila e a latência")
+    parser.add_argument("--target_latency", type=float,
+                        help="p99 alvo (em segundos) da espera na fila para o autoscaler (padrão: 2 tempos de processamento de uma transação)")
+    parser.add_argument("--batch", "-b", action="store_true",
+                        help="Liquidar as transações em lote (uma passada de locks por bloco)")
+    parser.add_argument("--mode", choices=["threads", "processes", "asyncio"], default="threads",
+                        help="Executar os atores como threads, divididos entre processos ou como corrotinas asyncio")
+    parser.add_argument("--processors", type=int, default=3,
+                        help="Número de processadores de pagamentos por banco")
+    parser.add_argument("--shards", type=int, default=default_shards,
+                        help="Número de processos no modo 'processes'")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Liquidar transferências internacionais em um pipeline de etapas (débito, câmbio, crédito)")
+    parser.add_argument("--netting", type=int, default=0, metavar="N",
+                        help="Compensar até N transações por janela, aplicando uma única variação líquida por conta")
+    parser.add_argument("--netting_window", type=float,
+                        help="Duração máxima (em segundos) da janela de compensação (padrão: 1 unidade de tempo)")
+    parser.add_argument("--reserve_cache", action="store_true",
+                        help="Debitar o câmbio de fatias locais (por processador) das reservas em moeda estrangeira")
+    parser.add_argument("--metrics_port", type=int,
+                        help="Expor as métricas em http://127.0.0.1:PORTA/metrics (formato Prometheus)")
+    parser.add_argument("--metrics_file",
+                        help="Reescrever periodicamente um snapshot JSON das métricas neste arquivo")
+    parser.add_argument("--metrics_interval", type=float, default=1.0,
+                        help="Intervalo (em segundos) entre os snapshots de --metrics_file")
+    parser.add_argument("--workload", choices=list(WORKLOADS), default="uniform",
+                        help="Carga de trabalho dos geradores de transações")
+    parser.add_argument("--seed", type=int,
+                        help="Semente dos números aleatórios (contas, reservas e transações)")
+    parser.add_argument("--journal", metavar="PATH",
+                        help="Registrar as alterações das contas em um journal (write-ahead log) em PATH")
+    parser.add_argument("--recover", action="store_true",
+                        help="Reconstruir as contas a partir do journal de --journal antes de continuar a simulação")
+    parser.add_argument("--journal_interval", type=float, default=journal_commit_interval,
+                        help="Intervalo (em segundos) entre os group commits do journal")
+    parser.add_argument("--snapshot_dir", metavar="DIR",
+                        help="Gravar checkpoints (completos e incrementais) das contas em DIR")
+    parser.add_argument("--snapshot_interval", type=float, default=snapshot_interval,
+                        help="Intervalo (em segundos) entre os checkpoints de --snapshot_dir")
+    parser.add_argument("--capture", metavar="PATH",
+                        help="Gravar as transações geradas em um trace binário em PATH")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="Reproduzir as transações do trace em PATH em vez de gerá-las")
+    parser.add_argument("--replay_speed", type=float, default=1.0,
+                        help="Fator sobre o ritmo gravado do trace de --replay (0: velocidade máxima)")
+    parser.add_argument("--lockprof", action="store_true",
+                        help="Medir a contenção dos mutexes e printá-la ao final (ou PAYMENT_LOCKPROF=1)")
+    parser.add_argument("--virtual", action="store_true",
+                        help="Usar um relógio virtual de eventos discretos (o tempo simulado avança instantaneamente)")
     args = parser.parse_args()
+    if args.pool and args.autoscale:
+        parser.error("--pool e --autoscale não podem ser usados juntos")
+    if args.mode != "threads" and (args.pool or args.autoscale):
+        parser.error("--pool e --autoscale só são suportados no modo 'threads'")
+    if args.mode != "threads" and (args.virtual or args.pipeline or args.netting or args.reserve_cache):
+        parser.error("--virtual, --pipeline, --netting e --reserve_cache só são suportados no modo 'threads'")
+    if args.mode == "processes" and (args.metrics_port is not None or args.metrics_file):
+        parser.error("--metrics_port e --metrics_file não são suportados no modo 'processes'")
+    if args.mode == "processes" and (args.journal or args.snapshot_dir):
+        parser.error("--journal e --snapshot_dir não são suportados no modo 'processes'")
+    if args.mode != "threads" and (args.capture or args.replay):
+        parser.error("--capture e --replay só são suportados no modo 'threads'")
+    if args.capture and args.replay:
+        parser.error("--capture e --replay não podem ser usados juntos")
+    if args.recover and not (args.journal or args.snapshot_dir):
+        parser.error("--recover exige --journal ou --snapshot_dir")
     if args.time_unit:
         time_unit = float(args.time_unit)
     if args.total_time:
@@ -35,6 +128,13 @@ if __name__ == "__main__":
     if args.debug:
         debug = True
 
+    # Com --lockprof, os mutexes criados a partir daqui são instrumentados
+    if args.lockprof:
+        lockprof.enable()
+
+    # Configura o relógio da simulação (antes de criar bancos e threads)
+    clock.use(VirtualClock(time_unit) if args.virtual else RealClock(time_unit))
+
     # Configura logger
     if debug:
         LOGGER.setLevel(DEBUG)
@@ -42,11 +142,18 @@ if __name__ == "__main__":
     else:
         LOGGER.setLevel(INFO)
         CH.setLevel(INFO)
+    set_overflow_policy(args.log_policy)
+    set_sampling(INFO, args.log_sample)
 
     # Printa argumentos capturados da simulação
     LOGGER.info(
         f"Iniciando simulação com os seguintes parâmetros:\n\ttotal_time = {total_time}\n\tdebug = {debug}\n")
-    time.sleep(3)
+    clock.sleep(3)
+
+    # Com --seed, saldos, reservas e a criação de contas são reproduzíveis (a ordem em que
+    # as threads intercalam continua dependendo do escalonador)
+    if args.seed is not None:
+        random.seed(args.seed)
 
     # Inicializa variável `tempo`:
     t = 0
@@ -57,79 +164,291 @@ if __name__ == "__main__":
         # Cria Banco Nacional
         bank = Bank(_id=i, currency=currency)
 
-        # Deposita valores aleatórios nas contas internas (reserves) do banco
-        bank.reserves.BRL.deposit(randint(100_000_000, 10_000_000_000))
-        bank.reserves.CHF.deposit(randint(100_000_000, 10_000_000_000))
-        bank.reserves.EUR.deposit(randint(100_000_000, 10_000_000_000))
-        bank.reserves.GBP.deposit(randint(100_000_000, 10_000_000_000))
-        bank.reserves.JPY.deposit(randint(100_000_000, 10_000_000_000))
-        bank.reserves.USD.deposit(randint(100_000_000, 10_000_000_000))
-
         # Adiciona banco na lista global de bancos
         banks.append(bank)
 
-    # ALTERAÇÕES: Criando contas e inicializando bancos
-    # Os valores aqui são arbitrários, inclusive o número de contas criadas
-    # Não sei se é a ideia do trabalho iniciar as contas aqui. De qualquer modo,
-    # está facilitando a execução
-    for bank in banks:
-        for i in range(10):
-            balance = randint(10000, 100000)
-            overdraft_limit = balance
-            bank.new_account(balance, overdraft_limit)
-        bank.open_bank()
-
-    # ALTERAÇÃO: Criação de listas para armazenar as threads
-    # Elas serão posteriormente inicializadas e finalizadas
-    transaction_threads = []
-    processing_threads = []
-
-    # Inicializa gerador de transações e processadores de pagamentos para os Bancos Nacionais:
-    for i, bank in enumerate(banks):
-        # Cria um TransactionGenerator thread por banco:
-        transaction_threads.append(
-            TransactionGenerator(_id=i, bank=bank))  # alterado
-        # Cria um PaymentProcessor thread por banco.
-        # Sua solução completa deverá funcionar corretamente com múltiplos PaymentProcessor threads para cada banco.
-        processing_threads.append(PaymentProcessor(_id=i, bank=bank))
-        processing_threads.append(PaymentProcessor(_id=(i+6), bank=bank))
-        processing_threads.append(PaymentProcessor(_id=(i+12), bank=bank))
-
-    for i in range(len(transaction_threads)):
-        transaction_threads[i].start()
-
-    for i in range(len(processing_threads)):
-        processing_threads[i].start()
-
-    # As accounts são criadas aqui?
-    # Enquanto o tempo total de simuação não for atingido:
-    while t < total_time:
-        # Aguarda um tempo aleatório antes de criar o próximo cliente:
-        dt = randint(0, 3)
-        time.sleep(dt * time_unit)
-
-        # Alteração: Criando uma conta nova em cada banco a cada ciclo
+    # Com --journal, o journal é ligado antes dos depósitos iniciais, para que eles também
+    # sejam registrados. Com --recover, as contas e as reservas vêm do último checkpoint de
+    # --snapshot_dir e dos registros do journal posteriores a ele.
+    snapshot_lsn = 0
+    if args.recover and args.snapshot_dir:
+        recovery_start = time.perf_counter()
+        snapshot_lsn = snapshot.restore(args.snapshot_dir, banks)
+        LOGGER.info(f"Checkpoints {args.snapshot_dir}: "
+                    f"{sum(len(bank.accounts) for bank in banks)} contas restauradas em "
+                    f"{time.perf_counter() - recovery_start:.3f}s (LSN {snapshot_lsn})")
+    elif args.snapshot_dir:
+        # checkpoints de outra simulação não valem para esta
+        snapshot.clear(args.snapshot_dir)
+    wal = None
+    if args.journal:
+        recovered = None
+        if args.recover:
+            recovered = journal.replay(args.journal, banks, from_lsn=snapshot_lsn)
+            LOGGER.info(f"Journal {args.journal}: {recovered['accounts']} contas e "
+                        f"{recovered['deltas']} variações de saldo e "
+                        f"{recovered['slices']} movimentações de fatias de reservas recuperadas "
+                        f"(LSN {recovered['lsn']})")
+        elif os.path.exists(args.journal):
+            # um journal novo não pode continuar um arquivo de outra simulação
+            os.remove(args.journal)
+        wal = Journal(args.journal, commit_interval=args.journal_interval,
+                      lsn=recovered["lsn"] if recovered else 0)
+        for bank in banks:
+            wal.attach(bank)
+        journal.use(wal)
+        wal.start()
+
+    if not args.recover:
+        # Deposita valores aleatórios nas contas internas (reserves) dos bancos
+        for bank in banks:
+            for reserve in bank.reserves:
+                reserve.deposit(randint(100_000_000, 10_000_000_000))
+
+        # ALTERAÇÕES: Criando contas e inicializando bancos
+        # Os valores aqui são arbitrários, inclusive o número de contas criadas
+        # Não sei se é a ideia do trabalho iniciar as contas aqui. De qualquer modo,
+        # está facilitando a execução
+        for bank in banks:
+            balances = [randint(10000, 100000) for _ in range(10)]
+            # overdraft_limit = balance
+            bank.new_accounts(len(balances), balances, balances)
+
+    # Com --replay, cada banco precisa ter as contas usadas pelo trace
+    if args.replay:
+        with TraceReader(args.replay) as reader:
+            needed = reader.accounts_needed()
+        for bank in banks:
+            missing = needed.get(bank._id, 0) - len(bank.accounts)
+            if missing > 0:
+                balances = [randint(10000, 100000) for _ in range(missing)]
+                bank.new_accounts(missing, balances, balances)
+
+    # Com --snapshot_dir, os checkpoints são tirados sem parar os processadores
+    checkpointer = None
+    if args.snapshot_dir:
+        checkpointer = Checkpointer(args.snapshot_dir, banks, journal=wal,
+                                    interval=args.snapshot_interval)
+        checkpointer.start()
+
+    if args.mode != "processes":
+        for bank in banks:
+            bank.open()
+
+    # Métricas ao vivo: lidas dos bancos a cada requisição/snapshot
+    metrics_server = snapshot_writer = None
+    if args.metrics_port is not None or args.metrics_file:
+        register_collector(lambda: [sample for bank in banks for sample in bank.metrics()])
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(args.metrics_port)
+        metrics_server.start()
+        LOGGER.info(f"Métricas em http://{metrics_server.address[0]}:"
+                    f"{metrics_server.address[1]}/metrics")
+    if args.metrics_file:
+        snapshot_writer = SnapshotWriter(args.metrics_file, args.metrics_interval)
+        snapshot_writer.start()
+
+    if args.mode == "processes":
+        # Os bancos são divididos entre processos; as contas são fixas neste modo
+        pending = run_sharded(banks, total_time * time_unit, shards=args.shards,
+                              processors_per_bank=args.processors,
+                              batch_settlement=args.batch, drain=args.drain,
+                              log_policy=args.log_policy, log_sample=args.log_sample,
+                              time_unit=time_unit, workload=args.workload, seed=args.seed)
+    elif args.mode == "asyncio":
+        # Geradores e processadores são corrotinas em uma única thread
+        engine = AsyncEngine(banks, processors_per_bank=args.processors,
+                             batch_settlement=args.batch, time_unit=time_unit,
+                             workload=WORKLOADS[args.workload], seed=args.seed)
+        pending = engine.run(total_time, drain=args.drain)
+    else:
+        # ALTERAÇÃO: Criação de listas para armazenar as threads
+        # Elas serão posteriormente inicializadas e finalizadas
+        transaction_threads = []
+        processing_threads = []
+
+        # Com --pipeline, as transferências internacionais são liquidadas em etapas
+        pipeline = InternationalPipeline() if args.pipeline else None
+
+        # Com --netting, cada processador liquida janelas de até N transações;
+        # com --reserve_cache, debita o câmbio de fatias locais das reservas
+        options = {"netting_size": args.netting,
+                   "netting_window": args.netting_window or time_unit,
+                   "reserve_cache": args.reserve_cache}
+
+        # Com --capture, as transações geradas são gravadas em um trace
+        trace = TraceWriter(args.capture) if args.capture else None
+
+        # Inicializa gerador de transações e processadores de pagamentos para os Bancos Nacionais:
+        for i, bank in enumerate(banks):
+            # Cria um TransactionGenerator thread por banco (ou um ReplayGenerator, com --replay):
+            if args.replay:
+                transaction_threads.append(
+                    ReplayGenerator(_id=i, bank=bank, path=args.replay, speed=args.replay_speed))
+            else:
+                transaction_threads.append(
+                    TransactionGenerator(_id=i, bank=bank, rng=generator_rng(args.seed, i),
+                                         workload=WORKLOADS[args.workload], trace=trace))  # alterado
+            if not (args.pool or args.autoscale):
+                # Cria `args.processors` (três, por padrão) PaymentProcessor threads por banco.
+                for k in range(args.processors):
+                    processing_threads.append(PaymentProcessor(
+                        _id=(i + 6 * k), bank=bank, batch_settlement=args.batch,
+                        pipeline=pipeline, **options))
+
+        # Com --pool, os mesmos processadores por banco formam um pool compartilhado
+        pool = None
+        if args.pool:
+            pool = ProcessorPool(banks, workers_per_bank=args.processors,
+                                 batch_settlement=args.batch, pipeline=pipeline, **options)
+            processing_threads.extend(pool.workers)
+
+        # A thread principal é um dos atores do relógio até fechar os bancos
+        clock.enter_actor()
+
+        # Com --autoscale, os processadores são criados e aposentados pelo Autoscaler
+        autoscaler = None
+        if args.autoscale:
+            target_latency = args.target_latency or default_target_latency(time_unit)
+            autoscaler = Autoscaler(banks, *args.autoscale, target_latency=target_latency,
+                                    batch_settlement=args.batch, pipeline=pipeline, **options)
+            if args.metrics_port is not None or args.metrics_file:
+                register_collector(autoscaler.samples)
+            autoscaler.start()
+
+        for i in range(len(transaction_threads)):
+            transaction_threads[i].start()
+
+        if pipeline is not None:
+            pipeline.start()
+
+        for i in range(len(processing_threads)):
+            processing_threads[i].start()
+
+        # As accounts são criadas aqui?
+        # Enquanto o tempo total de simuação não for atingido:
+        while t < total_time:
+            # Aguarda um tempo aleatório antes de criar o próximo cliente:
+            dt = randint(0, 3)
+            clock.sleep_units(dt)
+
+            # Alteração: Criando uma conta nova em cada banco a cada ciclo
+            for bank in banks:
+                balance = randint(10000, 100000)
+                overdraft_limit = balance
+                bank.new_account(balance, overdraft_limit)
+
+            # Atualiza a variável tempo considerando o intervalo de criação dos clientes:
+            t += dt
+
+        # Finaliza todas as threads:
+        # 1. os bancos param de aceitar transações (os geradores são acordados e encerram);
+        # 2. com --drain, espera a liquidação das transações pendentes;
+        # 3. com --pipeline, o pipeline para de receber transferências e conclui as que já
+        #    recebeu (as entregues depois disso são liquidadas pelos processadores);
+        # 4. os bancos fecham (os processadores são acordados e encerram).
+        shutdown_start = time.perf_counter()
+        if autoscaler is not None:
+            autoscaler.stop()
+            autoscaler.join()
+            processing_threads.extend(autoscaler.workers())
         for bank in banks:
-            balance = randint(10000, 100000)
-            overdraft_limit = balance
-            bank.new_account(balance, overdraft_limit)
+            bank.stop_accepting()
 
-        # Atualiza a variável tempo considerando o intervalo de criação dos clientes:
-        t += dt
+        if args.drain is not None:
+            deadline = clock.monotonic() + args.drain
+            for bank in banks:
+                if not bank.drain(max(0.0, deadline - clock.monotonic())):
+                    LOGGER.warning(
+                        f"Banco {bank._id} não liquidou todas as transações dentro do prazo de drain")
 
-    # Finaliza todas as threads
-    # TODO
+        # um processador pode estar no meio da latência simulada de uma transação
+        join_timeout = 5 + 3 * time_unit
+        if pipeline is not None:
+            pipeline.close()
+            if not pipeline.drain(join_timeout):
+                LOGGER.warning("O pipeline internacional não concluiu todas as transferências "
+                               "antes do fechamento dos bancos")
 
-    # ALTERAÇÃO: Fechar os Bancos
-    for bank in banks:
-        bank.close_bank()
+        for bank in banks:
+            bank.close()
+        clock.exit_actor()
 
-    for i in range(len(transaction_threads)):
-        # print(transaction_threads[i].name, transaction_threads[i].is_alive())
-        transaction_threads[i].join()
+        for thread in transaction_threads + processing_threads:
+            thread.join(max(0.0, shutdown_start + join_timeout - time.perf_counter()))
+        # os workers do pipeline encerram depois de esvaziar as etapas
+        pipeline_threads = []
+        if pipeline is not None:
+            pipeline_threads = pipeline.workers
+            for thread in pipeline_threads:
+                thread.join(max(0.0, shutdown_start + join_timeout - time.perf_counter()))
+        leaked = [thread.name for thread in transaction_threads +
+                  processing_threads + pipeline_threads if thread.is_alive()]
 
-    for i in range(len(processing_threads)):
-        processing_threads[i].join()
+        LOGGER.info(
+            f"Encerramento das threads concluído em {time.perf_counter() - shutdown_start:.3f}s")
+        if leaked:
+            LOGGER.error(f"Threads que não finalizaram: {leaked}")
+
+        if trace is not None:
+            trace.close()
+            LOGGER.info(f"Trace {args.capture}: {trace.records} transações gravadas")
+        if args.replay:
+            LOGGER.info(f"Trace {args.replay}: "
+                        f"{sum(thread.replayed for thread in transaction_threads)} transações "
+                        f"reproduzidas, {sum(thread.skipped for thread in transaction_threads)} "
+                        f"ignoradas")
+
+        if pool is not None:
+            pool.report()
+        if pipeline is not None:
+            pipeline.report()
+        if autoscaler is not None:
+            for bank_id, metrics in autoscaler.metrics().items():
+                LOGGER.info(f"Autoscaler: banco {bank_id}: {metrics}")
+
+        if args.reserve_cache:
+            # tudo o que saiu das reservas compartilhadas foi usado no câmbio, devolvido ou
+            # ainda está na fatia de um processador que não encerrou
+            pulled, spent, returned = (RESERVES_PULLED.value(), RESERVES_SPENT.value(),
+                                       RESERVES_RETURNED.value())
+            held = sum(reserve_cache.outstanding().values())
+            if pulled == spent + returned + held:
+                LOGGER.info(f"Cache de reservas: {pulled} centavos retirados, {spent} usados "
+                            f"no câmbio, {returned} devolvidos, {held} retidos em fatias")
+            else:
+                LOGGER.error(f"Cache de reservas não reconcilia: {pulled} retirados != "
+                             f"{spent} usados + {returned} devolvidos + {held} retidos")
+
+        pending = [(bank._id, *bank.info_transaction_incompleted()) for bank in banks]
+
+    if checkpointer is not None:
+        checkpointer.stop()
+        LOGGER.info(f"Checkpoints {args.snapshot_dir}: {checkpointer.checkpoints} gravados "
+                    f"(último com os stores travados por "
+                    f"{checkpointer.last_pause_ns / 1e6:.3f}ms)")
+    if wal is not None:
+        wal.close()
+        journal.use(None)
+        LOGGER.info(f"Journal {args.journal}: {wal.commits} group commits, "
+                    f"LSN durável {wal.durable_lsn}")
+
+    if snapshot_writer is not None:
+        snapshot_writer.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+
+    # no modo de processos, cada processo printa a latência dos seus bancos
+    if args.mode != "processes":
+        for bank in banks:
+            bank.info()
+            bank.latency_report()
+        lockprof.report()
+
+    if args.mode != "processes" and SETTLED_TRANSACTIONS.value():
+        LOGGER.info(
+            f"Mutexes de contas adquiridos por transação liquidada: "
+            f"{LOCK_ACQUISITIONS.value() / SETTLED_TRANSACTIONS.value():.2f}")
 
     # Termina simulação. Após esse print somente dados devem ser printados no console.
     LOGGER.info(f"A simulação chegou ao fim!\n")
@@ -138,8 +457,7 @@ if __name__ == "__main__":
     # delas na fila de espera
     trans_incompletas = 0
     soma_medias = timedelta()
-    for bank in banks:
-        (len_queue, media) = bank.info_transaction_incompleted()
+    for (_, len_queue, media) in pending:
         trans_incompletas += len_queue
         soma_medias += media
 
@@ -147,3 +465,6 @@ if __name__ == "__main__":
         f"Quantidade total (de todos os bancos) de transações não processadas: {trans_incompletas}")
     LOGGER.info(
         f"Média de tempo destas transações na fila de espera até o fechamento do banco: {soma_medias/6}")
+
+    if args.mode == "processes":
+        release_banks(banks, unlink=True)
@@ -1,26 +1,231 @@
-from dataclasses import dataclass
+import time
+from array import array
+from contextlib import contextmanager
+from dataclasses import InitVar, dataclass, field
+from multiprocessing.shared_memory import SharedMemory
 from threading import Lock
+from typing import Iterator, Optional, Sequence, Tuple
 
 from utils.currency import Currency
-from utils.logger import LOGGER
+from utils.lockprof import make_lock
+from utils.logger import HOT, LOGGER
+from utils import metrics
+from utils.metrics import LOCK_ACQUISITIONS, LOCK_WAIT_NS
+from utils.money import format_amount
 
-# Ideia: Foi adicionado um mutex em cada conta e o mutex é solicitado
-# dentro das operações depositar ou sacar. O ponto é que não está implementado
-# de modo que o payment_processor tenha que ter os mutexes tanto da conta origem
-# como da conta destino antes de realizar as operações entre contas. Se fosse assim, as operações de
-# lock e unlock seriam realizadas pela função do payment_processor.
+# Ideia: os saldos e limites das contas de um banco ficam em arrays contíguos de inteiros
+# (AccountStore), e não em um objeto por conta. Os mutexes são "listrados": a conta `i`
+# é protegida pelo mutex `i % stripes` do seu store, então o número de mutexes não cresce
+# com o número de contas. `Account` é apenas uma visão leve (store, índice) sobre esses
+# arrays, de modo que `bank.accounts[i].balance`, `deposit`, `withdraw` etc. continuam
+# funcionando.
+# `deposit` e `withdraw` travam a conta individualmente. Para operações entre contas,
+# a liquidação usa `lock_accounts`, que trava origem e destino (e reservas, se for o
+# caso) juntas em ordem determinística, e então altera os saldos diretamente.
+# Com um journal (payment_system/journal.py), toda criação de conta e alteração de saldo
+# ou limite é registrada no momento em que é feita, com o mutex correspondente adquirido.
+# Para os checkpoints incrementais (payment_system/snapshot.py), um store pode marcar as
+# páginas (blocos de 2**dirty_page_bits contas) alteradas desde o último checkpoint em um
+# bitmap `dirty`, com um byte por página. `lock_stores` trava stores inteiros para copiá-los.
+# No modo de processos (ver payment_system/sharded.py) os arrays de um store são movidos
+# para um bloco de memória compartilhada (`share`/`attach`). Os mutexes continuam sendo
+# locais a cada processo: apenas o processo dono do banco altera os saldos dele.
 
-# Optei por deixar os mutexes aqui nas funções de "deposit" e "withdraw" pois
-# os comentários do trabalho diziam pra adicionar os códigos relativos a concorrência
-# nestas funções. A princípio essa é uma solução que é simples e funciona,
-# mas ainda fico na dúvida se teria que ser feito de modo diferente.
+# Número padrão de mutexes por AccountStore
+account_stripes = 64
+
+# Cada página do bitmap de contas alteradas cobre 2**dirty_page_bits contas
+dirty_page_bits = 9
+
+
+class AccountStore:
+    """
+    Armazenamento compacto das contas de um banco: saldos e limites de cheque especial em
+    arrays de inteiros de 64 bits indexados pelo _id da conta, com mutexes listrados.
+    Também é o registro concorrente de contas do banco: a alocação de _ids é atômica (um
+    mutex só para criação de contas) e uma conta só é publicada, isto é, passa a contar em
+    `len()` e a ser acessível por índice, depois que o seu saldo e limite foram gravados.
+    Leituras de contas já publicadas não usam mutex.
+    Um store pode ser movido para memória compartilhada (`share`) e mapeado por outros
+    processos (`attach`); a partir daí o número de contas é fixo.
+    Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
+
+    ...
+
+    Atributos
+    ---------
+    _bank_id : int
+        Identificador do banco dono das contas.
+    currency : Optional[Currency]
+        Moeda corrente das contas (None para as reservas, que têm uma moeda por conta).
+    journal : Optional[Journal]
+        Journal que registra as criações de contas e as alterações de saldos e limites
+        (None para não registrar).
+    dirty : Optional[bytearray]
+        Um byte por página de contas, diferente de zero se alguma conta da página foi
+        criada ou alterada desde a última limpeza (None para não rastrear).
+
+    Métodos
+    -------
+    append(balance: int = 0, overdraft_limit: int = 0) -> int:
+        Cria uma nova conta e retorna o seu _id.
+    extend(balances: Sequence[int], overdraft_limits: Sequence[int]) -> range:
+        Cria várias contas de uma só vez e retorna o intervalo de _ids alocados.
+    lock_for(index: int) -> Lock:
+        Mutex que protege a conta `index`.
+    track_dirty_pages() -> None:
+        Passa a marcar em `dirty` as páginas alteradas (inicialmente, todas).
+    lock_order(index: int) -> Tuple[int, int, int]:
+        Chave global de ordenação do mutex que protege a conta `index`.
+    nbytes() -> int:
+        Memória ocupada pelos arrays de saldos e limites.
+    share() -> str:
+        Move saldos e limites para um bloco de memória compartilhada e retorna o nome dele.
+    attach(bank_id: int, currency: Optional[Currency], name: str, n: int, stripes: int = account_stripes) -> AccountStore:
+        Cria um store sobre o bloco compartilhado `name`, com `n` contas.
+    release(unlink: bool = False) -> None:
+        Desfaz o mapeamento da memória compartilhada (e a libera, se `unlink`).
+    """
+
+    def __init__(self, bank_id: int, currency: Optional[Currency],
+                 stripes: int = account_stripes):
+        self._bank_id = bank_id
+        self.currency = currency
+        self._balances = array('q')
+        self._limits = array('q')
+        name = f"bank{bank_id}.{'reserves' if currency is None else 'accounts'}"
+        self._locks = [make_lock(name) for _ in range(stripes)]
+        # serializa apenas a criação de contas
+        self._alloc_lock = make_lock(f"{name}.alloc")
+        # número de contas publicadas
+        self._published = 0
+        # bloco de memória compartilhada (None enquanto os arrays são locais)
+        self._shm: Optional[SharedMemory] = None
+        self._shm_view: Optional[memoryview] = None
+        self.journal = None
+        self.dirty: Optional[bytearray] = None
+
+    def __len__(self) -> int:
+        return self._published
+
+    def __getitem__(self, index: int) -> "Account":
+        published = self._published
+        if index < 0:
+            index += published
+        if not 0 <= index < published:
+            raise IndexError("account index out of range")
+        return Account(index, self._bank_id, self.currency, _store=self, _index=index)
+
+    def __iter__(self) -> Iterator["Account"]:
+        for index in range(self._published):
+            yield self[index]
+
+    def _check_resizable(self) -> None:
+        if self._shm is not None:
+            raise RuntimeError("a shared AccountStore has a fixed number of accounts")
+
+    def append(self, balance: int = 0, overdraft_limit: int = 0) -> int:
+        self._check_resizable()
+        with self._alloc_lock:
+            self._balances.append(balance)
+            self._limits.append(overdraft_limit)
+            index = len(self._balances) - 1
+            if self.journal is not None:
+                self.journal.account_created(self, index, balance, overdraft_limit)
+            if self.dirty is not None:
+                self._mark_dirty(index, index + 1)
+            self._published = index + 1
+        return index
+
+    def extend(self, balances: Sequence[int], overdraft_limits: Sequence[int]) -> range:
+        if len(balances) != len(overdraft_limits):
+            raise ValueError("balances and overdraft_limits must have the same length")
+        self._check_resizable()
+        with self._alloc_lock:
+            first = len(self._balances)
+            self._balances.extend(balances)
+            self._limits.extend(overdraft_limits)
+            if self.journal is not None:
+                for offset, (balance, limit) in enumerate(zip(balances, overdraft_limits)):
+                    self.journal.account_created(self, first + offset, balance, limit)
+            if self.dirty is not None:
+                self._mark_dirty(first, len(self._balances))
+            self._published = len(self._balances)
+        return range(first, first + len(balances))
+
+    def lock_for(self, index: int) -> Lock:
+        return self._locks[index % len(self._locks)]
+
+    def _mark_dirty(self, first: int, end: int) -> None:
+        # exige o mutex de alocação: o bitmap cresce junto com os arrays
+        last_page = (end - 1) >> dirty_page_bits
+        if last_page >= len(self.dirty):
+            self.dirty.extend(bytes(last_page + 1 - len(self.dirty)))
+        for page in range(first >> dirty_page_bits, last_page + 1):
+            self.dirty[page] = 1
+
+    def track_dirty_pages(self) -> None:
+        with self._alloc_lock:
+            pages = (len(self._balances) + (1 << dirty_page_bits) - 1) >> dirty_page_bits
+            self.dirty = bytearray(b"\x01" * pages)
+
+    def lock_order(self, index: int) -> Tuple[int, int, int]:
+        # id(self) desempata stores diferentes de um mesmo banco (ex.: reservas)
+        return (self._bank_id, index % len(self._locks), id(self))
+
+    def nbytes(self) -> int:
+        return (self._balances.itemsize * len(self._balances)
+                + self._limits.itemsize * len(self._limits))
+
+    def _map(self, shm: SharedMemory, n: int) -> None:
+        # layout do bloco: n saldos seguidos de n limites, inteiros de 64 bits
+        self._shm = shm
+        self._shm_view = shm.buf.cast('q')
+        self._balances = self._shm_view[:n]
+        self._limits = self._shm_view[n:2 * n]
+        self._published = n
+
+    def share(self) -> str:
+        """
+        Copia saldos e limites para um novo bloco de memória compartilhada e passa a usá-lo.
+        Retorna o nome do bloco, a ser passado para `attach` em outros processos.
+        """
+        with self._alloc_lock:
+            self._check_resizable()
+            balances, limits = self._balances, self._limits
+            n = len(balances)
+            self._map(SharedMemory(create=True, size=max(1, 2 * n) * balances.itemsize), n)
+            self._balances[:] = balances
+            self._limits[:] = limits
+            return self._shm.name
+
+    @classmethod
+    def attach(cls, bank_id: int, currency: Optional[Currency], name: str, n: int,
+               stripes: int = account_stripes) -> "AccountStore":
+        store = cls(bank_id, currency, stripes)
+        store._map(SharedMemory(name=name), n)
+        return store
+
+    def release(self, unlink: bool = False) -> None:
+        """
+        Desfaz o mapeamento da memória compartilhada; o store não pode mais ser usado.
+        Com `unlink`, o bloco também é liberado (apenas o processo que o criou deve fazê-lo).
+        """
+        if self._shm is None:
+            return
+        for view in (self._balances, self._limits, self._shm_view):
+            view.release()
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
 
 
-@dataclass
 class Account:
     """
     Uma classe para representar uma conta bancária.
     Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
+    Uma Account é uma visão sobre uma posição de um AccountStore; criada sem store, ela
+    aloca um store próprio de uma única conta (usado pelas reservas do banco).
 
     ...
 
@@ -33,11 +238,14 @@ class Account:
     currency : Currency
         Moeda corrente da conta bancária.
     balance : int
-        Saldo da conta bancária.
+        Saldo da conta bancária, em centavos (ver utils/money.py).
     overdraft_limit : int
-        Limite de cheque especial da conta bancária.
+        Limite de cheque especial da conta bancária, em centavos.
     lock : Lock
-        Mutex de acesso ao atributo 'balance'
+        Mutex de acesso ao atributo 'balance' (compartilhado com as outras contas da mesma
+        listra do AccountStore).
+    key : Tuple[int, int]
+        Identifica unicamente a posição da conta, mesmo entre visões diferentes.
 
     Métodos
     -------
@@ -47,81 +255,234 @@ class Account:
         Adiciona o valor `amount` ao saldo da conta bancária.
     withdraw(amount: int) -> None:
         Remove o valor `amount` do saldo da conta bancária.
+    _deposit(amount: int) -> bool:
+        Igual a `deposit`, mas exige que o chamador já possua o mutex da conta.
+    _withdraw(amount: int) -> bool:
+        Igual a `withdraw`, mas exige que o chamador já possua o mutex da conta.
     """
 
-    _id: int
-    _bank_id: int
-    currency: Currency
-    balance: int = 0
-    overdraft_limit: int = 0
-    lock = Lock()
+    __slots__ = ("_id", "_bank_id", "currency", "_store", "_index")
+
+    def __init__(self, _id: int, _bank_id: int, currency: Currency, balance: int = 0,
+                 overdraft_limit: int = 0, _store: Optional[AccountStore] = None,
+                 _index: int = 0):
+        self._id = _id
+        self._bank_id = _bank_id
+        self.currency = currency
+        if _store is None:
+            _store = AccountStore(_bank_id, currency, stripes=1)
+            _index = _store.append(balance, overdraft_limit)
+        self._store = _store
+        self._index = _index
+
+    @property
+    def balance(self) -> int:
+        return self._store._balances[self._index]
+
+    @balance.setter
+    def balance(self, value: int) -> None:
+        store = self._store
+        if store.journal is not None:
+            store.journal.balance_changed(store, self._index,
+                                          value - store._balances[self._index])
+        if store.dirty is not None:
+            store.dirty[self._index >> dirty_page_bits] = 1
+        store._balances[self._index] = value
+
+    @property
+    def overdraft_limit(self) -> int:
+        return self._store._limits[self._index]
+
+    @overdraft_limit.setter
+    def overdraft_limit(self, value: int) -> None:
+        store = self._store
+        if store.journal is not None:
+            store.journal.limit_changed(store, self._index, value)
+        if store.dirty is not None:
+            store.dirty[self._index >> dirty_page_bits] = 1
+        store._limits[self._index] = value
+
+    @property
+    def lock(self) -> Lock:
+        return self._store.lock_for(self._index)
+
+    @property
+    def key(self) -> Tuple[int, int]:
+        return (id(self._store), self._index)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Account):
+            return NotImplemented
+        return self.key == other.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __repr__(self) -> str:
+        return (f"Account(_id={self._id}, _bank_id={self._bank_id}, currency={self.currency}, "
+                f"balance={self.balance}, overdraft_limit={self.overdraft_limit})")
 
     def info(self) -> None:
         """
         Esse método printa informações gerais sobre a conta bancária.
         """
         # TODO: IMPLEMENTE AS MODIFICAÇÕES, SE NECESSÁRIAS, NESTE MÉTODO!
-        self.balance = int(self.balance)
-        self.overdraft_limit = int(self.overdraft_limit)
-
-        pretty_balance = f"{format(round(self.balance/100), ',d')}.{self.balance%100:02d} {self.currency.name}"
-        pretty_overdraft_limit = f"{format(round(self.overdraft_limit/100), ',d')}.{self.overdraft_limit%100:02d} {self.currency.name}"
+        pretty_balance = format_amount(self.balance, self.currency.name)
+        pretty_overdraft_limit = format_amount(
+            self.overdraft_limit, self.currency.name)
         LOGGER.info(
             f"Account::{{ _id={self._id}, _bank_id={self._bank_id}, balance={pretty_balance}, overdraft_limit={pretty_overdraft_limit} }}")
 
     def deposit(self, amount: int) -> bool:
         """
-        Esse método deverá adicionar o valor `amount` passado como argumento ao saldo da conta bancária 
-        (`balance`). Lembre-se que esse método pode ser chamado concorrentemente por múltiplos 
+        Esse método deverá adicionar o valor `amount` passado como argumento ao saldo da conta bancária
+        (`balance`). Lembre-se que esse método pode ser chamado concorrentemente por múltiplos
         PaymentProcessors, então modifique-o para garantir que não ocorram erros de concorrência!
         """
         # TODO: IMPLEMENTE AS MODIFICAÇÕES NECESSÁRIAS NESTE MÉTODO !
 
-        self.lock.acquire()
-        self.balance += amount
-        LOGGER.info(f"deposit({amount}) successful!")
-        self.lock.release()
+        with self.lock:
+            self._deposit(amount)
+        # o log é feito fora da seção crítica
+        LOGGER.info("deposit(%d) successful!", amount, extra=HOT)
         return True
 
     def withdraw(self, amount: int) -> bool:
         """
         Esse método deverá retirar o valor `amount` especificado do saldo da conta bancária (`balance`).
         Deverá ser retornado um valor bool indicando se foi possível ou não realizar a retirada.
-        Lembre-se que esse método pode ser chamado concorrentemente por múltiplos PaymentProcessors, 
+        Lembre-se que esse método pode ser chamado concorrentemente por múltiplos PaymentProcessors,
         então modifique-o para garantir que não ocorram erros de concorrência!
         """
         # TODO: IMPLEMENTE AS MODIFICAÇÕES NECESSÁRIAS NESTE MÉTODO !
 
-        self.lock.acquire()
+        with self.lock:
+            balance_before = self.balance
+            success = self._withdraw(amount)
+        # o log é feito fora da seção crítica
+        if not success:
+            LOGGER.warning("withdraw(%d) failed, no balance!", amount, extra=HOT)
+        elif balance_before >= amount:
+            LOGGER.info("withdraw(%d) successful!", amount, extra=HOT)
+        else:
+            LOGGER.info("withdraw(%d) successful with overdraft!", amount, extra=HOT)
+        return success
+
+    def _deposit(self, amount: int) -> bool:
+        """
+        Deposita `amount` na conta. O chamador deve possuir `self.lock`
+        (diretamente ou por meio de `lock_accounts`). Não loga: nenhum I/O é feito
+        com o mutex de uma conta adquirido.
+        """
+        self.balance += amount
+        return True
+
+    def _withdraw(self, amount: int) -> bool:
+        """
+        Retira `amount` da conta, usando o cheque especial se necessário.
+        O chamador deve possuir `self.lock` (diretamente ou por meio de `lock_accounts`).
+        Não loga: nenhum I/O é feito com o mutex de uma conta adquirido.
+        """
         if self.balance >= amount:
             self.balance -= amount
-            LOGGER.info(f"withdraw({amount}) successful!")
-            self.lock.release()
             return True
         else:
             overdrafted_amount = abs(self.balance - amount)
             if self.overdraft_limit >= overdrafted_amount:
                 self.balance -= amount
-                LOGGER.info(f"withdraw({amount}) successful with overdraft!")
-                self.lock.release()
                 return True
             else:
-                LOGGER.warning(f"withdraw({amount}) failed, no balance!")
-                self.lock.release()
                 return False
 
 
+@contextmanager
+def lock_accounts(*accounts: Account) -> Iterator[None]:
+    """
+    Adquire os mutexes de todas as contas passadas em uma ordem global determinística
+    (_bank_id, listra, store), evitando deadlocks entre PaymentProcessors que travam as
+    mesmas contas em ordens diferentes. A ordem é a dos mutexes, e não a das contas, pois
+    contas diferentes podem compartilhar a mesma listra; cada mutex é travado uma única vez.
+    """
+    locks = {}
+    for acc in accounts:
+        lock = acc.lock
+        if id(lock) not in locks:
+            locks[id(lock)] = (acc._store.lock_order(acc._index), lock)
+    ordered = [lock for _, lock in sorted(locks.values(), key=lambda item: item[0])]
+    LOCK_ACQUISITIONS.add(len(ordered))
+    acquired = []
+    # a espera só é medida com um benchmark ou o profiler ativo (ver utils/metrics.py)
+    timed = metrics.lock_timing
+    try:
+        if timed:
+            started = time.perf_counter_ns()
+        for lock in ordered:
+            lock.acquire()
+            acquired.append(lock)
+        if timed:
+            LOCK_WAIT_NS.add(time.perf_counter_ns() - started)
+        yield
+    finally:
+        for lock in reversed(acquired):
+            lock.release()
+
+
+@contextmanager
+def lock_stores(*stores: AccountStore) -> Iterator[None]:
+    """
+    Trava stores inteiros: primeiro os mutexes de alocação (nenhuma conta é criada) e depois
+    todas as listras, na mesma ordem global de `lock_accounts`. Com os mutexes adquiridos,
+    nenhum saldo dos stores muda, e eles podem ser copiados de forma consistente entre si.
+    """
+    stripes = sorted(((store._bank_id, stripe, id(store)), lock)
+                     for store in stores for stripe, lock in enumerate(store._locks))
+    ordered = [store._alloc_lock for store in stores] + [lock for _, lock in stripes]
+    acquired = []
+    try:
+        for lock in ordered:
+            lock.acquire()
+            acquired.append(lock)
+        yield
+    finally:
+        for lock in reversed(acquired):
+            lock.release()
+
+
 @dataclass
 class CurrencyReserves:
     """
     Uma classe de dados para armazenar as reservas do banco, que serão usadas
     para câmbio e transferências internacionais.
-    OBS: NÃO É PERMITIDO ALTERAR ESSA CLASSE!
+    Cada banco possui as suas próprias seis contas de reservas, guardadas em um
+    AccountStore com uma listra (mutex) por moeda: débitos em moedas diferentes não
+    competem entre si. `reserves[currency]` retorna a conta da moeda em O(1).
+    `store` é o AccountStore das seis contas; um store já existente (ex.: mapeado de
+    memória compartilhada) pode ser passado na construção.
     """
 
-    USD: Account = Account(_id=1, _bank_id=0, currency=Currency.USD)
-    EUR: Account = Account(_id=2, _bank_id=0, currency=Currency.EUR)
-    GBP: Account = Account(_id=3, _bank_id=0, currency=Currency.GBP)
-    JPY: Account = Account(_id=4, _bank_id=0, currency=Currency.JPY)
-    CHF: Account = Account(_id=5, _bank_id=0, currency=Currency.CHF)
-    BRL: Account = Account(_id=6, _bank_id=0, currency=Currency.BRL)
+    _bank_id: int = 0
+    _store: InitVar[Optional[AccountStore]] = None
+    USD: Account = field(init=False)
+    EUR: Account = field(init=False)
+    GBP: Account = field(init=False)
+    JPY: Account = field(init=False)
+    CHF: Account = field(init=False)
+    BRL: Account = field(init=False)
+
+    def __post_init__(self, _store: Optional[AccountStore]):
+        store = _store
+        if store is None:
+            store = AccountStore(self._bank_id, None, stripes=len(Currency))
+            store.extend([0] * len(Currency), [0] * len(Currency))
+        self.store = store
+        # a conta de reservas da moeda `c` tem _id c.value e ocupa a posição c.value - 1
+        self._accounts = tuple(Account(c.value, self._bank_id, c, _store=store, _index=c.value - 1)
+                               for c in Currency)
+        for account in self._accounts:
+            setattr(self, account.currency.name, account)
+
+    def __getitem__(self, currency: Currency) -> Account:
+        return self._accounts[currency.value - 1]
+
+    def __iter__(self) -> Iterator[Account]:
+        return iter(self._accounts)
@@ -0,0 +1,209 @@
+import asyncio
+from datetime import timedelta
+from random import randint
+from typing import Dict, List, Optional, Tuple
+
+from globals import *
+from payment_system.bank import Bank, queue_max_size
+from payment_system.payment_processor import dequeue_size
+from payment_system.settlement import settle_batch
+from payment_system.workloads import Workload, generator_rng, uniform
+from utils.clock import monotonic_ns
+from utils.currency import Currency
+from utils.logger import HOT, LOGGER
+from utils.transaction import Transaction
+
+# Motor assíncrono: em vez de uma thread por TransactionGenerator/PaymentProcessor, cada
+# ator é uma corrotina que espera a latência simulada com `asyncio.sleep`, todas em uma
+# única thread. Uma corrotina ocupa alguns KB (contra a pilha de uma thread do SO), então
+# milhares de processadores por banco cabem em um único processo.
+# As regras de negócio são as mesmas do modo com threads: as transações são `Transaction`
+# e a liquidação usa `settle_batch` sobre as mesmas contas. Os mutexes das contas nunca
+# são disputados (há uma única thread), mas continuam sendo adquiridos, de modo que o
+# mesmo banco pode ser usado por threads e corrotinas.
+# A fila de cada banco é uma asyncio.Queue com a mesma capacidade (queue_max_size).
+
+
+class AsyncEngine:
+    """
+    Executa a simulação com geradores e processadores de pagamentos como corrotinas.
+    Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
+
+    ...
+
+    Atributos
+    ---------
+    banks : List[Bank]
+        Bancos simulados (já abertos).
+    processors_per_bank : int
+        Número de corrotinas processadoras por banco.
+    batch_size : int
+        Número máximo de transações retiradas da fila a cada vez que um processador acorda
+        (ver `dequeue_size`).
+    batch_settlement : bool
+        Se True, cada bloco retirado da fila é liquidado de uma só vez.
+    time_unit : float
+        Valor da unidade de tempo de simulação, em segundos.
+    workload : Workload
+        Função que sorteia cada transferência (ver payment_system/workloads.py).
+    seed : Optional[int]
+        Semente dos geradores de transferências (None para não semear).
+
+    Métodos
+    -------
+    run(total_time: int, drain: Optional[float] = None) -> List[Tuple[int, int, timedelta]]:
+        Executa a simulação e retorna, por banco, as transações não processadas.
+    """
+
+    def __init__(self, banks: List[Bank], processors_per_bank: int = 3,
+                 batch_size: Optional[int] = None, batch_settlement: bool = False,
+                 time_unit: float = time_unit, workload: Workload = uniform,
+                 seed: Optional[int] = None):
+        self.banks = banks
+        self.processors_per_bank = processors_per_bank
+        self.batch_size = dequeue_size(batch_settlement, batch_size)
+        self.batch_settlement = batch_settlement
+        self.time_unit = time_unit
+        self.workload = workload
+        self.seed = seed
+        self._queues: Dict[int, asyncio.Queue] = {}
+        # transações retiradas da fila mas não liquidadas até o fechamento do banco
+        self._leftovers: Dict[int, List[Transaction]] = {}
+
+    def run(self, total_time: int,
+            drain: Optional[float] = None) -> List[Tuple[int, int, timedelta]]:
+        """
+        Executa a simulação por `total_time` unidades de tempo. Com `drain`, espera (no
+        máximo `drain` segundos) a liquidação das transações pendentes antes de fechar os
+        bancos. Retorna, para cada banco, (_id, transações não processadas, tempo médio
+        delas na fila).
+        """
+        return asyncio.run(self._main(total_time, drain))
+
+    async def _main(self, total_time: int,
+                    drain: Optional[float]) -> List[Tuple[int, int, timedelta]]:
+        for bank in self.banks:
+            self._queues[bank._id] = asyncio.Queue(queue_max_size)
+            self._leftovers[bank._id] = []
+        generators = [asyncio.create_task(self._generator(bank)) for bank in self.banks]
+        processors = [asyncio.create_task(self._processor(bank._id + k * len(self.banks), bank))
+                      for k in range(self.processors_per_bank) for bank in self.banks]
+        LOGGER.info(f"Motor assíncrono iniciado: {len(generators)} geradores e "
+                    f"{len(processors)} processadores")
+
+        await self._create_accounts(total_time)
+
+        # Finaliza todas as corrotinas, na mesma ordem do modo com threads
+        for bank in self.banks:
+            bank.stop_accepting()
+        for task in generators:
+            task.cancel()
+        await asyncio.gather(*generators, return_exceptions=True)
+
+        if drain is not None:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(queue.join() for queue in self._queues.values())), drain)
+            except asyncio.TimeoutError:
+                LOGGER.warning("Nem todas as transações foram liquidadas dentro do prazo de drain")
+
+        for bank in self.banks:
+            bank.close()
+        for task in processors:
+            task.cancel()
+        await asyncio.gather(*processors, return_exceptions=True)
+        LOGGER.info("Motor assíncrono finalizado.")
+
+        result = []
+        for bank in self.banks:
+            pending = self._leftovers[bank._id]
+            queue = self._queues[bank._id]
+            while not queue.empty():
+                pending.append(queue.get_nowait())
+            result.append((bank._id, *Bank.pending_stats(pending)))
+        return result
+
+    async def _create_accounts(self, total_time: int) -> None:
+        # equivalente ao laço principal de main.py: uma conta nova por banco a cada ciclo
+        t = 0
+        while t < total_time:
+            dt = randint(0, 3)
+            await asyncio.sleep(dt * self.time_unit)
+            for bank in self.banks:
+                balance = randint(10000, 100000)
+                bank.new_account(balance, balance)
+            t += dt
+
+    async def _generator(self, bank: Bank) -> None:
+        LOGGER.info(f"Inicializado TransactionGenerator para o Banco Nacional {bank._id}!")
+        queue = self._queues[bank._id]
+        rng = generator_rng(self.seed, bank._id)
+        i = 0
+        try:
+            while bank.operating and bank.accepting:
+                origin, destination, amount = self.workload(rng, bank)
+                transaction = Transaction(
+                    i, origin, destination, amount, currency=Currency(destination[0] + 1))
+                transaction.enqueued_ns = monotonic_ns()
+                await queue.put(transaction)
+                i += 1
+                await asyncio.sleep(0.2 * self.time_unit)
+        except asyncio.CancelledError:
+            pass
+        LOGGER.info(f"O TransactionGenerator {bank._id} do banco {bank._id} foi finalizado.")
+
+    async def _next_batch(self, queue: asyncio.Queue) -> List[Transaction]:
+        batch = [await queue.get()]
+        while len(batch) < self.batch_size and not queue.empty():
+            batch.append(queue.get_nowait())
+        dequeued_ns = monotonic_ns()
+        for transaction in batch:
+            transaction.dequeued_ns = dequeued_ns
+        return batch
+
+    async def _processor(self, _id: int, bank: Bank) -> None:
+        queue = self._queues[bank._id]
+        unfinished: List[Transaction] = []
+        try:
+            while bank.operating:
+                unfinished = await self._next_batch(queue)
+                if self.batch_settlement:
+                    LOGGER.info("PaymentProcessor %d do Banco %d iniciando processamento de %d Transactions!",
+                                _id, bank._id, len(unfinished), extra=HOT)
+                    started_ns = monotonic_ns()
+                    for transaction in unfinished:
+                        transaction.started_ns = started_ns
+                    # latência simulada, uma vez por bloco
+                    await asyncio.sleep(3 * self.time_unit)
+                    if not bank.operating:
+                        break
+                    batch, unfinished = unfinished, []
+                    self._settle(bank, batch)
+                    continue
+                while unfinished:
+                    transaction = unfinished[0]
+                    LOGGER.info("PaymentProcessor %d do Banco %d iniciando processamento da Transaction %d!",
+                                _id, bank._id, transaction._id, extra=HOT)
+                    transaction.started_ns = monotonic_ns()
+                    # latência simulada, uma vez por transação
+                    await asyncio.sleep(3 * self.time_unit)
+                    if not bank.operating:
+                        break
+                    unfinished = unfinished[1:]
+                    self._settle(bank, [transaction])
+        except asyncio.CancelledError:
+            pass
+        self._leftovers[bank._id].extend(unfinished)
+
+    def _settle(self, bank: Bank, batch: List[Transaction]) -> None:
+        queue = self._queues[bank._id]
+        try:
+            statuses = settle_batch(batch)
+        except Exception as err:
+            LOGGER.error(f"Falha em AsyncEngine._processor(): {err}")
+        else:
+            for transaction, status in zip(batch, statuses):
+                LOGGER.info("Transaction %d, status: %s", transaction._id, status, extra=HOT)
+                bank.record_completion(transaction)
+        for _ in batch:
+            queue.task_done()
@@ -0,0 +1,202 @@
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from payment_system.bank import Bank
+from payment_system.payment_processor import PaymentProcessor, processing_time_units
+from utils import clock
+from utils.clock import ActorThread
+from utils.lockprof import make_lock
+from utils.logger import LOGGER
+from utils.metrics import Sample
+
+if TYPE_CHECKING:
+    from payment_system.international import InternationalPipeline
+
+# Intervalo (em segundos) entre duas avaliações do Autoscaler
+autoscale_interval = 0.5
+
+# Espera máxima (em segundos) de um processador na fila antes de verificar se foi aposentado
+autoscale_poll_timeout = 0.1
+
+# Alvo padrão do p99 da espera na fila, em tempos de processamento de uma transação
+autoscale_target_services = 2
+
+
+def default_target_latency(time_unit: float) -> float:
+    """
+    Alvo padrão do p99 da espera na fila: `autoscale_target_services` vezes o tempo de
+    processamento de uma transação.
+    """
+    return autoscale_target_services * processing_time_units * time_unit
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class Autoscaler(ActorThread):
+    """
+    Controlador que ajusta o número de PaymentProcessors de cada banco em tempo de execução.
+    A cada `interval` segundos, para cada banco, observa a profundidade da fila de transações
+    e o p99 da espera na fila (entrada -> retirada) das transações retiradas na última
+    janela de tempo (ver `Bank.recent_queue_waits`), que não inclui a latência simulada
+    do processamento e esquece rajadas antigas:
+      * se há transações na fila e o p99 passa de `target_latency`, ou a fila tem mais de
+        um bloco pendente por processador, adiciona um processador (até `max_workers`);
+      * se a fila está vazia e o p99 está abaixo de metade do alvo, aposenta um
+        processador (até `min_workers`).
+    Cada decisão é registrada e exposta por `metrics()` e, como amostras para o registro de
+    métricas (utils/metrics.py, `register_collector`), por `samples()`.
+    Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
+
+    ...
+
+    Atributos
+    ---------
+    banks : List[Bank]
+        Bancos controlados.
+    min_workers : int
+        Número mínimo de processadores por banco.
+    max_workers : int
+        Número máximo de processadores por banco.
+    target_latency : float
+        p99 alvo da espera na fila, em segundos (ver `default_target_latency`).
+    decisions : List[Dict]
+        Histórico das decisões de escala (momento, banco, ação, processadores, fila, p99
+        da espera na fila).
+
+    Métodos
+    -------
+    run():
+        Inicia os processadores mínimos e avalia os bancos periodicamente até `stop()`.
+    stop() -> None:
+        Encerra o controlador (os processadores continuam até o banco fechar).
+    workers() -> List[PaymentProcessor]:
+        Todos os processadores criados pelo controlador, inclusive os aposentados.
+    metrics() -> Dict[int, Dict]:
+        Estado atual e contadores de decisões por banco.
+    samples() -> List[Sample]:
+        As mesmas métricas de `metrics()`, como amostras do registro de métricas.
+    """
+
+    def __init__(self, banks: List[Bank], min_workers: int, max_workers: int,
+                 target_latency: float, interval: float = autoscale_interval,
+                 batch_settlement: bool = False,
+                 pipeline: Optional["InternationalPipeline"] = None,
+                 netting_size: int = 0, netting_window: float = 0.0,
+                 reserve_cache: bool = False):
+        ActorThread.__init__(self, name="Autoscaler")
+        self.banks = banks
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_latency = target_latency
+        self.interval = interval
+        self.batch_settlement = batch_settlement
+        self.pipeline = pipeline
+        self.netting_size = netting_size
+        self.netting_window = netting_window
+        self.reserve_cache = reserve_cache
+        self.decisions = []
+        self._stopped = False
+        self._stop_cond = clock.condition(make_lock("autoscaler.stop"))
+        self._lock = make_lock("autoscaler")
+        self._active = {bank._id: [] for bank in banks}
+        self._all = []
+        self._counters = {bank._id: {"scale_up": 0, "scale_down": 0} for bank in banks}
+        for bank in banks:
+            for _ in range(min_workers):
+                self._add_worker(bank)
+
+    def _add_worker(self, bank: Bank) -> None:
+        with self._lock:
+            worker = PaymentProcessor(_id=len(self._all), bank=bank,
+                                      batch_settlement=self.batch_settlement,
+                                      poll_timeout=autoscale_poll_timeout,
+                                      pipeline=self.pipeline,
+                                      netting_size=self.netting_size,
+                                      netting_window=self.netting_window,
+                                      reserve_cache=self.reserve_cache)
+            self._active[bank._id].append(worker)
+            self._all.append(worker)
+        if self.is_alive():
+            worker.start()
+
+    def run(self):
+        LOGGER.info(
+            f"Autoscaler iniciado: {self.min_workers}..{self.max_workers} processadores por banco")
+        for worker in self.workers():
+            worker.start()
+        while not self._wait_stop(self.interval):
+            for bank in self.banks:
+                if bank.operating:
+                    self._scale(bank)
+        LOGGER.info("Autoscaler finalizado.")
+
+    def _wait_stop(self, timeout: float) -> bool:
+        with self._stop_cond:
+            if not self._stopped:
+                self._stop_cond.wait(timeout)
+            return self._stopped
+
+    def _scale(self, bank: Bank) -> None:
+        active = self._active[bank._id]
+        active[:] = [worker for worker in active if worker.is_alive()]
+        n = len(active)
+        depth = bank.transaction_queue.qsize()
+        p99 = _percentile(bank.recent_queue_waits(), 99)
+        batch_size = active[0].batch_size if active else 1
+
+        action = None
+        if n < self.max_workers and depth > 0 and (p99 > self.target_latency
+                                                   or depth > n * batch_size):
+            self._add_worker(bank)
+            action = "scale_up"
+        elif n > self.min_workers and depth == 0 and p99 < self.target_latency / 2:
+            active.pop().retire()
+            action = "scale_down"
+        if action is None:
+            return
+
+        self._counters[bank._id][action] += 1
+        workers = len(active)
+        self.decisions.append({"time": clock.now().timestamp(), "bank": bank._id, "action": action,
+                               "workers": workers, "queue_depth": depth, "p99_queue_wait": p99})
+        LOGGER.info(
+            f"Autoscaler: banco {bank._id} {action} -> {workers} processadores "
+            f"(fila={depth}, p99 da espera={p99:.3f}s)")
+
+    def stop(self) -> None:
+        with self._stop_cond:
+            self._stopped = True
+            self._stop_cond.notify_all()
+
+    def workers(self) -> List[PaymentProcessor]:
+        with self._lock:
+            return list(self._all)
+
+    def metrics(self) -> Dict[int, Dict]:
+        result = {}
+        for bank in self.banks:
+            result[bank._id] = {
+                "workers": sum(worker.is_alive() for worker in list(self._active[bank._id])),
+                "queue_depth": bank.transaction_queue.qsize(),
+                "p99_queue_wait": _percentile(bank.recent_queue_waits(), 99),
+                **self._counters[bank._id],
+            }
+        return result
+
+    def samples(self) -> List[Sample]:
+        samples = [("payment_autoscaler_target_queue_wait_seconds", {}, self.target_latency),
+                   ("payment_autoscaler_min_workers", {}, self.min_workers),
+                   ("payment_autoscaler_max_workers", {}, self.max_workers)]
+        for bank_id, metrics in self.metrics().items():
+            bank = str(bank_id)
+            samples.append(("payment_autoscaler_workers", {"bank": bank}, metrics["workers"]))
+            samples.append(("payment_autoscaler_p99_queue_wait_seconds", {"bank": bank},
+                            metrics["p99_queue_wait"]))
+            for action in ("scale_up", "scale_down"):
+                samples.append(("payment_autoscaler_decisions_total",
+                                {"bank": bank, "action": action}, metrics[action]))
+        return samples
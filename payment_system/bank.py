@@ -1,15 +1,37 @@
-from typing import Tuple
-from queue import Queue
-from threading import Lock, Semaphore
-from datetime import datetime, timedelta
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from datetime import timedelta
 
-from payment_system.account import Account, CurrencyReserves
-from utils.transaction import Transaction
+from payment_system.account import AccountStore, CurrencyReserves
+from utils.bounded_queue import BoundedQueue
+from utils.histogram import Histogram
+from utils.metrics import Counter, Sample
+from utils.money import EXCHANGE_FEE_BP, fee
+from utils.transaction import Transaction, TransactionStatus
 from utils.currency import Currency
 from utils.logger import LOGGER
+from utils import clock
 
 queue_max_size = 50
 
+# Janela (em segundos, no relógio da simulação) das esperas na fila recentes de cada banco
+queue_wait_window = 1.0
+
+# Número máximo de esperas na fila guardadas na janela
+queue_wait_window_size = 4096
+
+# Etapas da latência de uma transação, cada uma com um histograma por banco:
+#   queue: entrada na fila -> retirada da fila;
+#   wait: retirada da fila -> início do processamento (espera atrás do resto do bloco);
+#   processing: início do processamento -> finalização (latência simulada e liquidação);
+#   total: criação -> finalização.
+latency_stages = ("queue", "wait", "processing", "total")
+
+# Contadores das transferências concluídas de cada banco (as taxas em centavos da moeda
+# do banco)
+transfer_counters = ("national_successful", "national_failed", "international_successful",
+                     "international_failed", "overdraft_fees", "exchange_fees")
+
 
 class Bank():
     """
@@ -25,101 +47,317 @@ class Bank():
     currency : Currency
         Moeda corrente das contas bancárias do banco.
     reserves : CurrencyReserves
-        Dataclass de contas bancárias contendo as reservas internas do banco.
+        Dataclass de contas bancárias contendo as reservas internas do banco (exclusivas
+        deste banco). `reserves[currency]` retorna a conta de reservas da moeda.
     operating : bool
         Booleano que indica se o banco está em funcionamento ou não.
-    accounts : List[Account]
-        Lista contendo as contas bancárias dos clientes do banco.
-    transaction_queue : Queue[Transaction]
-        Fila FIFO contendo as transações bancárias pendentes que ainda serão processadas.
-    queue_lock : Lock()
-        Mutex utilizado para inserção/remoção de elementos da fila de transações
-    queue_sem_prod : Semaphore()
-        Semaforo utilizado pelo transaction_generator para adicionar mais transações na fila
-    queue_sem_cons : Semaphore()
-        Semaforo utilizado pelo payment_processor para retirar transações da fila
+    accepting : bool
+        Booleano que indica se o banco ainda aceita novas transações.
+    accounts : AccountStore
+        Contas bancárias dos clientes do banco, armazenadas em arrays compactos.
+        `accounts[i]` retorna uma visão Account da conta de _id `i`.
+    transaction_queue : BoundedQueue[Transaction]
+        Fila FIFO limitada (queue_max_size) contendo as transações bancárias pendentes que
+        ainda serão processadas. Um único mutex protege a fila; produtores bloqueiam quando
+        ela está cheia e consumidores quando está vazia.
+    recent_waits : deque
+        (instante da retirada, espera na fila) em ns das transações retiradas mais
+        recentemente da fila (ver `recent_queue_waits`).
+    latency : Dict[str, Histogram]
+        Histograma (em nanossegundos) de cada etapa de `latency_stages` das transações
+        concluídas.
+    stats : Dict[str, Counter]
+        Contadores de `transfer_counters` das transações concluídas.
+    processors : List[PaymentProcessor]
+        PaymentProcessors criados para este banco (inclusive os já encerrados).
+    remote_inbox : Optional[multiprocessing.Queue]
+        No modo de processos, fila de entrada do processo dono deste banco, quando ele
+        pertence a outro processo (None quando o banco é local).
 
     Métodos
     -------
-    open_bank() -> None:
+    open() -> None:
         Inicia o banco: seta o atributo 'operating' para True
+    stop_accepting() -> None:
+        Para de aceitar novas transações na fila
+    drain(timeout: Optional[float] = None) -> bool:
+        Espera a liquidação de todas as transações já aceitas
+    close() -> None:
+        Fecha o banco: seta o atributo 'operating' para False e acorda todas as threads
+    open_bank() -> None:
+        Equivalente a `open()`
     close_bank() -> None:
-        Fecha o banco: seta o atributo 'operating' para False
-    transaction_queue_put() -> Transaction:
+        Equivalente a `stop_accepting()` seguido de `close()`
+    transaction_done(n: int = 1) -> None:
+        Confirma a liquidação de transações retiradas da fila
+    record_completion(transaction: Transaction) -> None:
+        Registra a latência de uma transação concluída em `latency`
+    recent_queue_waits(window: float = queue_wait_window) -> List[float]:
+        Esperas na fila (em segundos) das transações retiradas nos últimos `window` segundos
+    latency_report() -> None:
+        Printa os percentis p50/p99/p999 de cada etapa da latência
+    utilization() -> float:
+        Fração do tempo de vida dos processadores do banco gasta processando transações
+    metrics() -> List[Sample]:
+        Amostras das métricas do banco (ver utils/metrics.py)
+    transaction_queue_put(transaction: Transaction) -> bool:
         Insere uma transação na fila de transações
-    transaction_queue_get() -> Transaction:
+    transaction_queue_put_batch(transactions: Iterable[Transaction], timeout: Optional[float] = None) -> int:
+        Insere várias transações na fila de transações
+    transaction_queue_get() -> Optional[Transaction]:
         Retira e retorna o primeiro elemento da fila de transações
-    new_account(balance: int = 0, overdraft_limit: int = 0) -> None:
-        Cria uma nova conta bancária (Account) no banco.
+    transaction_queue_get_batch(max_n: int, timeout: Optional[float] = None) -> List[Transaction]:
+        Retira e retorna até `max_n` transações da fila de transações
+    transaction_queue_return(transactions: List[Transaction]) -> None:
+        Devolve ao início da fila transações retiradas mas não processadas
+    new_account(balance: int = 0, overdraft_limit: int = 0) -> int:
+        Cria uma nova conta bancária (Account) no banco e retorna o seu _id.
+    new_accounts(n: int, balances: Optional[Sequence[int]] = None, overdraft_limits: Optional[Sequence[int]] = None) -> range:
+        Cria `n` contas bancárias de uma só vez e retorna o intervalo de _ids criados.
     new_transfer(origin: Tuple[int, int], destination: Tuple[int, int], amount: int, currency: Currency) -> None:
         Cria uma nova transação bancária.
     info() -> None:
         Printa informações e estatísticas sobre o funcionamento do banco.
+    info_transaction_incompleted() -> Tuple[int, timedelta]:
+        Descarta as transações pendentes na fila e retorna `pending_stats` delas.
+    pending_stats(pending: Sequence[Transaction]) -> Tuple[int, timedelta]:
+        Número de transações não processadas e tempo médio de espera delas.
 
     """
 
     def __init__(self, _id: int, currency: Currency):
         self._id = _id
         self.currency = currency
-        self.reserves = CurrencyReserves()
+        self.reserves = CurrencyReserves(_id)
         self.operating = False
-        self.accounts = []
-        self.transaction_queue = Queue()  # Alterada lista pela fila
-        self.queue_lock = Lock()
-        self.queue_sem_prod = Semaphore(queue_max_size)
-        self.queue_sem_cons = Semaphore(0)
+        self.accounts = AccountStore(self._id, currency)
+        self.transaction_queue = BoundedQueue(queue_max_size, name=f"bank{_id}.queue")
+        self.recent_waits = deque(maxlen=queue_wait_window_size)
+        self.latency: Dict[str, Histogram] = {stage: Histogram() for stage in latency_stages}
+        self.stats: Dict[str, Counter] = {name: Counter() for name in transfer_counters}
+        self.processors = []
+        self.remote_inbox = None
 
-    def open_bank(self) -> None:
+    @property
+    def accepting(self) -> bool:
         """
-        Esse método seta o atributo 'operating' para True
+        Indica se o banco ainda aceita novas transações na fila.
         """
-        print("Abrindo banco", self._id)  # print de teste
+        return self.transaction_queue.accepting
+
+    def open(self) -> None:
+        """
+        Abre o banco: passa a aceitar e processar transações.
+        """
+        LOGGER.info(f"Abrindo banco {self._id}")
         self.operating = True
 
-    def close_bank(self) -> None:
+    def stop_accepting(self) -> None:
+        """
+        Para de aceitar novas transações. Os TransactionGenerators bloqueados na fila são
+        acordados e encerram; os PaymentProcessors continuam consumindo o que já está na
+        fila e encerram quando ela esvaziar.
+        """
+        self.transaction_queue.stop_accepting()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera (no máximo `timeout` segundos) que todas as transações já aceitas sejam
+        liquidadas. Deve ser chamado depois de `stop_accepting`. Retorna True se a fila
+        foi totalmente liquidada.
         """
-        Esse método seta o atributo 'operating' para False
+        return self.transaction_queue.join(timeout)
+
+    def close(self) -> None:
+        """
+        Fecha o banco: nenhuma transação é processada depois disso. Todas as threads
+        bloqueadas na fila são acordadas e as transações restantes ficam na fila, sendo
+        contabilizadas como não processadas.
         """
-        self.queue_sem_prod.release(2)
-        print("Encerrando banco", self._id)  # print de teste
+        LOGGER.info(f"Encerrando banco {self._id}")
         self.operating = False
+        self.transaction_queue.close()
 
-    def transaction_queue_put(self, transaction: Transaction) -> None:
+    def open_bank(self) -> None:
         """
-        Esse método insere uma transição na fila de transações
+        Esse método seta o atributo 'operating' para True (equivalente a `open`).
         """
-        self.queue_lock.acquire()
-        self.transaction_queue.put(transaction)
-        self.queue_lock.release()
+        self.open()
 
-    def transaction_queue_get(self) -> Transaction:
+    def close_bank(self) -> None:
         """
-        Esse método retira e retorna o primeiro elemento da fila de transações
+        Esse método seta o atributo 'operating' para False (equivalente a `stop_accepting`
+        seguido de `close`).
         """
-        self.queue_lock.acquire()
-        transaction = self.transaction_queue.get()
-        self.queue_lock.release()
-        return transaction
+        self.stop_accepting()
+        self.close()
 
-    def new_account(self, balance: int = 0, overdraft_limit: int = 0) -> None:
+    def transaction_done(self, n: int = 1) -> None:
         """
-        Esse método deverá criar uma nova conta bancária (Account) no banco com determinado
-        saldo (balance) e limite de cheque especial (overdraft_limit).
+        Confirma que `n` transações retiradas da fila foram liquidadas (ver `drain`).
+        """
+        self.transaction_queue.task_done(n)
+
+    def record_completion(self, transaction: Transaction) -> None:
+        """
+        Registra a latência (created_at -> completed_at) de uma transação concluída e a
+        duração de cada etapa dela nos histogramas (etapas sem as duas marcas são ignoradas).
+        """
+        marks = (("queue", transaction.enqueued_ns, transaction.dequeued_ns),
+                 ("wait", transaction.dequeued_ns, transaction.started_ns),
+                 ("processing", transaction.started_ns, transaction.completed_ns),
+                 ("total", transaction.created_ns, transaction.completed_ns))
+        for stage, begin, end in marks:
+            if begin and end:
+                self.latency[stage].record(end - begin)
+
+        # taxas cobradas: o câmbio só em internacionais e o cheque especial no restante (as
+        # transações que falharam não pagam taxas)
+        international = transaction.origin[0] != transaction.destination[0]
+        successful = transaction.status == TransactionStatus.SUCCESSFUL
+        scope = "international" if international else "national"
+        self.stats[f"{scope}_{'successful' if successful else 'failed'}"].add()
+        if successful and transaction.taxes:
+            exchange_fee = fee(transaction.amount, EXCHANGE_FEE_BP) if international else 0
+            if exchange_fee:
+                self.stats["exchange_fees"].add(exchange_fee)
+            if transaction.taxes > exchange_fee:
+                self.stats["overdraft_fees"].add(transaction.taxes - exchange_fee)
+
+    def latency_report(self) -> None:
+        """
+        Printa os percentis p50/p99/p999 (em milissegundos) de cada etapa da latência.
+        """
+        for stage in latency_stages:
+            histogram = self.latency[stage]
+            p = histogram.percentiles((50, 99, 99.9))
+            LOGGER.info(f"Banco {self._id}: latência {stage} ({histogram.count()} transações): "
+                        f"p50={p[50] / 1e6:.3f}ms p99={p[99] / 1e6:.3f}ms "
+                        f"p999={p[99.9] / 1e6:.3f}ms")
+
+    def utilization(self) -> float:
         """
-        # TODO: IMPLEMENTE AS MODIFICAÇÕES, SE NECESSÁRIAS, NESTE MÉTODO!
+        Retorna a fração do tempo de vida dos processadores deste banco gasta processando
+        transações (0 se nenhum processador rodou).
+        """
+        busy = alive = 0
+        for processor in list(self.processors):
+            busy += processor.busy_ns
+            alive += processor.alive_ns()
+        return busy / alive if alive else 0.0
+
+    def metrics(self) -> List[Sample]:
+        """
+        Retorna as amostras das métricas do banco: transferências por escopo e status,
+        receita de taxas, saldos das reservas e das contas, fila e processadores.
+        """
+        bank = str(self._id)
+        samples = []
+        for scope in ("national", "international"):
+            for status in ("successful", "failed"):
+                samples.append(("payment_transfers_total",
+                                {"bank": bank, "scope": scope, "status": status},
+                                self.stats[f"{scope}_{status}"].value()))
+        for kind in ("overdraft", "exchange"):
+            samples.append(("payment_fee_revenue_total", {"bank": bank, "kind": kind},
+                            self.stats[f"{kind}_fees"].value()))
+        for reserve in self.reserves:
+            samples.append(("payment_reserve_balance",
+                            {"bank": bank, "currency": reserve.currency.name}, reserve.balance))
+        samples.append(("payment_accounts", {"bank": bank}, len(self.accounts)))
+        samples.append(("payment_accounts_balance", {"bank": bank},
+                        sum(self.accounts._balances)))
+        samples.append(("payment_queue_depth", {"bank": bank}, self.transaction_queue.qsize()))
+        samples.append(("payment_processors_running", {"bank": bank},
+                        sum(processor.is_alive() for processor in list(self.processors))))
+        samples.append(("payment_processor_utilization", {"bank": bank}, self.utilization()))
+        return samples
+
+    def transaction_queue_put(self, transaction: Transaction) -> bool:
+        """
+        Esse método insere uma transição na fila de transações, bloqueando enquanto ela
+        estiver cheia. Retorna False caso o banco tenha sido fechado.
+        """
+        transaction.enqueued_ns = clock.monotonic_ns()
+        return self.transaction_queue.put(transaction)
+
+    def transaction_queue_put_batch(self, transactions: Iterable[Transaction],
+                                    timeout: Optional[float] = None) -> int:
+        """
+        Esse método insere várias transações na fila de transações, na ordem dada, com uma
+        única aquisição do mutex da fila por bloco de espaço livre.
+        Retorna a quantidade de transações inseridas.
+        """
+        transactions = list(transactions)
+        enqueued_ns = clock.monotonic_ns()
+        for transaction in transactions:
+            transaction.enqueued_ns = enqueued_ns
+        return self.transaction_queue.put_many(transactions, timeout)
+
+    def transaction_queue_get(self) -> Optional[Transaction]:
+        """
+        Esse método retira e retorna o primeiro elemento da fila de transações.
+        Retorna None caso o banco tenha sido fechado.
+        """
+        batch = self.transaction_queue_get_batch(1)
+        return batch[0] if batch else None
+
+    def transaction_queue_get_batch(self, max_n: int,
+                                    timeout: Optional[float] = None) -> List[Transaction]:
+        """
+        Esse método retira e retorna até `max_n` transações da fila de transações, bloqueando
+        (no máximo `timeout` segundos) enquanto a fila estiver vazia. Retorna uma lista vazia
+        caso o banco tenha sido fechado ou o timeout tenha expirado.
+        """
+        batch = self.transaction_queue.get_many(max_n, timeout)
+        dequeued_ns = clock.monotonic_ns()
+        for transaction in batch:
+            transaction.dequeued_ns = dequeued_ns
+            if transaction.enqueued_ns:
+                self.recent_waits.append((dequeued_ns, dequeued_ns - transaction.enqueued_ns))
+        return batch
 
-        # Gera _id para a nova Account
-        acc_id = len(self.accounts)
+    def recent_queue_waits(self, window: float = queue_wait_window) -> List[float]:
+        """
+        Retorna as esperas na fila (da entrada à retirada, em segundos) das transações
+        retiradas nos últimos `window` segundos do relógio da simulação.
+        """
+        since = clock.monotonic_ns() - int(window * 1e9)
+        return [wait / 1e9 for dequeued_ns, wait in list(self.recent_waits)
+                if dequeued_ns >= since]
 
-        # Cria instância da classe Account
-        acc = Account(_id=acc_id, _bank_id=self._id, currency=self.currency,
-                      balance=balance, overdraft_limit=overdraft_limit)
+    def transaction_queue_return(self, transactions: List[Transaction]) -> None:
+        """
+        Esse método devolve ao início da fila transações que foram retiradas mas não chegaram
+        a ser processadas (ex.: o banco fechou no meio de um lote), para que continuem sendo
+        contabilizadas como pendentes.
+        """
+        self.transaction_queue.unget(transactions)
 
-        # LOGGER.info(f"Conta criada no banco {self._id}")
-        # acc.info()
+    def new_account(self, balance: int = 0, overdraft_limit: int = 0) -> int:
+        """
+        Esse método deverá criar uma nova conta bancária (Account) no banco com determinado
+        saldo (balance) e limite de cheque especial (overdraft_limit).
+        Pode ser chamado concorrentemente com geradores e processadores: o _id é alocado
+        atomicamente pelo AccountStore e retornado.
+        """
+        return self.accounts.append(balance, overdraft_limit)
 
-        # Adiciona a Account criada na lista de contas do banco
-        self.accounts.append(acc)
+    def new_accounts(self, n: int, balances: Optional[Sequence[int]] = None,
+                     overdraft_limits: Optional[Sequence[int]] = None) -> range:
+        """
+        Cria `n` contas bancárias com uma única alocação de _ids. Saldos e limites não
+        informados são zero. Retorna o intervalo de _ids das contas criadas.
+        """
+        if balances is None:
+            balances = [0] * n
+        if overdraft_limits is None:
+            overdraft_limits = [0] * n
+        if len(balances) != n:
+            raise ValueError("len(balances) must be n")
+        if len(overdraft_limits) != n:
+            raise ValueError("len(overdraft_limits) must be n")
+        return self.accounts.extend(balances, overdraft_limits)
 
     def info(self) -> None:
         """
@@ -130,22 +368,40 @@ class Bank():
         4. Saldo total de todas as contas bancárias (dos clientes) registradas no banco
         5. Lucro do banco: taxas de câmbio acumuladas + juros de cheque especial acumulados
         """
-        # TODO: IMPLEMENTE AS MODIFICAÇÕES, SE NECESSÁRIAS, NESTE MÉTODO!
-
+        stats = {name: counter.value() for name, counter in self.stats.items()}
+        reserves = ", ".join(f"{reserve.currency.name}={reserve.balance}"
+                             for reserve in self.reserves)
         LOGGER.info(f"Estatísticas do Banco Nacional {self._id}:")
-        LOGGER.info(f"...")
+        LOGGER.info(f"  Reservas internas (centavos): {reserves}")
+        LOGGER.info(f"  Transferências nacionais: {stats['national_successful']} concluídas, "
+                    f"{stats['national_failed']} com falha")
+        LOGGER.info(f"  Transferências internacionais: {stats['international_successful']} "
+                    f"concluídas, {stats['international_failed']} com falha")
+        LOGGER.info(f"  Contas registradas: {len(self.accounts)}")
+        LOGGER.info(f"  Saldo total das contas: {sum(self.accounts._balances)} centavos")
+        LOGGER.info(f"  Lucro: {stats['exchange_fees'] + stats['overdraft_fees']} centavos "
+                    f"({stats['exchange_fees']} de câmbio + {stats['overdraft_fees']} "
+                    f"de cheque especial)")
 
     def info_transaction_incompleted(self):
-        len_queue = self.transaction_queue.qsize()
+        pending = self.transaction_queue.drain()
+        return self.pending_stats(pending)
+
+    @staticmethod
+    def pending_stats(pending: Sequence[Transaction]) -> Tuple[int, timedelta]:
+        """
+        Retorna o número de transações não processadas em `pending` e o tempo médio que
+        elas esperaram desde a criação.
+        """
+        len_queue = len(pending)
         # LOGGER.info(
         #     f"Transações na fila que não foram processadas: {len_queue}")
-        current_time = datetime.now()
+        current_time = clock.now()
         time_sum = timedelta()
-        while (not self.transaction_queue.empty()):
-            transaction = self.transaction_queue.get()
+        for transaction in pending:
             time_waiting = current_time - transaction.created_at
             time_sum += time_waiting
-        media = 0
+        media = timedelta()
         if (len_queue):
             media = time_sum/len_queue
         # else:
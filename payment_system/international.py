@@ -0,0 +1,303 @@
+from typing import Callable, Dict, List, Optional
+
+from globals import *
+from payment_system import journal
+from payment_system.account import Account, lock_accounts
+from payment_system.bank import queue_max_size
+from payment_system.payment_processor import processor_batch_size
+from payment_system.settlement import (Ledger, credit_destination, debit_origin,
+                                       destination_accounts, exchange, fx_accounts,
+                                       origin_accounts, refund_exchange, refund_origin)
+from utils.bounded_queue import BoundedQueue
+from utils import clock
+from utils.clock import ActorThread
+from utils.lockprof import make_lock
+from utils.logger import HOT, LOGGER
+from utils.transaction import Transaction, TransactionStatus
+
+# Pipeline de transferências internacionais.
+#
+# Uma transferência internacional é liquidada em três etapas, cada uma com a sua fila e o
+# seu conjunto de workers, e cada uma travando apenas as contas que usa:
+#   1. débito:  conta de origem + reservas em moeda nacional do banco de origem;
+#   2. câmbio:  reservas em moeda estrangeira do banco de origem;
+#   3. crédito: conta de destino.
+# Assim, etapas diferentes de transferências diferentes se sobrepõem, e a vazão não fica
+# limitada pelo mutex mais disputado (tipicamente o das reservas de uma moeda).
+# Se o câmbio falhar (reservas insuficientes), a transferência segue pelo caminho de
+# compensação: o valor retido nas reservas em moeda nacional volta para a conta de origem
+# e a transação termina com FAILED.
+# Cada worker retira até `batch_size` transferências da sua fila e as aplica com uma
+# única passada de locks (como `settle_batch`).
+# O status e a conclusão (`record_completion`/`transaction_done`) de cada transação são
+# definidos pela etapa em que ela termina.
+# Se uma etapa levantar uma exceção, as transferências do bloco que ainda estão nela são
+# encerradas conforme o que já foi aplicado: sem débito, falham; debitadas (e talvez já
+# convertidas), são compensadas e falham; já creditadas, terminam com sucesso.
+# No encerramento, o pipeline deve ser fechado e esvaziado (`drain`) antes de os bancos
+# fecharem: transferências entregues depois disso são liquidadas pelo próprio processador.
+
+# Número padrão de workers por etapa
+pipeline_stage_workers = 2
+
+
+class _Transfer:
+    __slots__ = ("transaction", "final_value", "stage", "applied", "finished")
+
+    def __init__(self, transaction: Transaction):
+        self.transaction = transaction
+        self.final_value: Optional[int] = None
+        # etapa em cuja fila a transferência está
+        self.stage = "debit"
+        # número de etapas já aplicadas aos saldos (0: nenhuma, 3: creditada)
+        self.applied = 0
+        self.finished = False
+
+
+class _StageWorker(ActorThread):
+    def __init__(self, pipeline: "InternationalPipeline", stage: str):
+        ActorThread.__init__(self, name=f"International-{stage}")
+        self.pipeline = pipeline
+        self.stage = stage
+
+    def run(self):
+        queue = self.pipeline.queues[self.stage]
+        while True:
+            batch = queue.get_many(self.pipeline.batch_size)
+            if not batch:
+                if queue.exhausted():
+                    break
+                continue
+            try:
+                self.pipeline.handle(self.stage, batch)
+            except Exception as err:
+                LOGGER.error(f"Falha na etapa {self.stage} do pipeline internacional: {err}")
+                self.pipeline.abort(self.stage, batch)
+            queue.task_done(len(batch))
+        self.pipeline.worker_done(self.stage)
+
+
+class InternationalPipeline:
+    """
+    Liquidação de transferências internacionais em etapas (débito -> câmbio -> crédito).
+    Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
+
+    ...
+
+    Atributos
+    ---------
+    queues : Dict[str, BoundedQueue]
+        Fila de cada etapa ("debit", "fx", "credit").
+    workers : List[ActorThread]
+        Workers de todas as etapas.
+    batch_size : int
+        Número máximo de transferências aplicadas por passada de locks.
+
+    Métodos
+    -------
+    start() -> None:
+        Inicia os workers.
+    submit(transaction: Transaction) -> bool:
+        Entrega uma transferência internacional à etapa de débito.
+    close() -> None:
+        Para de aceitar transferências; os workers encerram depois de esvaziar as etapas.
+    drain(timeout: Optional[float] = None) -> bool:
+        Espera as transferências já entregues serem concluídas.
+    abort(stage: str, batch: List[_Transfer]) -> None:
+        Encerra as transferências de um bloco cuja etapa levantou uma exceção.
+    join(timeout: Optional[float] = None) -> None:
+        Espera os workers encerrarem.
+    counters() -> Dict[str, int]:
+        Transferências concluídas, recusadas no débito e compensadas.
+    report() -> None:
+        Printa os contadores do pipeline.
+    """
+
+    stages = ("debit", "fx", "credit")
+
+    def __init__(self, workers_per_stage: int = pipeline_stage_workers,
+                 batch_size: int = processor_batch_size, queue_size: int = queue_max_size):
+        self.batch_size = batch_size
+        self.queues = {stage: BoundedQueue(queue_size, name=f"international.{stage}")
+                       for stage in self.stages}
+        self.workers = [_StageWorker(self, stage)
+                        for stage in self.stages for _ in range(workers_per_stage)]
+        self._lock = make_lock("international.counters")
+        self._running = {stage: workers_per_stage for stage in self.stages}
+        self._counters = {"successful": 0, "debit_failed": 0, "compensated": 0, "aborted": 0}
+        self._handlers: Dict[str, Callable[[List[_Transfer]], None]] = {
+            "debit": self._debit, "fx": self._fx, "credit": self._credit}
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, transaction: Transaction) -> bool:
+        """
+        Entrega `transaction` à etapa de débito, bloqueando enquanto a fila dela estiver
+        cheia. Retorna False se o pipeline já foi fechado.
+        """
+        return self.queues["debit"].put(_Transfer(transaction))
+
+    def close(self) -> None:
+        """
+        Para de aceitar transferências. As etapas são encerradas em cadeia: cada uma para de
+        aceitar entradas quando todos os workers da etapa anterior terminaram, de modo que
+        nenhuma transferência fica pela metade.
+        """
+        self.queues["debit"].stop_accepting()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera (no máximo `timeout` segundos, no relógio da simulação) até que todas as
+        transferências entregues ao pipeline tenham sido concluídas, etapa por etapa.
+        Retorna True se nenhuma ficou pendente.
+        """
+        deadline = None if timeout is None else clock.monotonic() + timeout
+        for stage in self.stages:
+            remaining = None if deadline is None else max(0.0, deadline - clock.monotonic())
+            if not self.queues[stage].join(remaining):
+                return False
+        return True
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def worker_done(self, stage: str) -> None:
+        with self._lock:
+            self._running[stage] -= 1
+            last = self._running[stage] == 0
+        index = self.stages.index(stage)
+        if last and index + 1 < len(self.stages):
+            self.queues[self.stages[index + 1]].stop_accepting()
+
+    def handle(self, stage: str, batch: List[_Transfer]) -> None:
+        self._handlers[stage](batch)
+
+    @staticmethod
+    def _apply(batch: List[_Transfer],
+               accounts: Callable[[Transaction], List[Account]],
+               step: Callable[[Ledger, _Transfer], bool]) -> List[bool]:
+        # aplica `step` às transferências do bloco com uma única passada de locks
+        ledger = Ledger()
+        with lock_accounts(*[acc for transfer in batch
+                             for acc in accounts(transfer.transaction)]):
+            results = [step(ledger, transfer) for transfer in batch]
+            with journal.batch():
+                ledger.commit()
+        ledger.send_remote_credits()
+        return results
+
+    def _forward(self, transfer: _Transfer, stage: str) -> None:
+        # a partir daqui a transferência pertence à etapa `stage`
+        previous, transfer.stage = transfer.stage, stage
+        if not self.queues[stage].put(transfer):
+            transfer.stage = previous
+            raise RuntimeError(f"international stage {stage} is closed")
+
+    def _debit(self, batch: List[_Transfer]) -> None:
+        results = self._apply(batch, origin_accounts,
+                              lambda ledger, transfer: debit_origin(ledger, transfer.transaction))
+        for transfer, ok in zip(batch, results):
+            if ok:
+                transfer.applied = 1
+        for transfer, ok in zip(batch, results):
+            if ok:
+                self._forward(transfer, "fx")
+            else:
+                self._finish(transfer, TransactionStatus.FAILED, "debit_failed")
+
+    def _fx(self, batch: List[_Transfer]) -> None:
+        def step(ledger: Ledger, transfer: _Transfer) -> bool:
+            transfer.final_value = exchange(ledger, transfer.transaction)
+            return transfer.final_value is not None
+
+        results = self._apply(batch, fx_accounts, step)
+        for transfer, ok in zip(batch, results):
+            if ok:
+                transfer.applied = 2
+        failed = [transfer for transfer, ok in zip(batch, results) if not ok]
+        if failed:
+            self._compensate(failed)
+        for transfer, ok in zip(batch, results):
+            if ok:
+                self._forward(transfer, "credit")
+
+    def _compensate(self, batch: List[_Transfer], counter: str = "compensated") -> None:
+        # desfaz o câmbio (se aplicado) e o débito das transferências do bloco
+        def accounts(transaction: Transaction) -> List[Account]:
+            return origin_accounts(transaction) + fx_accounts(transaction)
+
+        def step(ledger: Ledger, transfer: _Transfer) -> bool:
+            if transfer.applied == 2:
+                refund_exchange(ledger, transfer.transaction, transfer.final_value)
+            refund_origin(ledger, transfer.transaction)
+            return True
+
+        self._apply(batch, accounts, step)
+        for transfer in batch:
+            transfer.applied = 0
+            self._finish(transfer, TransactionStatus.FAILED, counter)
+
+    def _credit(self, batch: List[_Transfer]) -> None:
+        def step(ledger: Ledger, transfer: _Transfer) -> bool:
+            credit_destination(ledger, transfer.transaction, transfer.final_value)
+            return True
+
+        self._apply(batch, destination_accounts, step)
+        for transfer in batch:
+            transfer.applied = 3
+        for transfer in batch:
+            self._finish(transfer, TransactionStatus.SUCCESSFUL, "successful")
+
+    def abort(self, stage: str, batch: List[_Transfer]) -> None:
+        """
+        Encerra as transferências de `batch` que ainda estão na etapa `stage` (não foram
+        concluídas nem passadas adiante) depois que a etapa levantou uma exceção.
+        """
+        pending = [transfer for transfer in batch
+                   if transfer.stage == stage and not transfer.finished]
+        refunds = []
+        for transfer in pending:
+            if transfer.applied == 3:
+                self._finish(transfer, TransactionStatus.SUCCESSFUL, "successful")
+            elif transfer.applied:
+                refunds.append(transfer)
+            else:
+                self._finish(transfer, TransactionStatus.FAILED, "aborted")
+        if refunds:
+            try:
+                self._compensate(refunds, "aborted")
+            except Exception as err:
+                LOGGER.error(f"Falha ao compensar transferências do pipeline internacional: {err}")
+                for transfer in refunds:
+                    if not transfer.finished:
+                        self._finish(transfer, TransactionStatus.FAILED, "aborted")
+
+    def _finish(self, transfer: _Transfer, status: TransactionStatus, counter: str) -> None:
+        transfer.finished = True
+        transaction = transfer.transaction
+        wal = journal.current()
+        if wal is not None:
+            wal.transactions_settled([transaction], [status])
+        transaction.set_status(status)
+        LOGGER.info("Transaction %d, status: %s", transaction._id, status, extra=HOT)
+        # a transação saiu da fila do banco de origem
+        owner = banks[transaction.origin[0]]
+        owner.record_completion(transaction)
+        owner.transaction_done()
+        with self._lock:
+            self._counters[counter] += 1
+
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def report(self) -> None:
+        counters = self.counters()
+        LOGGER.info(
+            f"Pipeline internacional: {counters['successful']} concluídas, "
+            f"{counters['debit_failed']} recusadas no débito, "
+            f"{counters['compensated']} compensadas após falha no câmbio, "
+            f"{counters['aborted']} encerradas após erro")
@@ -0,0 +1,373 @@
+import os, struct, threading, zlib
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from globals import *
+from utils.logger import LOGGER
+from utils.transaction import Transaction, TransactionStatus
+
+# Journal (write-ahead log) das contas.
+#
+# Toda alteração de saldo (ou de limite) de um AccountStore com journal e toda criação de
+# conta gera um registro binário de tamanho fixo, anexado a um buffer em memória no
+# momento da alteração, ainda com o mutex da conta adquirido. Assim, os registros de uma
+# mesma conta ficam no journal na ordem em que foram aplicados. A liquidação também
+# registra cada transação concluída (ids, valor, taxas e status).
+# Group commit: uma thread grava o buffer acumulado a cada `journal_commit_interval`
+# segundos, com um único write + fsync por grupo, de modo que a durabilidade não custa um
+# fsync por transferência. Cada grupo é gravado como um quadro
+#   [tamanho do conteúdo, crc32 do conteúdo, LSN do último registro][registros...]
+# e a recuperação para no primeiro quadro incompleto ou corrompido (uma queda no meio de
+# uma gravação perde apenas o último grupo, inteiro).
+# Os registros de saldo são variações: somadas por conta, a ordem entre contas diferentes
+# não importa. A recuperação (`replay`) parte de bancos recém-criados (reservas zeradas e
+# nenhuma conta de cliente) e reaplica as criações de contas e as variações.
+# O LSN (log sequence number) é o número de registros anexados desde a criação do arquivo.
+# Os registros de uma liquidação (variações de saldo de todas as contas do lote e as
+# transações concluídas) são anexados de uma só vez (`batch`), de modo que um group commit
+# nunca separa parte de uma liquidação em outro quadro: recuperar até qualquer quadro
+# reaplica liquidações inteiras.
+# O dinheiro das fatias de reservas dos ReserveCaches (payment_system/reserve_cache.py)
+# pertence à reserva: as movimentações das fatias são registradas (`slice_changed`) e a
+# recuperação as soma à reserva, já que os processadores que retinham as fatias não
+# existem mais.
+# Com snapshots (payment_system/snapshot.py), o journal é cortado no LSN de cada checkpoint
+# (`cut`), e os quadros até ele podem ser descartados (`compact`): a recuperação carrega o
+# snapshot e reaplica só os registros posteriores (`replay(..., from_lsn)`).
+
+# Intervalo entre os group commits, em segundos (tempo real)
+journal_commit_interval = 0.01
+
+# Tipos de registro
+_ACCOUNT, _DELTA, _LIMIT, _SETTLED, _SLICE = 1, 2, 3, 4, 5
+
+# Estrutura de cada tipo (após o byte do tipo). `kind` é 0 para contas de clientes e 1
+# para as reservas do banco.
+_RECORDS = {
+    # banco, kind, índice, saldo, limite
+    _ACCOUNT: struct.Struct("<HBIqq"),
+    # banco, kind, índice, variação do saldo
+    _DELTA: struct.Struct("<HBIq"),
+    # banco, kind, índice, novo limite
+    _LIMIT: struct.Struct("<HBIq"),
+    # banco de origem, conta de origem, banco de destino, conta de destino, _id, valor,
+    # taxas, moeda, status
+    _SETTLED: struct.Struct("<HIHIIqqBB"),
+    # banco, kind, índice da reserva, variação das fatias da reserva
+    _SLICE: struct.Struct("<HBIq"),
+}
+_TYPE = struct.Struct("<B")
+_FRAME = struct.Struct("<IIQ")
+
+
+def _kind(store) -> int:
+    return 1 if store.currency is None else 0
+
+
+class Journal:
+    """
+    Journal das contas com group commit.
+    Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
+
+    ...
+
+    Atributos
+    ---------
+    path : str
+        Arquivo do journal (aberto para anexar).
+    commit_interval : float
+        Intervalo entre os group commits, em segundos.
+    fsync : bool
+        Se False, os grupos são gravados sem fsync (apenas para medições).
+    lsn : int
+        LSN do último registro anexado.
+    durable_lsn : int
+        LSN do último registro gravado em disco.
+    commits : int
+        Número de grupos gravados.
+
+    Métodos
+    -------
+    attach(bank: Bank) -> None:
+        Passa a registrar as alterações das contas e das reservas de `bank`.
+    account_created(store: AccountStore, index: int, balance: int, limit: int) -> None:
+        Registra a criação de uma conta.
+    balance_changed(store: AccountStore, index: int, delta: int) -> None:
+        Registra uma variação de saldo.
+    limit_changed(store: AccountStore, index: int, limit: int) -> None:
+        Registra um novo limite de cheque especial.
+    slice_changed(store: AccountStore, index: int, delta: int) -> None:
+        Registra uma variação das fatias de ReserveCaches retiradas de uma reserva.
+    transactions_settled(transactions: Sequence[Transaction], statuses: Sequence[TransactionStatus]) -> None:
+        Registra transações concluídas.
+    batch() -> ContextManager:
+        Acumula os registros da thread atual e os anexa juntos ao sair do bloco.
+    start() -> None:
+        Inicia a thread de group commit.
+    cut() -> int:
+        Fecha o grupo atual (o próximo quadro começa no registro seguinte) e retorna o LSN.
+    flush() -> int:
+        Grava imediatamente o buffer acumulado e retorna o LSN durável.
+    compact(lsn: int) -> None:
+        Remove do arquivo os quadros cujos registros têm LSN até `lsn`.
+    close() -> None:
+        Para a thread de group commit, grava o restante e fecha o arquivo.
+    """
+
+    def __init__(self, path: str, commit_interval: float = journal_commit_interval,
+                 fsync: bool = True, lsn: int = 0):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.fsync = fsync
+        self.lsn = lsn
+        self.durable_lsn = lsn
+        self.commits = 0
+        self._file = open(path, "ab")
+        self._buffer = bytearray()
+        # grupos fechados por `cut` ainda não gravados: (registros, LSN do último)
+        self._groups: List[Tuple[bytes, int]] = []
+        self._lock = threading.Lock()
+        # registros acumulados por `batch` na thread atual: [registros, quantidade]
+        self._local = threading.local()
+        # serializa as gravações (a thread de commit e flushes explícitos)
+        self._io_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._writer = threading.Thread(target=self._run, name="JournalWriter", daemon=True)
+
+    def attach(self, bank) -> None:
+        bank.accounts.journal = self
+        bank.reserves.store.journal = self
+
+    def _extend(self, records: bytes, n: int) -> None:
+        pending = getattr(self._local, "pending", None)
+        if pending is not None:
+            pending[0] += records
+            pending[1] += n
+            return
+        with self._lock:
+            self._buffer += records
+            self.lsn += n
+
+    def _append(self, record_type: int, *fields) -> None:
+        self._extend(_TYPE.pack(record_type) + _RECORDS[record_type].pack(*fields), 1)
+
+    @contextmanager
+    def batch(self):
+        """
+        Dentro do bloco, os registros da thread atual são acumulados e, ao sair, anexados
+        com uma única aquisição do mutex do buffer (ficam no mesmo quadro). Blocos
+        aninhados fazem parte do mais externo.
+        """
+        if getattr(self._local, "pending", None) is not None:
+            yield
+            return
+        pending = self._local.pending = [bytearray(), 0]
+        try:
+            yield
+        finally:
+            self._local.pending = None
+            if pending[1]:
+                with self._lock:
+                    self._buffer += pending[0]
+                    self.lsn += pending[1]
+
+    def account_created(self, store, index: int, balance: int, limit: int) -> None:
+        self._append(_ACCOUNT, store._bank_id, _kind(store), index, balance, limit)
+
+    def balance_changed(self, store, index: int, delta: int) -> None:
+        self._append(_DELTA, store._bank_id, _kind(store), index, delta)
+
+    def limit_changed(self, store, index: int, limit: int) -> None:
+        self._append(_LIMIT, store._bank_id, _kind(store), index, limit)
+
+    def slice_changed(self, store, index: int, delta: int) -> None:
+        self._append(_SLICE, store._bank_id, _kind(store), index, delta)
+
+    def transactions_settled(self, transactions: Sequence[Transaction],
+                             statuses: Sequence[TransactionStatus]) -> None:
+        fields = _RECORDS[_SETTLED]
+        records = b"".join(
+            _TYPE.pack(_SETTLED) + fields.pack(
+                transaction.origin[0], transaction.origin[1], transaction.destination[0],
+                transaction.destination[1], transaction._id, transaction.amount,
+                transaction.taxes, transaction.currency.value, status.value)
+            for transaction, status in zip(transactions, statuses))
+        self._extend(records, len(transactions))
+
+    def start(self) -> None:
+        self._writer.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.commit_interval):
+            self.flush()
+
+    def cut(self) -> int:
+        """
+        Fecha o grupo atual: os registros anexados até aqui ficam em quadros separados dos
+        seguintes, de modo que o arquivo pode ser compactado exatamente no LSN retornado.
+        """
+        with self._lock:
+            if self._buffer:
+                self._groups.append((bytes(self._buffer), self.lsn))
+                self._buffer.clear()
+            return self.lsn
+
+    def flush(self) -> int:
+        with self._io_lock:
+            with self._lock:
+                groups = self._groups
+                self._groups = []
+                if self._buffer:
+                    groups.append((bytes(self._buffer), self.lsn))
+                    self._buffer.clear()
+                lsn = self.lsn
+            if groups:
+                for payload, last in groups:
+                    self._file.write(_FRAME.pack(len(payload), zlib.crc32(payload), last))
+                    self._file.write(payload)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+                self.commits += 1
+            self.durable_lsn = lsn
+            return lsn
+
+    def compact(self, lsn: int) -> None:
+        """
+        Grava o que estiver pendente e reescreve o arquivo sem os quadros que terminam até
+        `lsn` (que deve ter sido retornado por `cut`). O arquivo novo substitui o antigo
+        atomicamente.
+        """
+        self.flush()
+        with self._io_lock:
+            tmp = f"{self.path}.tmp"
+            data = _read(self.path)
+            with open(tmp, "wb") as f:
+                previous = 0
+                for start, end, frame_lsn in _frames(self.path, data):
+                    if frame_lsn > lsn:
+                        f.write(data[previous:end])
+                    previous = end
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp, self.path)
+            self._file = open(self.path, "ab")
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._writer.is_alive():
+            self._writer.join()
+        self.flush()
+        self._file.close()
+
+
+_current: Optional[Journal] = None
+
+
+def use(journal: Optional[Journal]) -> None:
+    """
+    Define o journal em que a liquidação registra as transações concluídas.
+    """
+    global _current
+    _current = journal
+
+
+def current() -> Optional[Journal]:
+    return _current
+
+
+def batch():
+    """
+    `Journal.batch()` do journal atual (um bloco sem efeito se não há journal).
+    """
+    return _current.batch() if _current is not None else nullcontext()
+
+
+def _read(path: str) -> memoryview:
+    with open(path, "rb") as f:
+        return memoryview(f.read())
+
+
+def _frames(path: str, data: memoryview) -> Iterator[Tuple[int, int, int]]:
+    # quadros íntegros de `data` (conteúdo de `path`): (início dos registros, fim do
+    # quadro, LSN do último registro)
+    offset = 0
+    while offset + _FRAME.size <= len(data):
+        length, crc, lsn = _FRAME.unpack_from(data, offset)
+        start = offset + _FRAME.size
+        if start + length > len(data) or zlib.crc32(data[start:start + length]) != crc:
+            break
+        offset = start + length
+        yield start, offset, lsn
+    if offset < len(data):
+        LOGGER.warning(f"Journal {path}: quadro incompleto ou corrompido no byte {offset}; "
+                       f"os registros a partir dele foram ignorados")
+
+
+def _records(payload: memoryview) -> List[Tuple[int, tuple]]:
+    records = []
+    position = 0
+    while position < len(payload):
+        (record_type,) = _TYPE.unpack_from(payload, position)
+        fields = _RECORDS[record_type]
+        records.append((record_type, fields.unpack_from(payload, position + _TYPE.size)))
+        position += _TYPE.size + fields.size
+    return records
+
+
+def read_records(path: str) -> Iterator[Tuple[int, tuple]]:
+    """
+    Lê os registros dos quadros íntegros de `path`, em ordem, como (tipo, campos).
+    """
+    data = _read(path)
+    for start, end, _ in _frames(path, data):
+        yield from _records(data[start:end])
+
+
+def replay(path: str, banks: List, from_lsn: int = 0) -> Dict[str, int]:
+    """
+    Reaplica nas contas de `banks` os registros de `path` com LSN maior que `from_lsn` e
+    corta do arquivo um eventual quadro final incompleto, para que novos registros sejam
+    anexados depois do último quadro íntegro. Com `from_lsn` 0, os bancos devem ter sido
+    recém-criados (na ordem dos _ids); senão, restaurados do snapshot de LSN `from_lsn`.
+    Retorna o LSN recuperado e contagens dos registros aplicados.
+    """
+    stores = {(bank._id, 0): bank.accounts for bank in banks}
+    stores.update({(bank._id, 1): bank.reserves.store for bank in banks})
+    counts = {"lsn": from_lsn, "accounts": 0, "deltas": 0, "slices": 0, "settled": 0}
+    data = _read(path)
+    valid = 0
+    for start, valid, frame_lsn in _frames(path, data):
+        if frame_lsn <= from_lsn:
+            continue
+        records = _records(data[start:valid])
+        first_lsn = frame_lsn - len(records) + 1
+        if first_lsn > counts["lsn"] + 1:
+            raise ValueError(f"journal {path}: records {counts['lsn'] + 1}..{first_lsn - 1} "
+                             f"are missing (compacted past the snapshot?)")
+        for record_type, fields in records[max(0, from_lsn + 1 - first_lsn):]:
+            if record_type == _SETTLED:
+                counts["settled"] += 1
+                continue
+            store = stores[(fields[0], fields[1])]
+            index = fields[2]
+            if record_type == _ACCOUNT:
+                # as criações de contas de um store são registradas na ordem dos _ids
+                if store.append(fields[3], fields[4]) != index:
+                    raise ValueError(f"journal {path}: account {index} of bank {fields[0]} "
+                                     f"created out of order")
+                counts["accounts"] += 1
+            elif record_type == _DELTA:
+                store._balances[index] += fields[3]
+                counts["deltas"] += 1
+            elif record_type == _SLICE:
+                # o dinheiro das fatias volta para a reserva
+                store._balances[index] += fields[3]
+                counts["slices"] += 1
+            else:
+                store._limits[index] = fields[3]
+        counts["lsn"] = frame_lsn
+    if len(data) > valid:
+        os.truncate(path, valid)
+    return counts
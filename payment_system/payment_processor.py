@@ -1,20 +1,39 @@
-from locale import currency
-import time
-from threading import Thread
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
 from globals import *
 from payment_system.bank import Bank
+from payment_system.reserve_cache import ReserveCache
+from payment_system.settlement import is_international, settle_batch
 from utils.transaction import Transaction, TransactionStatus
-from utils.logger import LOGGER
+from utils.logger import HOT, LOGGER
 from utils.currency import *
+from utils import clock
+from utils.clock import ActorThread, sleep_units
 
-# TODO
-#  * Retirar o valor das reservas internacionais do banco:
-# talvez criar uma função que verifique qual moeda está sendo utilizada
-# e retirar a quantia necessaria das reservas dessa moeda
+if TYPE_CHECKING:
+    from payment_system.international import InternationalPipeline
+    from payment_system.processor_pool import ProcessorPool
 
+# Número máximo de transações retiradas da fila do banco por acesso, com liquidação em bloco
+processor_batch_size = 8
 
-class PaymentProcessor(Thread):
+# Latência simulada do processamento de uma transação (ou de um bloco), em unidades de tempo
+processing_time_units = 3
+
+
+def dequeue_size(batch_settlement: bool, batch_size: Optional[int] = None) -> int:
+    """
+    Número de transações retiradas da fila por acesso: `batch_size`, se informado; senão
+    `processor_batch_size` com liquidação em bloco e 1 sem ela. Transações liquidadas uma a
+    uma não ganham nada saindo juntas da fila, e o processador que retira um bloco o
+    seguraria enquanto os outros processadores do banco ficam ociosos.
+    """
+    if batch_size is not None:
+        return batch_size
+    return processor_batch_size if batch_settlement else 1
+
+
+class PaymentProcessor(ActorThread):
     """
     Uma classe para representar um processador de pagamentos de um banco.
     Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
@@ -27,23 +46,74 @@ class PaymentProcessor(Thread):
         Identificador do processador de pagamentos.
     bank: Bank
         Banco sob o qual o processador de pagamentos operará.
+    batch_size: int
+        Número máximo de transações retiradas da fila a cada vez que o processador acorda
+        (ver `dequeue_size`).
+    batch_settlement: bool
+        Se True, cada bloco retirado da fila é liquidado de uma só vez por `process_batch`.
+    pool: Optional[ProcessorPool]
+        Pool compartilhado do qual o processador faz parte. Com pool, `bank` é o banco "de
+        casa" e, quando a fila dele está vazia, o processador rouba trabalho de outros bancos.
+    poll_timeout: Optional[float]
+        Espera máxima (em segundos) na fila antes de verificar se o processador foi aposentado.
+        None espera indefinidamente (até o banco fechar).
+    retired: bool
+        Indica se o processador foi aposentado (ver `retire`).
+    netting_size: int
+        Se maior que zero, ativa a janela de compensação (netting): o processador acumula
+        até `netting_size` transações da fila, esperando no máximo `netting_window`
+        segundos desde a primeira, e liquida a janela inteira de uma só vez: cada conta
+        (e cada par de moedas das reservas) recebe uma única variação líquida, com as
+        verificações de saldo/limite feitas na ordem das transações.
+    netting_window: float
+        Duração máxima (em segundos) da janela de compensação.
+    reserve_cache: Optional[ReserveCache]
+        Fatias locais das reservas em moeda estrangeira usadas pelo câmbio (None debita as
+        reservas compartilhadas). As fatias são devolvidas quando o processador encerra.
+    busy_ns: int
+        Tempo total (em nanossegundos) gasto processando blocos de transações.
+    run_started_ns, run_finished_ns: int
+        Instantes (clock.monotonic_ns) do início e do fim de `run` (0 enquanto não ocorreram).
+    pipeline: Optional[InternationalPipeline]
+        Se informado, as transações internacionais são entregues a este pipeline (e
+        terminam nele, com status PENDING até lá) em vez de liquidadas pelo processador.
 
     Métodos
     -------
     run():
         Inicia thread to PaymentProcessor
-    deposit_bank_reserves(self, amount) -> None:
-        Deposita o valor retirado da conta de origem nas reservas da moeda nacional
-    withdraw_from_international_reserves(self, currency, amount_converted) -> None:
-        Retira o valor convertido das reservas da moeda internacional
+    alive_ns() -> int:
+        Tempo de execução de `run` até agora (ou até o fim), em nanossegundos
     process_transaction(transaction: Transaction) -> TransactionStatus:
         Processa uma transação bancária.
+    process_batch(transactions: List[Transaction]) -> Optional[List[TransactionStatus]]:
+        Processa um bloco de transações bancárias com uma única passada de locks.
+    retire() -> None:
+        Pede que o processador encerre depois do bloco atual, mesmo com o banco aberto.
     """
 
-    def __init__(self, _id: int, bank: Bank):
-        Thread.__init__(self)
+    def __init__(self, _id: int, bank: Bank, batch_size: Optional[int] = None,
+                 batch_settlement: bool = False, pool: Optional["ProcessorPool"] = None,
+                 poll_timeout: Optional[float] = None,
+                 pipeline: Optional["InternationalPipeline"] = None,
+                 netting_size: int = 0, netting_window: float = 0.0,
+                 reserve_cache: bool = False):
+        ActorThread.__init__(self)
         self._id = _id
         self.bank = bank
+        self.batch_size = dequeue_size(batch_settlement, batch_size)
+        self.batch_settlement = batch_settlement
+        self.pool = pool
+        self.poll_timeout = poll_timeout
+        self.retired = False
+        self.pipeline = pipeline
+        self.netting_size = netting_size
+        self.netting_window = netting_window
+        self.reserve_cache = ReserveCache() if reserve_cache else None
+        self.busy_ns = 0
+        self.run_started_ns = 0
+        self.run_finished_ns = 0
+        bank.processors.append(self)
 
     def run(self):
         """
@@ -55,72 +125,127 @@ class PaymentProcessor(Thread):
 
         LOGGER.info(
             f"Inicializado o PaymentProcessor {self._id} do Banco {self.bank._id}!")
-        queue = banks[self.bank._id].transaction_queue
-
-        # ALTERADO: adicionado condição de parada no while e verificação do tamanho da fila
-        operating = True
-        while operating:
-            try:
-                # tenta pegar o semáforo dos consumidores
-                self.bank.queue_sem_cons.acquire()
-                # pega um transação da fila
-                transaction = self.bank.transaction_queue_get()
-                # libera o semáforo dos produtores
-                self.bank.queue_sem_prod.release()
-
-                # LOGGER.info(
-                # f"Transaction_queue do Banco {self.bank._id}: {queue}")
-            except Exception as err:
-                LOGGER.error(f"Falha em PaymentProcessor.run(): {err}")
+        self.run_started_ns = clock.monotonic_ns()
+
+        # ALTERADO: retira até `batch_size` transações por vez da fila. Uma lista vazia
+        # indica que a fila foi fechada (banco fechado) ou que o banco parou de aceitar
+        # transações e a fila esvaziou; nos dois casos o processador encerra.
+        while self.bank.operating and not self.retired:
+            owner, batch = self._next_batch()
+            if not batch:
+                if self._exhausted():
+                    break
+                continue
+            busy_since = clock.monotonic_ns()
+            if self.netting_size:
+                self._run_batch(owner, self._fill_window(owner, batch))
+            elif self.batch_settlement:
+                self._run_batch(owner, batch)
             else:
-                self.process_transaction(transaction)
-            operating = self.bank.operating
+                self._run_each(owner, batch)
+            self.busy_ns += clock.monotonic_ns() - busy_since
 
+        if self.reserve_cache is not None:
+            self.reserve_cache.release()
+        self.run_finished_ns = clock.monotonic_ns()
         LOGGER.info(
             f"O PaymentProcessor {self._id} do banco {self.bank._id} foi finalizado.")
 
-    # Depositando o valor da transferência nas reservas internas
-    # O depósito é feito na conta da própria moeda nacional
-    def deposit_bank_reserves(self, amount) -> None:
-        if (self.bank.currency == Currency.USD):
-            self.bank.reserves.USD.deposit(amount)
-        elif (self.bank.currency == Currency.EUR):
-            self.bank.reserves.EUR.deposit(amount)
-        elif (self.bank.currency == Currency.GBP):
-            self.bank.reserves.GBP.deposit(amount)
-        elif (self.bank.currency == Currency.JPY):
-            self.bank.reserves.JPY.deposit(amount)
-        elif (self.bank.currency == Currency.CHF):
-            self.bank.reserves.CHF.deposit(amount)
-        elif (self.bank.currency == Currency.BRL):
-            self.bank.reserves.BRL.deposit(amount)
-        # LOGGER.info(
-        #     f"Depositado {amount} nas reservas do banco cuja moeda é {self.bank.currency}")
-
-    # Retirando o valor na nova moeda das reservas internacionais do banco
-    def withdraw_from_international_reserves(self, currency, amount_converted) -> None:
-        if (currency == Currency.USD):
-            self.bank.reserves.USD.withdraw(amount_converted)
-            # print("Dolares retirados:", amount_converted)
-        if (currency == Currency.EUR):
-            self.bank.reserves.EUR.withdraw(amount_converted)
-            # print("Euros retirados", amount_converted)
-        if (currency == Currency.GBP):
-            self.bank.reserves.GBP.withdraw(amount_converted)
-            # print("Euros retirados", amount_converted)
-        if (currency == Currency.JPY):
-            self.bank.reserves.JPY.withdraw(amount_converted)
-            # print("JPY retirados", amount_converted)
-        if (currency == Currency.CHF):
-            self.bank.reserves.CHF.withdraw(amount_converted)
-            # print("CHF retirados", amount_converted)
-        if (currency == Currency.BRL):
-            self.bank.reserves.BRL.withdraw(amount_converted)
-            # print("BRL retirados", amount_converted)
+    def alive_ns(self) -> int:
+        """
+        Tempo (em nanossegundos) desde o início de `run`, até o seu fim se já encerrou.
+        """
+        if not self.run_started_ns:
+            return 0
+        return (self.run_finished_ns or clock.monotonic_ns()) - self.run_started_ns
+
+    def retire(self) -> None:
+        """
+        Pede que o processador encerre assim que terminar o bloco atual (usado pelo
+        Autoscaler). Com `poll_timeout` None o pedido só é visto na próxima retirada.
+        """
+        self.retired = True
+
+    def _next_batch(self) -> Tuple[Bank, List[Transaction]]:
+        """
+        Retira o próximo bloco de transações e retorna também o banco dono da fila de onde
+        ele saiu. Sem pool, bloqueia na fila do próprio banco. Com pool, espera no máximo
+        `pool.steal_timeout` pela fila de casa e, se ela estiver vazia, tenta roubar um
+        bloco da fila de outro banco.
+        """
+        if self.pool is None:
+            return self.bank, self.bank.transaction_queue_get_batch(
+                self.batch_size, timeout=self.poll_timeout)
+        batch = self.bank.transaction_queue_get_batch(
+            self.batch_size, timeout=self.pool.steal_timeout)
+        if batch:
+            return self.bank, batch
+        return self.pool.steal(self)
+
+    def _fill_window(self, owner: Bank, batch: List[Transaction]) -> List[Transaction]:
+        """
+        Completa a janela de compensação com mais transações da fila de `owner`, até
+        `netting_size` transações ou até `netting_window` segundos desde o início.
+        """
+        window = list(batch)
+        deadline = clock.monotonic() + self.netting_window
+        while len(window) < self.netting_size:
+            remaining = deadline - clock.monotonic()
+            if remaining <= 0:
+                break
+            more = owner.transaction_queue_get_batch(
+                self.netting_size - len(window), timeout=remaining)
+            if not more:
+                break
+            window.extend(more)
+        return window
+
+    def _exhausted(self) -> bool:
+        if self.pool is None:
+            return self.bank.transaction_queue.exhausted()
+        return self.pool.exhausted()
+
+    def _run_each(self, owner: Bank, batch: List[Transaction]) -> None:
+        for i, transaction in enumerate(batch):
+            try:
+                status = self.process_transaction(transaction)
+            except Exception as err:
+                LOGGER.error(f"Falha em PaymentProcessor.run(): {err}")
+                owner.transaction_done()
+                continue
+            if status is None:
+                # o banco fechou no meio do lote: o restante volta para a fila
+                owner.transaction_queue_return(batch[i:])
+                return
+            if status == TransactionStatus.PENDING:
+                # concluída pelo pipeline internacional
+                continue
+            owner.record_completion(transaction)
+            owner.transaction_done()
+
+    def _run_batch(self, owner: Bank, batch: List[Transaction]) -> None:
+        try:
+            statuses = self.process_batch(batch)
+        except Exception as err:
+            LOGGER.error(f"Falha em PaymentProcessor.run(): {err}")
+            owner.transaction_done(len(batch))
+            return
+        if statuses is None:
+            # o banco fechou antes da liquidação: o bloco volta para a fila
+            owner.transaction_queue_return(batch)
+            return
+        done = 0
+        for transaction, status in zip(batch, statuses):
+            if status != TransactionStatus.PENDING:
+                owner.record_completion(transaction)
+                done += 1
+        if done:
+            owner.transaction_done(done)
 
     def process_transaction(self, transaction: Transaction) -> TransactionStatus:
         """
-        Esse método deverá processar as transações bancárias do banco ao qual foi designado.
+        Esse método deverá processar as transações bancárias do banco ao qual foi designado
+        (ou de outro banco, quando a transação foi roubada pelo ProcessorPool).
         Caso a transferência seja realizada para um banco diferente (em moeda diferente), a
         lógica para transações internacionais detalhada no enunciado (README.md) deverá ser
         aplicada.
@@ -128,81 +253,68 @@ class PaymentProcessor(Thread):
         """
         # TODO: IMPLEMENTE/MODIFIQUE O CÓDIGO NECESSÁRIO ABAIXO !
 
-        LOGGER.info(
-            f"PaymentProcessor {self._id} do Banco {self.bank._id} iniciando processamento da Transaction {transaction._id}!")
+        origin_bank = banks[transaction.origin[0]]
+        LOGGER.info("PaymentProcessor %d do Banco %d iniciando processamento da Transaction %d!",
+                    self._id, origin_bank._id, transaction._id, extra=HOT)
+        transaction.started_ns = clock.monotonic_ns()
         # LOGGER.info(
         #     f"Da conta {transaction.origin[1]} do banco {transaction.origin[1]} para a conta {transaction.destination[1]} do banco {transaction.origin[0]}")
 
         # NÃO REMOVA ESSE SLEEP!
         # Ele simula uma latência de processamento para a transação.
-        time.sleep(3 * time_unit)
+        sleep_units(processing_time_units)
 
         # ALTERAÇÕES \/
 
-        operating = self.bank.operating
+        operating = origin_bank.operating
         # Caso o banco feche
         if (not operating):
             return None
 
-        # conta de origem
-        origin_acc = self.bank.accounts[transaction.origin[1]]
-        # conta de destino
-        destination_acc = banks[transaction.destination[0]
-                                ].accounts[transaction.destination[1]]
-
-        # tentativa de saque: recebe valor booleano
-        withdraw_op = origin_acc.withdraw(transaction.amount)
-
-        if (not withdraw_op):
-            # caso não haja dinheiro suficiente na conta
-            transaction.set_status(TransactionStatus.FAILED)
-            LOGGER.info(
-                f"Transaction {transaction._id}, status: {transaction.status}")
-            return transaction.status
-
-        # transaction.taxes inicia com valor 0
-        if (origin_acc.balance < 0):
-            # foi usado cheque especial -> 5% de taxa
-            transaction.taxes = transaction.amount * 0.05
-
-        if (transaction.origin[0] == transaction.destination[0]):
-            # Transação nacional na mesma moeda
-            final_value = transaction.amount - transaction.taxes
-            # --> aqui pode ser incrementado o lucro do banco,
-            # --> transaction.taxes terá o valor zero ou o valor do cheque especial
-            destination_acc.deposit(final_value)
-        else:
-            # Transação internacional
-
-            # transfere o valor em moeda nacional para a conta de reservas do banco
-            self.deposit_bank_reserves(transaction.amount)
-
-            # a taxa será descontada do valor final convertido em moeda estrangeira
+        status = self._settle([transaction])[0]
+        if status != TransactionStatus.PENDING:
+            LOGGER.info("Transaction %d, status: %s", transaction._id, status, extra=HOT)
+        return status
 
-            # soma taxa do cheque especial à taxa de transações internacionais (1%)
-            transaction.taxes += transaction.amount * 0.01
-
-            # --> aqui pode ser incrementado o lucro do banco,
-            # --> transaction.taxes terá o valor de todas as taxas somadas (ou zero)
-
-            # valor que será convertido (com o desconto das taxas)
-            value_to_convert = transaction.amount - transaction.taxes
-
-            # taxa de conversão entre as moedas
-            transaction.exchange_fee = get_exchange_rate(
-                self.bank.currency, transaction.currency)
-
-            # valor final na nova moeda
-            final_value = value_to_convert * transaction.exchange_fee
+    def process_batch(self, transactions: List[Transaction]) -> Optional[List[TransactionStatus]]:
+        """
+        Processa um bloco de transações de uma só vez (modo de liquidação em lote): todas as
+        contas envolvidas são travadas uma única vez e as variações líquidas são aplicadas
+        ao final. O resultado é idêntico ao de chamar `process_transaction` para cada
+        transação, em ordem. A latência simulada é aplicada uma vez por bloco.
+        Todas as transações do bloco devem vir da fila de um mesmo banco.
+        Retorna None caso o banco feche antes da liquidação.
+        """
+        origin_bank = banks[transactions[0].origin[0]]
+        LOGGER.info("PaymentProcessor %d do Banco %d iniciando processamento de %d Transactions!",
+                    self._id, origin_bank._id, len(transactions), extra=HOT)
+        started_ns = clock.monotonic_ns()
+        for transaction in transactions:
+            transaction.started_ns = started_ns
 
-            # retira o valor das reservas internacionais do banco
-            self.withdraw_from_international_reserves(
-                transaction.currency, final_value)
+        # NÃO REMOVA ESSE SLEEP!
+        # Ele simula uma latência de processamento para o bloco de transações.
+        sleep_units(processing_time_units)
 
-            # deposita na conta de destino
-            destination_acc.deposit(final_value)
+        # Caso o banco feche
+        if (not origin_bank.operating):
+            return None
 
-        transaction.set_status(TransactionStatus.SUCCESSFUL)
-        LOGGER.info(
-            f"Transaction {transaction._id}, status: {transaction.status}")
-        return transaction.status
+        statuses = self._settle(transactions)
+        for transaction, status in zip(transactions, statuses):
+            if status != TransactionStatus.PENDING:
+                LOGGER.info("Transaction %d, status: %s", transaction._id, status, extra=HOT)
+        return statuses
+
+    def _settle(self, transactions: List[Transaction]) -> List[TransactionStatus]:
+        # com pipeline, as internacionais são entregues a ele (PENDING) e as demais são
+        # liquidadas aqui; se o pipeline já fechou, todas são liquidadas aqui
+        if self.pipeline is None:
+            return settle_batch(transactions, self.reserve_cache)
+        statuses = [TransactionStatus.PENDING] * len(transactions)
+        direct = [i for i, transaction in enumerate(transactions)
+                  if not (is_international(transaction) and self.pipeline.submit(transaction))]
+        settled = settle_batch([transactions[i] for i in direct], self.reserve_cache)
+        for i, status in zip(direct, settled):
+            statuses[i] = status
+        return statuses
@@ -0,0 +1,114 @@
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from payment_system.bank import Bank
+from payment_system.payment_processor import PaymentProcessor
+from utils.transaction import Transaction
+from utils.lockprof import make_lock
+from utils.logger import LOGGER
+
+if TYPE_CHECKING:
+    from payment_system.international import InternationalPipeline
+
+# Tempo máximo (em segundos) que um processador espera pela fila do seu banco antes de
+# tentar roubar trabalho de outro banco
+steal_timeout = 0.05
+
+
+class ProcessorPool:
+    """
+    Um pool de PaymentProcessors compartilhado entre todos os bancos.
+    Cada processador tem um banco "de casa" e consome a fila dele; quando ela fica vazia,
+    o processador rouba um bloco de transações da fila do banco com maior backlog. Assim,
+    uma rajada de transações em um único banco é absorvida pelo pool inteiro, e não apenas
+    pelos processadores daquele banco.
+    Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
+
+    ...
+
+    Atributos
+    ---------
+    banks : List[Bank]
+        Bancos atendidos pelo pool.
+    workers : List[PaymentProcessor]
+        Processadores do pool (`workers_per_bank` por banco de casa).
+    steal_timeout : float
+        Espera máxima na fila de casa antes de tentar roubar trabalho.
+
+    Métodos
+    -------
+    start() -> None:
+        Inicia todos os processadores.
+    join(timeout: Optional[float] = None) -> None:
+        Espera todos os processadores encerrarem.
+    steal(thief: PaymentProcessor) -> Tuple[Bank, List[Transaction]]:
+        Retira um bloco de transações da fila de outro banco.
+    exhausted() -> bool:
+        Indica se nenhuma fila atendida pelo pool ainda terá transações.
+    backlog() -> Dict[int, int]:
+        Número de transações pendentes por banco.
+    steal_counts() -> Dict[int, int]:
+        Número de transações roubadas da fila de cada banco.
+    report() -> None:
+        Printa backlog e roubos por banco.
+    """
+
+    def __init__(self, banks: List[Bank], workers_per_bank: int,
+                 batch_size: Optional[int] = None, batch_settlement: bool = False,
+                 steal_timeout: float = steal_timeout,
+                 pipeline: Optional["InternationalPipeline"] = None,
+                 netting_size: int = 0, netting_window: float = 0.0,
+                 reserve_cache: bool = False):
+        self.banks = banks
+        self.steal_timeout = steal_timeout
+        self._stats_lock = make_lock("pool.stats")
+        self._stolen_from = {bank._id: 0 for bank in banks}
+        self.workers = []
+        for _ in range(workers_per_bank):
+            for bank in banks:
+                self.workers.append(PaymentProcessor(
+                    _id=len(self.workers), bank=bank, batch_size=batch_size,
+                    batch_settlement=batch_settlement, pool=self, pipeline=pipeline,
+                    netting_size=netting_size, netting_window=netting_window,
+                    reserve_cache=reserve_cache))
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def steal(self, thief: PaymentProcessor) -> Tuple[Bank, List[Transaction]]:
+        """
+        Tenta retirar, sem bloquear, um bloco de transações da fila de outro banco, começando
+        pelo banco de maior backlog. Retorna o banco roubado e o bloco (vazio se todas as
+        outras filas estiverem vazias).
+        """
+        victims = sorted((bank for bank in self.banks if bank is not thief.bank),
+                         key=lambda bank: bank.transaction_queue.qsize(), reverse=True)
+        for victim in victims:
+            if victim.transaction_queue.empty():
+                break
+            batch = victim.transaction_queue_get_batch(thief.batch_size, timeout=0)
+            if batch:
+                with self._stats_lock:
+                    self._stolen_from[victim._id] += len(batch)
+                return victim, batch
+        return thief.bank, []
+
+    def exhausted(self) -> bool:
+        return all(bank.transaction_queue.exhausted() for bank in self.banks)
+
+    def backlog(self) -> Dict[int, int]:
+        return {bank._id: bank.transaction_queue.qsize() for bank in self.banks}
+
+    def steal_counts(self) -> Dict[int, int]:
+        with self._stats_lock:
+            return dict(self._stolen_from)
+
+    def report(self) -> None:
+        stolen = self.steal_counts()
+        for bank_id, pending in self.backlog().items():
+            LOGGER.info(
+                f"Pool: banco {bank_id}: {pending} transações pendentes, {stolen[bank_id]} roubadas por processadores de outros bancos")
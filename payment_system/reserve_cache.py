@@ -0,0 +1,219 @@
+from contextlib import nullcontext
+from threading import Lock
+from typing import Dict, Iterable, List, Set, Tuple
+from weakref import WeakSet
+
+from payment_system.account import Account
+from utils.metrics import RESERVES_PULLED, RESERVES_RETURNED, RESERVES_SPENT
+
+# Cache de liquidez das reservas.
+# Sem cache, toda transferência internacional debita a conta compartilhada de reservas da
+# moeda de destino, cujo mutex é disputado por todos os processadores do banco (e fica
+# quente em moedas muito usadas, como USD e EUR). Com cache, cada processador mantém uma
+# fatia local de cada reserva em moeda estrangeira que usa: os débitos do câmbio saem da
+# fatia, sem o mutex da reserva, já que a fatia pertence a uma única thread. A fatia é
+# reposta em bloco quando o seu saldo fica abaixo da marca mínima, e devolvida à reserva
+# compartilhada quando o processador encerra.
+# Mutexes: a reposição precisa do mutex da reserva compartilhada e acontece no meio de uma
+# passada de `lock_accounts`. Para respeitar a ordem global dos mutexes (e não travar com
+# `lock_stores` ou com a compensação do pipeline, que também seguem essa ordem), antes da
+# passada `reserves_to_lock` estima o débito máximo do lote em cada reserva e inclui na
+# passada as reservas cujas fatias podem precisar de reposição. Se a estimativa falhar
+# (a taxa de câmbio mudou no meio do lote), o mutex fora de ordem só é tentado, nunca
+# esperado: ocupado, o câmbio falha como por falta de reservas.
+# Durabilidade: no journal e nos snapshots, o dinheiro das fatias pertence à reserva. As
+# movimentações das fatias são registradas como `slice_changed` (reposição e devolução
+# junto com a variação da reserva compartilhada, no mesmo bloco do journal; débitos do
+# câmbio junto com a liquidação, em `journal_spent`), e a recuperação as soma à reserva.
+# Os checkpoints somam às reservas as fatias ainda não devolvidas (`outstanding`), lidas
+# com os stores travados. Assim, uma queda com fatias retidas não perde o dinheiro delas.
+# O dinheiro é conservado: o que sai da reserva compartilhada está em alguma fatia até ser
+# usado em uma transferência ou devolvido (ver `pulled`, `spent` e `returned`).
+# Um câmbio só falha quando a fatia e a reserva compartilhada não cobrem o valor; o saldo
+# retido nas fatias de outros processadores não é considerado.
+# O pipeline internacional (payment_system/international.py) não usa o cache: a etapa de
+# câmbio já isola o mutex das reservas em moeda estrangeira.
+
+# Fração do saldo da reserva compartilhada retirada a cada reposição de uma fatia
+reserve_slice_fraction = 0.01
+
+# A fatia é reposta quando o seu saldo fica abaixo desta fração da última reposição
+reserve_low_watermark = 0.25
+
+
+def _journal_batch(reserve: Account):
+    # bloco do journal da reserva: a variação dela e a da fatia ficam no mesmo quadro
+    journal = reserve._store.journal
+    return journal.batch() if journal is not None else nullcontext()
+
+
+# caches vivos, para `outstanding`
+_caches: "WeakSet[ReserveCache]" = WeakSet()
+_caches_lock = Lock()
+
+
+class ReserveCache:
+    """
+    Fatias locais das reservas em moeda estrangeira usadas por um processador.
+    Deve ser usado por uma única thread.
+    Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
+
+    ...
+
+    Atributos
+    ---------
+    slice_fraction : float
+        Fração do saldo da reserva compartilhada retirada a cada reposição.
+    low_watermark : float
+        Fração da última reposição abaixo da qual a fatia é reposta.
+    pulled : int
+        Total retirado das reservas compartilhadas.
+    spent : int
+        Total debitado das fatias por transferências.
+    returned : int
+        Total devolvido às reservas compartilhadas.
+
+    Métodos
+    -------
+    reserves_to_lock(demands: Iterable[Tuple[Account, int]]) -> List[Account]:
+        Reservas que devem entrar na passada de locks do próximo lote.
+    pass_finished() -> None:
+        Indica que a passada de locks do lote terminou.
+    withdraw(reserve: Account, amount: int) -> bool:
+        Debita `amount` da fatia local de `reserve`, repondo-a se necessário.
+    journal_spent() -> None:
+        Registra no journal os débitos das fatias desde a última chamada.
+    held() -> int:
+        Soma dos saldos de todas as fatias.
+    release() -> None:
+        Devolve todas as fatias às reservas compartilhadas.
+    """
+
+    def __init__(self, slice_fraction: float = reserve_slice_fraction,
+                 low_watermark: float = reserve_low_watermark):
+        self.slice_fraction = slice_fraction
+        self.low_watermark = low_watermark
+        self.pulled = 0
+        self.spent = 0
+        self.returned = 0
+        # reserve.key -> [conta de reservas, saldo da fatia, última reposição]
+        self._slices: Dict[Tuple[int, int], list] = {}
+        # reservas cujo mutex faz parte da passada de locks atual
+        self._locked: Set[Tuple[int, int]] = set()
+        # reserve.key -> [conta de reservas, débitos ainda não registrados no journal]
+        self._unjournaled: Dict[Tuple[int, int], list] = {}
+        with _caches_lock:
+            _caches.add(self)
+
+    def _entry(self, reserve: Account) -> list:
+        entry = self._slices.get(reserve.key)
+        if entry is None:
+            entry = self._slices[reserve.key] = [reserve, 0, 0]
+        return entry
+
+    def reserves_to_lock(self, demands: Iterable[Tuple[Account, int]]) -> List[Account]:
+        """
+        Recebe, por reserva, um limite superior do que o próximo lote pode debitar dela e
+        retorna as reservas cujas fatias podem precisar de reposição durante o lote. Elas
+        devem entrar na passada de locks do lote; a reposição delas usa o mutex já
+        adquirido.
+        """
+        self._locked.clear()
+        reserves = []
+        for reserve, amount in demands:
+            entry = self._entry(reserve)
+            if entry[1] - amount < entry[2] * self.low_watermark:
+                self._locked.add(reserve.key)
+                reserves.append(reserve)
+        return reserves
+
+    def pass_finished(self) -> None:
+        self._locked.clear()
+
+    def _refill(self, entry: list, needed: int) -> None:
+        # o chamador possui o mutex da reserva
+        reserve = entry[0]
+        available = reserve.balance
+        take = min(available, max(int(available * self.slice_fraction), needed))
+        if take <= 0:
+            return
+        store = reserve._store
+        with _journal_batch(reserve):
+            reserve.balance = available - take
+            if store.journal is not None:
+                store.journal.slice_changed(store, reserve._index, take)
+        entry[1] += take
+        entry[2] = take
+        self.pulled += take
+        RESERVES_PULLED.add(take)
+
+    def withdraw(self, reserve: Account, amount: int) -> bool:
+        """
+        Debita `amount` da fatia local de `reserve`. Se o saldo restante ficar abaixo da
+        marca mínima, repõe a fatia antes (com pelo menos o necessário para o débito).
+        Deve ser chamado dentro da passada de locks de um lote (ver `reserves_to_lock`).
+        Retorna False se nem a fatia nem a reserva compartilhada tiverem saldo suficiente.
+        """
+        entry = self._entry(reserve)
+        if entry[1] - amount < entry[2] * self.low_watermark:
+            if reserve.key in self._locked:
+                self._refill(entry, amount - entry[1])
+            elif reserve.lock.acquire(blocking=False):
+                # fora da ordem global: só tenta o mutex (ver o comentário do módulo)
+                try:
+                    self._refill(entry, amount - entry[1])
+                finally:
+                    reserve.lock.release()
+        if entry[1] < amount:
+            return False
+        entry[1] -= amount
+        self.spent += amount
+        RESERVES_SPENT.add(amount)
+        pending = self._unjournaled.get(reserve.key)
+        if pending is None:
+            pending = self._unjournaled[reserve.key] = [reserve, 0]
+        pending[1] += amount
+        return True
+
+    def journal_spent(self) -> None:
+        """
+        Registra no journal os débitos das fatias desde a última chamada. Deve ser chamado
+        junto com os demais registros da liquidação (ver `Ledger.commit`).
+        """
+        for reserve, amount in self._unjournaled.values():
+            store = reserve._store
+            if store.journal is not None:
+                store.journal.slice_changed(store, reserve._index, -amount)
+        self._unjournaled.clear()
+
+    def held(self) -> int:
+        return sum(entry[1] for entry in list(self._slices.values()))
+
+    def release(self) -> None:
+        for entry in self._slices.values():
+            if entry[1]:
+                reserve, held = entry[0], entry[1]
+                store = reserve._store
+                with reserve.lock, _journal_batch(reserve):
+                    reserve._deposit(held)
+                    if store.journal is not None:
+                        store.journal.slice_changed(store, reserve._index, -held)
+                    entry[1] = 0
+                self.returned += held
+                RESERVES_RETURNED.add(held)
+
+
+def outstanding() -> Dict[Tuple[int, int], int]:
+    """
+    Soma, por reserva (`Account.key`), dos saldos das fatias ainda não devolvidas de todos
+    os caches. Para um valor consistente com os saldos das reservas, deve ser lido com os
+    stores travados (`lock_stores`) ou depois que os processadores encerraram.
+    """
+    with _caches_lock:
+        caches = list(_caches)
+    totals: Dict[Tuple[int, int], int] = {}
+    for cache in caches:
+        for key, entry in list(cache._slices.items()):
+            if entry[1]:
+                totals[key] = totals.get(key, 0) + entry[1]
+    return totals
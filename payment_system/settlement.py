@@ -0,0 +1,311 @@
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+from globals import *
+from payment_system import journal
+from payment_system.account import Account, lock_accounts
+from utils.currency import RATES
+from utils.metrics import SETTLED_TRANSACTIONS
+from utils.money import EXCHANGE_FEE_BP, OVERDRAFT_FEE_BP, convert, fee
+from utils.transaction import Transaction, TransactionStatus
+
+if TYPE_CHECKING:
+    from payment_system.reserve_cache import ReserveCache
+
+# Liquidação de transações em lote.
+#
+# Um lote de transações é liquidado com uma única passada de locks: todas as contas
+# envolvidas (origem, destino e reservas) são travadas juntas, em ordem determinística,
+# os saldos são copiados para um `Ledger`, as transações são aplicadas sobre essas cópias
+# na ordem do lote e, ao final, a variação líquida de cada conta é gravada uma única vez.
+# Como as transações são avaliadas em ordem sobre os saldos de trabalho, o resultado
+# (inclusive as falhas por saldo/limite insuficiente) é idêntico ao processamento
+# sequencial das mesmas transações.
+#
+# No modo de processos (payment_system/sharded.py), a conta de destino de uma transação
+# internacional pode pertencer a um banco de outro processo (`bank.remote_inbox`). Nesse
+# caso o crédito não é aplicado aqui: ele é acumulado no Ledger e enviado, depois que os
+# mutexes foram liberados, à fila de entrada do processo dono do banco de destino.
+# Os créditos remotos também são compensados por conta: cada conta remota recebe um único
+# crédito líquido por lote.
+#
+# Com um ReserveCache (payment_system/reserve_cache.py), o câmbio debita a fatia local do
+# processador em vez da reserva compartilhada em moeda estrangeira, cujo mutex então só
+# faz parte da passada de locks se a fatia puder precisar de reposição durante o lote.
+#
+# Com um journal ativo (payment_system/journal.py), as variações de saldo do lote e as
+# transações concluídas são registradas juntas (`journal.batch`), ainda com os mutexes
+# adquiridos: a recuperação nunca reaplica só parte de uma liquidação.
+
+
+class Ledger:
+    """
+    Saldos de trabalho das contas tocadas por um lote de transações.
+    O chamador deve possuir os mutexes de todas as contas usadas até o `commit()`.
+    `reserve_cache`, se informado, é a fonte dos débitos de câmbio (ver `exchange`).
+
+    ...
+
+    Métodos
+    -------
+    balance(acc: Account) -> int:
+        Saldo de trabalho da conta.
+    withdraw(acc: Account, amount: int) -> bool:
+        Retira `amount` do saldo de trabalho, respeitando o cheque especial da conta.
+    deposit(acc: Account, amount: int) -> None:
+        Adiciona `amount` ao saldo de trabalho.
+    credit(bank, index: int, amount: int) -> None:
+        Credita `amount` na conta `index` de `bank`, local ou de outro processo.
+    commit() -> None:
+        Aplica a variação líquida de cada conta ao seu saldo real.
+    send_remote_credits() -> None:
+        Envia os créditos destinados a bancos de outros processos.
+    """
+
+    def __init__(self, reserve_cache: Optional["ReserveCache"] = None):
+        self.reserve_cache = reserve_cache
+        # acc.key -> [conta, saldo inicial, saldo de trabalho]
+        self._entries: Dict[Tuple[int, int], list] = {}
+        # _id do banco remoto -> {índice da conta: valor líquido}
+        self._remote: Dict[int, Dict[int, int]] = {}
+
+    def _entry(self, acc: Account) -> list:
+        entry = self._entries.get(acc.key)
+        if entry is None:
+            entry = self._entries[acc.key] = [acc, acc.balance, acc.balance]
+        return entry
+
+    def balance(self, acc: Account) -> int:
+        return self._entry(acc)[2]
+
+    def withdraw(self, acc: Account, amount: int) -> bool:
+        entry = self._entry(acc)
+        if entry[2] - amount < -acc.overdraft_limit:
+            return False
+        entry[2] -= amount
+        return True
+
+    def deposit(self, acc: Account, amount: int) -> None:
+        self._entry(acc)[2] += amount
+
+    def credit(self, bank, index: int, amount: int) -> None:
+        if bank.remote_inbox is None:
+            self.deposit(bank.accounts[index], amount)
+        else:
+            credits = self._remote.setdefault(bank._id, {})
+            credits[index] = credits.get(index, 0) + amount
+
+    def commit(self) -> None:
+        for acc, start, current in self._entries.values():
+            if current != start:
+                acc.balance += current - start
+        if self.reserve_cache is not None:
+            self.reserve_cache.journal_spent()
+
+    def send_remote_credits(self) -> None:
+        # não deve ser chamado com mutexes de contas adquiridos (put pode bloquear)
+        for bank_id, credits in self._remote.items():
+            banks[bank_id].remote_inbox.put(("credit", bank_id, list(credits.items())))
+        self._remote.clear()
+
+
+def accounts_for(transaction: Transaction, cached_reserves: bool = False) -> List[Account]:
+    """
+    Retorna todas as contas cujo mutex é necessário para liquidar `transaction`
+    (sem as reservas em moeda estrangeira, se elas vêm de um ReserveCache).
+    """
+    accounts = origin_accounts(transaction) + destination_accounts(transaction)
+    if is_international(transaction) and not cached_reserves:
+        accounts += fx_accounts(transaction)
+    return accounts
+
+
+def fx_demands(transactions: Sequence[Transaction]) -> List[Tuple[Account, int]]:
+    """
+    Para cada reserva em moeda estrangeira usada por `transactions`, um limite superior do
+    que o câmbio delas pode debitar (o valor convertido sem o desconto das taxas).
+    """
+    demands: Dict[Tuple[int, int], list] = {}
+    for transaction in transactions:
+        if not is_international(transaction):
+            continue
+        origin_bank = banks[transaction.origin[0]]
+        reserve = origin_bank.reserves[transaction.currency]
+        _, fixed_rate = RATES.pair(origin_bank.currency, transaction.currency)
+        demand = demands.setdefault(reserve.key, [reserve, 0])
+        demand[1] += convert(transaction.amount, fixed_rate)
+    return [(reserve, amount) for reserve, amount in demands.values()]
+
+
+def is_international(transaction: Transaction) -> bool:
+    return transaction.origin[0] != transaction.destination[0]
+
+
+# Etapas da liquidação. Cada etapa altera apenas saldos de trabalho de um Ledger e exige
+# os mutexes das contas indicadas; `settle_transaction` executa todas em sequência sob os
+# mesmos mutexes, e o pipeline internacional (payment_system/international.py) executa
+# cada uma em uma fila própria.
+
+def debit_origin(ledger: Ledger, transaction: Transaction) -> bool:
+    """
+    Retira o valor da conta de origem e calcula as taxas. Em transações internacionais, o
+    valor fica retido nas reservas em moeda nacional do banco de origem até o câmbio.
+    Exige as contas de `origin_accounts`. Retorna False se não houver saldo/limite.
+    """
+    origin_bank = banks[transaction.origin[0]]
+    origin_acc = origin_bank.accounts[transaction.origin[1]]
+    national_reserve = origin_bank.reserves[origin_bank.currency]
+
+    # tentativa de saque: recebe valor booleano
+    if (not ledger.withdraw(origin_acc, transaction.amount)):
+        # caso não haja dinheiro suficiente na conta
+        return False
+
+    # transaction.taxes inicia com valor 0
+    if (ledger.balance(origin_acc) < 0):
+        # foi usado cheque especial -> 5% de taxa
+        transaction.taxes = fee(transaction.amount, OVERDRAFT_FEE_BP)
+
+    if not is_international(transaction):
+        # a taxa do cheque especial fica nas reservas do banco, de modo que nenhum valor
+        # é criado ou destruído
+        ledger.deposit(national_reserve, transaction.taxes)
+        return True
+
+    # transfere o valor em moeda nacional para a conta de reservas do banco
+    ledger.deposit(national_reserve, transaction.amount)
+
+    # soma taxa do cheque especial à taxa de transações internacionais (1%),
+    # que será descontada do valor final convertido em moeda estrangeira
+    transaction.taxes += fee(transaction.amount, EXCHANGE_FEE_BP)
+    return True
+
+
+def refund_origin(ledger: Ledger, transaction: Transaction) -> None:
+    """
+    Compensação de `debit_origin` de uma transação internacional cujo câmbio falhou:
+    devolve o valor retido nas reservas à conta de origem (sem taxas).
+    Exige as contas de `origin_accounts`.
+    """
+    origin_bank = banks[transaction.origin[0]]
+    ledger.deposit(origin_bank.reserves[origin_bank.currency], -transaction.amount)
+    ledger.deposit(origin_bank.accounts[transaction.origin[1]], transaction.amount)
+    transaction.taxes = 0
+
+
+def refund_exchange(ledger: Ledger, transaction: Transaction, value: int) -> None:
+    """
+    Compensação de `exchange`: devolve `value` às reservas em moeda estrangeira do banco
+    de origem. Exige as contas de `fx_accounts`.
+    """
+    ledger.deposit(banks[transaction.origin[0]].reserves[transaction.currency], value)
+
+
+def exchange(ledger: Ledger, transaction: Transaction) -> Optional[int]:
+    """
+    Converte o valor (já descontadas as taxas) para a moeda de destino e o retira das
+    reservas em moeda estrangeira do banco de origem (ou da fatia local delas, se o ledger
+    tem um ReserveCache). Exige as contas de `fx_accounts`, exceto com ReserveCache.
+    Retorna o valor convertido, ou None se as reservas forem insuficientes.
+    """
+    origin_bank = banks[transaction.origin[0]]
+
+    # valor que será convertido (com o desconto das taxas)
+    value_to_convert = transaction.amount - transaction.taxes
+
+    # taxa de conversão entre as moedas (as duas formas lidas da mesma matriz)
+    transaction.exchange_fee, fixed_rate = RATES.pair(
+        origin_bank.currency, transaction.currency)
+
+    # valor final na nova moeda (em ponto fixo, arredondado para baixo)
+    final_value = convert(value_to_convert, fixed_rate)
+
+    # retira o valor das reservas internacionais do banco
+    reserve = origin_bank.reserves[transaction.currency]
+    if ledger.reserve_cache is not None:
+        if not ledger.reserve_cache.withdraw(reserve, final_value):
+            return None
+    elif not ledger.withdraw(reserve, final_value):
+        return None
+    return final_value
+
+
+def credit_destination(ledger: Ledger, transaction: Transaction, value: int) -> None:
+    """
+    Deposita `value` na conta de destino. Exige as contas de `destination_accounts`.
+    """
+    ledger.credit(banks[transaction.destination[0]], transaction.destination[1], value)
+
+
+def origin_accounts(transaction: Transaction) -> List[Account]:
+    origin_bank = banks[transaction.origin[0]]
+    return [origin_bank.accounts[transaction.origin[1]],
+            origin_bank.reserves[origin_bank.currency]]
+
+
+def fx_accounts(transaction: Transaction) -> List[Account]:
+    return [banks[transaction.origin[0]].reserves[transaction.currency]]
+
+
+def destination_accounts(transaction: Transaction) -> List[Account]:
+    destination_bank = banks[transaction.destination[0]]
+    if destination_bank.remote_inbox is not None:
+        # o crédito é aplicado pelo processo dono do banco
+        return []
+    return [destination_bank.accounts[transaction.destination[1]]]
+
+
+def settle_transaction(ledger: Ledger, transaction: Transaction) -> TransactionStatus:
+    """
+    Aplica `transaction` sobre os saldos de trabalho de `ledger` e retorna o status
+    resultante. Segue as regras de taxas e câmbio descritas no README.md, com valores
+    inteiros em centavos e o arredondamento definido em utils/money.py.
+    Se as reservas em moeda estrangeira forem insuficientes, a retirada da origem é
+    desfeita e a transação falha.
+    """
+    if not debit_origin(ledger, transaction):
+        return TransactionStatus.FAILED
+
+    if not is_international(transaction):
+        # Transação nacional na mesma moeda
+        credit_destination(ledger, transaction, transaction.amount - transaction.taxes)
+        return TransactionStatus.SUCCESSFUL
+
+    # Transação internacional
+    final_value = exchange(ledger, transaction)
+    if final_value is None:
+        refund_origin(ledger, transaction)
+        return TransactionStatus.FAILED
+    credit_destination(ledger, transaction, final_value)
+    return TransactionStatus.SUCCESSFUL
+
+
+def settle_batch(transactions: Sequence[Transaction],
+                 reserve_cache: Optional["ReserveCache"] = None) -> List[TransactionStatus]:
+    """
+    Liquida `transactions` em ordem, travando todas as contas envolvidas uma única vez.
+    Os status das transações só são definidos depois que os saldos foram gravados.
+    Com `reserve_cache`, o câmbio usa as fatias locais de reservas do chamador.
+    """
+    cached = reserve_cache is not None
+    accounts = [acc for transaction in transactions
+                for acc in accounts_for(transaction, cached)]
+    if cached:
+        accounts += reserve_cache.reserves_to_lock(fx_demands(transactions))
+    ledger = Ledger(reserve_cache)
+    try:
+        with lock_accounts(*accounts):
+            statuses = [settle_transaction(ledger, transaction)
+                        for transaction in transactions]
+            with journal.batch():
+                ledger.commit()
+                wal = journal.current()
+                if wal is not None:
+                    wal.transactions_settled(transactions, statuses)
+    finally:
+        if cached:
+            reserve_cache.pass_finished()
+    ledger.send_remote_credits()
+    SETTLED_TRANSACTIONS.add(len(transactions))
+    for transaction, status in zip(transactions, statuses):
+        transaction.set_status(status)
+    return statuses
@@ -0,0 +1,232 @@
+import multiprocessing, os, time
+from dataclasses import dataclass
+from datetime import timedelta
+from logging import INFO
+from queue import Empty
+from threading import Thread
+from typing import Dict, List, Optional, Tuple
+
+from globals import *
+from payment_system.account import AccountStore, CurrencyReserves
+from payment_system.bank import Bank
+from payment_system.payment_processor import PaymentProcessor
+from payment_system.transaction_generator import TransactionGenerator
+from payment_system.workloads import WORKLOADS, generator_rng
+from utils.clock import RealClock, use
+from utils.currency import Currency
+from utils import lockprof
+from utils.logger import CH, LOGGER, set_overflow_policy, set_sampling
+
+# Modo de processos: os bancos são divididos entre processos (shards), cada um com os seus
+# próprios TransactionGenerators, PaymentProcessors e GIL.
+#
+# * Os saldos de todos os bancos (contas dos clientes e reservas) ficam em memória
+#   compartilhada (AccountStore.share). Todo processo mapeia todos os bancos, mas apenas o
+#   dono de um banco altera os saldos dele; por isso os mutexes das contas continuam
+#   locais a cada processo.
+# * O único efeito de uma transação sobre um banco de outro processo é o crédito na conta
+#   de destino de uma transação internacional. Esses créditos são enviados à fila de
+#   entrada (multiprocessing.Queue) do processo dono, e aplicados por uma thread dele.
+# * Ao final, cada processo avisa os demais ("done") depois de encerrar os seus
+#   processadores; um processo só termina depois de receber o aviso de todos os outros,
+#   de modo que nenhum crédito em trânsito é perdido. O processo principal então verifica
+#   a conservação do dinheiro: para cada moeda, a soma dos saldos das contas e das reservas
+#   de todos os bancos não muda.
+# As contas são fixas neste modo (nenhuma conta é criada durante a simulação).
+
+# Número padrão de processos
+default_shards = min(len(Currency), os.cpu_count() or 1)
+
+
+@dataclass(frozen=True)
+class BankSpec:
+    """
+    Descrição de um banco em memória compartilhada, enviada aos processos.
+    """
+
+    _id: int
+    currency: Currency
+    n_accounts: int
+    accounts_shm: str
+    reserves_shm: str
+    shard: int
+
+
+def share_banks(banks: List[Bank], shards: int) -> List[BankSpec]:
+    """
+    Move os saldos de `banks` para memória compartilhada e distribui os bancos entre
+    `shards` processos.
+    """
+    return [BankSpec(bank._id, bank.currency, len(bank.accounts), bank.accounts.share(),
+                     bank.reserves.store.share(), bank._id % shards)
+            for bank in banks]
+
+
+def attach_banks(specs: List[BankSpec], shard: int,
+                 inboxes: List[multiprocessing.Queue]) -> List[Bank]:
+    """
+    Reconstrói, em um processo, os bancos descritos por `specs` sobre a memória
+    compartilhada. Os bancos de outros processos recebem a fila de entrada do seu dono.
+    """
+    result = []
+    for spec in specs:
+        bank = Bank(_id=spec._id, currency=spec.currency)
+        bank.accounts = AccountStore.attach(
+            spec._id, spec.currency, spec.accounts_shm, spec.n_accounts)
+        bank.reserves = CurrencyReserves(spec._id, AccountStore.attach(
+            spec._id, None, spec.reserves_shm, len(Currency), stripes=len(Currency)))
+        if spec.shard != shard:
+            bank.remote_inbox = inboxes[spec.shard]
+        result.append(bank)
+    return result
+
+
+def release_banks(banks: List[Bank], unlink: bool = False) -> None:
+    for bank in banks:
+        bank.accounts.release(unlink)
+        bank.reserves.store.release(unlink)
+
+
+def money_supply(banks: List[Bank]) -> Dict[Currency, int]:
+    """
+    Soma, por moeda, os saldos das contas dos clientes e das reservas de todos os bancos.
+    """
+    totals = {currency: 0 for currency in Currency}
+    for bank in banks:
+        totals[bank.currency] += sum(bank.accounts._balances)
+        for reserve in bank.reserves:
+            totals[reserve.currency] += reserve.balance
+    return totals
+
+
+def _receive_credits(inbox: multiprocessing.Queue, peers: int) -> None:
+    # aplica os créditos enviados por outros processos até receber o "done" de todos eles
+    while peers:
+        message = inbox.get()
+        if message[0] == "done":
+            peers -= 1
+            continue
+        _, bank_id, credits = message
+        accounts = banks[bank_id].accounts
+        for index, amount in credits:
+            acc = accounts[index]
+            with acc.lock:
+                acc._deposit(amount)
+
+
+def _shard_main(shard: int, specs: List[BankSpec], inboxes: List[multiprocessing.Queue],
+                results: multiprocessing.Queue, stop, config: Dict) -> None:
+    LOGGER.setLevel(config["log_level"])
+    CH.setLevel(config["log_level"])
+    set_overflow_policy(config["log_policy"])
+    set_sampling(INFO, config["log_sample"])
+    use(RealClock(config["time_unit"]))
+    if config["lockprof"]:
+        lockprof.enable()
+
+    banks.extend(attach_banks(specs, shard, inboxes))
+    owned = [bank for bank, spec in zip(banks, specs) if spec.shard == shard]
+    receiver = Thread(target=_receive_credits, args=(inboxes[shard], len(inboxes) - 1),
+                      name=f"Inbox-{shard}")
+    receiver.start()
+
+    threads = []
+    for bank in owned:
+        bank.open()
+        threads.append(TransactionGenerator(
+            _id=bank._id, bank=bank, rng=generator_rng(config["seed"], bank._id),
+            workload=WORKLOADS[config["workload"]]))
+        for k in range(config["processors_per_bank"]):
+            threads.append(PaymentProcessor(_id=bank._id + k * len(specs), bank=bank,
+                                            batch_settlement=config["batch"]))
+    for thread in threads:
+        thread.start()
+    LOGGER.info(f"Processo {shard} (pid {os.getpid()}) iniciado com os bancos "
+                f"{[bank._id for bank in owned]}")
+
+    stop.wait()
+    for bank in owned:
+        bank.stop_accepting()
+    if config["drain"] is not None:
+        deadline = time.perf_counter() + config["drain"]
+        for bank in owned:
+            if not bank.drain(max(0.0, deadline - time.perf_counter())):
+                LOGGER.warning(
+                    f"Banco {bank._id} não liquidou todas as transações dentro do prazo de drain")
+    for bank in owned:
+        bank.close()
+    for thread in threads:
+        thread.join()
+
+    # todos os créditos deste processo já foram enfileirados antes do aviso
+    for other, inbox in enumerate(inboxes):
+        if other != shard:
+            inbox.put(("done", shard))
+    receiver.join()
+
+    for bank in owned:
+        bank.latency_report()
+    lockprof.report()
+    pending = [(bank._id, *bank.info_transaction_incompleted()) for bank in owned]
+    results.put((shard, pending))
+    release_banks(banks)
+
+
+def run_sharded(banks: List[Bank], duration: float, shards: int = default_shards,
+                processors_per_bank: int = 3, batch_settlement: bool = False,
+                drain: Optional[float] = None, log_policy: str = "drop",
+                log_sample: int = 1, time_unit: float = time_unit, workload: str = "uniform",
+                seed: Optional[int] = None) -> List[Tuple[int, int, timedelta]]:
+    """
+    Executa a simulação de `banks` por `duration` segundos em `shards` processos.
+    Retorna, para cada banco, (_id, transações não processadas, tempo médio delas na fila).
+    Os saldos finais continuam acessíveis em `banks` até `release_banks(banks, unlink=True)`.
+    """
+    shards = max(1, min(shards, len(banks)))
+    specs = share_banks(banks, shards)
+    supply_before = money_supply(banks)
+
+    ctx = multiprocessing.get_context("spawn")
+    inboxes = [ctx.Queue() for _ in range(shards)]
+    results = ctx.Queue()
+    stop = ctx.Event()
+    config = {"log_level": LOGGER.getEffectiveLevel(), "log_policy": log_policy,
+              "log_sample": log_sample, "processors_per_bank": processors_per_bank,
+              "batch": batch_settlement, "drain": drain, "time_unit": time_unit,
+              "workload": workload, "seed": seed, "lockprof": lockprof.enabled()}
+    processes = [ctx.Process(target=_shard_main, name=f"Shard-{shard}",
+                             args=(shard, specs, inboxes, results, stop, config))
+                 for shard in range(shards)]
+    for process in processes:
+        process.start()
+
+    time.sleep(duration)
+    stop.set()
+
+    # os resultados são lidos antes do join: um processo só termina depois de esvaziar
+    # a sua fila de saída
+    pending = []
+    received = 0
+    while received < shards:
+        try:
+            _, shard_pending = results.get(timeout=1)
+        except Empty:
+            failed = [p.name for p in processes if p.exitcode not in (None, 0)]
+            if failed:
+                LOGGER.error(f"Processos encerrados com erro: {failed}")
+                break
+            continue
+        pending.extend(shard_pending)
+        received += 1
+    for process in processes:
+        process.join()
+
+    supply_after = money_supply(banks)
+    for currency in Currency:
+        before, after = supply_before[currency], supply_after[currency]
+        if before == after:
+            LOGGER.info(f"Conservação de {currency.name}: OK ({before} centavos)")
+        else:
+            LOGGER.error(
+                f"Conservação de {currency.name} violada: {before} -> {after} centavos")
+    return sorted(pending)
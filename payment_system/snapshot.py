@@ -0,0 +1,302 @@
+import mmap, os, struct, threading, time
+from array import array
+from typing import List, Optional, Tuple
+
+from globals import *
+from payment_system import reserve_cache
+from payment_system.account import AccountStore, dirty_page_bits, lock_stores
+from utils.logger import LOGGER
+
+# Snapshots (checkpoints) das contas e reservas de todos os bancos.
+#
+# Um checkpoint é tirado sem parar os processadores: `lock_stores` trava, em ordem global,
+# todos os stores de todos os bancos só pelo tempo de copiar os arrays (uma cópia de
+# memória por store, ou por página alterada); a escrita no arquivo acontece depois, já sem
+# nenhum mutex. Como os registros do journal são anexados com o mutex da conta adquirido,
+# o LSN lido com os stores travados (`Journal.cut`) é exatamente o do estado copiado.
+# Checkpoints incrementais escrevem só as páginas (2**dirty_page_bits contas) marcadas no
+# bitmap `dirty` dos stores desde o checkpoint anterior; a cada `snapshot_full_every`
+# incrementais, um checkpoint completo substitui os anteriores.
+# O dinheiro retido nas fatias dos ReserveCaches (payment_system/reserve_cache.py) é somado
+# às reservas de onde saiu (como no journal). Os débitos das fatias não marcam páginas, de
+# modo que os stores de reservas (poucas contas) são sempre copiados inteiros.
+#
+# Arquivos (em um diretório, numerados em sequência): `<n>.full` e `<n>.delta`, gravados
+# em um arquivo temporário e renomeados, de modo que um checkpoint pela metade nunca é lido.
+# Formato (little-endian), com os arrays alinhados em 8 bytes para serem lidos direto de
+# um mmap:
+#   cabeçalho: magic, tipo (0 completo, 1 incremental), bits por página, LSN, nº de stores
+#   por store: banco, kind (0 clientes, 1 reservas), nº de contas, nº de páginas, offset
+#   completo: no offset, os n saldos seguidos dos n limites (int64)
+#   incremental: no offset, os índices das páginas (uint32, completados até 8 bytes) e,
+#   para cada página, os saldos seguidos dos limites das contas dela (int64)
+# A recuperação (`restore`) mapeia o último checkpoint completo, aplica os incrementais
+# posteriores e retorna o LSN a partir do qual o journal deve ser reaplicado.
+
+# Intervalo entre checkpoints, em segundos (tempo real)
+snapshot_interval = 1.0
+
+# Número de checkpoints incrementais entre dois completos
+snapshot_full_every = 8
+
+_MAGIC = b"PAYSNAP1"
+_HEADER = struct.Struct("<8sBBxxQI4x")
+_STORE = struct.Struct("<HBxIII4x")
+_FULL, _DELTA = 0, 1
+
+
+def _stores(banks: List) -> List[Tuple[int, int, AccountStore]]:
+    stores = [(bank._id, 0, bank.accounts) for bank in banks]
+    return stores + [(bank._id, 1, bank.reserves.store) for bank in banks]
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _page_span(page: int, n: int) -> Tuple[int, int]:
+    first = page << dirty_page_bits
+    return first, min(n, first + (1 << dirty_page_bits))
+
+
+def _fold_slices(store: AccountStore, n: int, pages: Optional[List[int]], data: list,
+                 slices: dict) -> None:
+    # soma aos saldos copiados das reservas as fatias retiradas delas
+    spans = [(0, n)] if pages is None else [_page_span(page, n) for page in pages]
+    for (first, end), balances in zip(spans, data[::2]):
+        for index in range(first, end):
+            balances[index - first] += slices.get((id(store), index), 0)
+
+
+class Checkpointer(threading.Thread):
+    """
+    Thread que tira checkpoints das contas e reservas de `banks` a cada `interval`
+    segundos (tempo real) e os grava em `directory`.
+    Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
+
+    ...
+
+    Atributos
+    ---------
+    directory : str
+        Diretório dos arquivos de checkpoint.
+    banks : List[Bank]
+        Bancos cujas contas e reservas são copiadas.
+    journal : Optional[Journal]
+        Journal cortado (e compactado) no LSN de cada checkpoint.
+    interval : float
+        Intervalo entre checkpoints, em segundos.
+    full_every : int
+        Número de checkpoints incrementais entre dois completos.
+    checkpoints : int
+        Número de checkpoints gravados.
+    last_pause_ns : int
+        Tempo (em ns) com os stores travados no último checkpoint.
+
+    Métodos
+    -------
+    take(full: bool = False) -> str:
+        Tira um checkpoint imediatamente (completo se `full`) e retorna o arquivo gravado.
+    stop() -> None:
+        Tira um último checkpoint e encerra a thread.
+    """
+
+    def __init__(self, directory: str, banks: List, journal=None,
+                 interval: float = snapshot_interval, full_every: int = snapshot_full_every):
+        threading.Thread.__init__(self, name="Checkpointer", daemon=True)
+        self.directory = directory
+        self.banks = banks
+        self.journal = journal
+        self.interval = interval
+        self.full_every = full_every
+        self.checkpoints = 0
+        self.last_pause_ns = 0
+        # incrementais gravados desde o último completo (None: ainda não há completo)
+        self._deltas: Optional[int] = None
+        self._take_lock = threading.Lock()
+        self._stopped = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        files = _checkpoint_files(directory)
+        self._sequence = files[-1][1] + 1 if files else 0
+        for _, _, store in _stores(banks):
+            store.track_dirty_pages()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.take()
+
+    def _copy(self, full: bool) -> Tuple[int, list]:
+        stores = _stores(self.banks)
+        copied = []
+        started = time.perf_counter_ns()
+        with lock_stores(*(store for _, _, store in stores)):
+            lsn = self.journal.cut() if self.journal is not None else 0
+            slices = reserve_cache.outstanding()
+            for bank_id, kind, store in stores:
+                n = len(store._balances)
+                if full:
+                    pages = None
+                    data = [store._balances[:n], store._limits[:n]]
+                else:
+                    if kind == 1:
+                        pages = list(range((n + (1 << dirty_page_bits) - 1) >> dirty_page_bits))
+                    else:
+                        dirty = store.dirty
+                        pages = [page for page in range(len(dirty)) if dirty[page]]
+                    data = []
+                    for page in pages:
+                        first, end = _page_span(page, n)
+                        data += [store._balances[first:end], store._limits[first:end]]
+                if kind == 1:
+                    _fold_slices(store, n, pages, data, slices)
+                store.dirty[:] = bytes(len(store.dirty))
+                copied.append((bank_id, kind, n, pages, data))
+        self.last_pause_ns = time.perf_counter_ns() - started
+        return lsn, copied
+
+    def _write(self, kind: int, lsn: int, copied: list) -> str:
+        offset = _HEADER.size + _STORE.size * len(copied)
+        entries, bodies = [], []
+        for bank_id, store_kind, n, pages, data in copied:
+            body = b""
+            if pages is not None:
+                body = array('I', pages).tobytes()
+                body += bytes(_align(len(body)) - len(body))
+            body += b"".join(column.tobytes() for column in data)
+            entries.append(_STORE.pack(bank_id, store_kind, n,
+                                       len(pages) if pages is not None else 0, offset))
+            bodies.append(body)
+            offset += len(body)
+        path = os.path.join(self.directory,
+                            f"{self._sequence:010d}.{'full' if kind == _FULL else 'delta'}")
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, kind, dirty_page_bits, lsn, len(copied)))
+            f.writelines(entries)
+            f.writelines(bodies)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self._sequence += 1
+        return path
+
+    def take(self, full: bool = False) -> str:
+        with self._take_lock:
+            full = full or self._deltas is None or self._deltas >= self.full_every
+            lsn, copied = self._copy(full)
+            try:
+                path = self._write(_FULL if full else _DELTA, lsn, copied)
+            except OSError:
+                # as páginas copiadas já foram desmarcadas: o próximo precisa ser completo
+                self._deltas = None
+                raise
+            self.checkpoints += 1
+            if full:
+                self._deltas = 0
+                # os checkpoints anteriores ao completo não são mais necessários
+                for name, _, _ in _checkpoint_files(self.directory):
+                    if os.path.join(self.directory, name) != path:
+                        os.remove(os.path.join(self.directory, name))
+            else:
+                self._deltas += 1
+            if self.journal is not None:
+                self.journal.compact(lsn)
+            LOGGER.debug(f"Checkpoint {path} (stores travados por "
+                         f"{self.last_pause_ns / 1e6:.3f}ms)")
+            return path
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+        self.take()
+
+
+def _checkpoint_files(directory: str) -> List[Tuple[str, int, int]]:
+    # (nome, número, tipo) dos checkpoints de `directory`, em ordem
+    files = []
+    for name in os.listdir(directory):
+        stem, _, suffix = name.partition(".")
+        if stem.isdigit() and suffix in ("full", "delta"):
+            files.append((name, int(stem), _FULL if suffix == "full" else _DELTA))
+    return sorted(files, key=lambda item: item[1])
+
+
+def clear(directory: str) -> None:
+    """
+    Remove os checkpoints de `directory` (se ele existir).
+    """
+    if not os.path.isdir(directory):
+        return
+    for name, _, _ in _checkpoint_files(directory):
+        os.remove(os.path.join(directory, name))
+
+
+def restore(directory: str, banks: List) -> int:
+    """
+    Restaura as contas e reservas de `banks` (recém-criados, sem contas) a partir do último
+    checkpoint completo de `directory` e dos incrementais posteriores. Retorna o LSN do
+    estado restaurado (0 se não há checkpoint), a partir do qual o journal deve ser
+    reaplicado.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    files = _checkpoint_files(directory)
+    fulls = [i for i, (_, _, kind) in enumerate(files) if kind == _FULL]
+    if not fulls:
+        return 0
+    stores = {(bank_id, kind): store for bank_id, kind, store in _stores(banks)}
+    lsn = 0
+    for name, _, _ in files[fulls[-1]:]:
+        lsn = _apply(os.path.join(directory, name), stores)
+    return lsn
+
+
+def _apply(path: str, stores: dict) -> int:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            magic, kind, page_bits, lsn, n_stores = _HEADER.unpack_from(view, 0)
+            if magic != _MAGIC or page_bits != dirty_page_bits:
+                raise ValueError(f"{path} is not a compatible snapshot")
+            for i in range(n_stores):
+                bank_id, store_kind, n, n_pages, offset = _STORE.unpack_from(
+                    view, _HEADER.size + i * _STORE.size)
+                store = stores[(bank_id, store_kind)]
+                if kind == _FULL:
+                    _load_full(store, view, offset, n)
+                else:
+                    _load_pages(store, view, offset, n, n_pages)
+            return lsn
+        finally:
+            view.release()
+
+
+def _int64s(view: memoryview, offset: int, n: int) -> array:
+    values = array('q')
+    values.frombytes(view[offset:offset + 8 * n])
+    return values
+
+
+def _load_full(store: AccountStore, view: memoryview, offset: int, n: int) -> None:
+    store._balances = _int64s(view, offset, n)
+    store._limits = _int64s(view, offset + 8 * n, n)
+    store._published = n
+
+
+def _load_pages(store: AccountStore, view: memoryview, offset: int, n: int,
+                n_pages: int) -> None:
+    grow = n - len(store._balances)
+    if grow > 0:
+        store._balances.frombytes(bytes(8 * grow))
+        store._limits.frombytes(bytes(8 * grow))
+    pages = view[offset:offset + 4 * n_pages].cast('I')
+    position = offset + _align(4 * n_pages)
+    for page in pages:
+        first, end = _page_span(page, n)
+        count = end - first
+        store._balances[first:end] = _int64s(view, position, count)
+        store._limits[first:end] = _int64s(view, position + 8 * count, count)
+        position += 16 * count
+    pages.release()
+    store._published = n
@@ -1,15 +1,21 @@
-from random import randint
-import time
-from threading import Thread
+from random import Random
+from typing import List, Optional
 
 from globals import *
 from payment_system.bank import Bank
+from payment_system.workloads import Workload, uniform
 from utils.transaction import Transaction
 from utils.currency import Currency
 from utils.logger import LOGGER
+from utils.clock import ActorThread, monotonic_ns, sleep, sleep_units
+from utils.trace import TraceReader, TraceWriter
 
+# Número de transações inseridas de uma só vez na fila do banco pelo ReplayGenerator,
+# quando o trace é reproduzido na velocidade máxima
+replay_batch_size = 64
 
-class TransactionGenerator(Thread):
+
+class TransactionGenerator(ActorThread):
     """
     Uma classe para gerar e simular clientes de um banco por meio da geracão de transações bancárias.
     Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
@@ -22,6 +28,12 @@ class TransactionGenerator(Thread):
         Identificador do gerador de transações.
     bank: Bank
         Banco sob o qual o gerador de transações operará.
+    rng: Random
+        Gerador de números aleatórios das transferências (semeie-o para reproduzir a carga).
+    workload: Workload
+        Função que sorteia cada transferência (ver payment_system/workloads.py).
+    trace: Optional[TraceWriter]
+        Trace em que as transações aceitas pelo banco são gravadas (None para não gravar).
 
     Métodos
     -------
@@ -29,10 +41,14 @@ class TransactionGenerator(Thread):
         ....
     """
 
-    def __init__(self, _id: int, bank: Bank):
-        Thread.__init__(self)
+    def __init__(self, _id: int, bank: Bank, rng: Optional[Random] = None,
+                 workload: Workload = uniform, trace: Optional[TraceWriter] = None):
+        ActorThread.__init__(self)
         self._id = _id
         self.bank = bank
+        self.rng = rng or Random()
+        self.workload = workload
+        self.trace = trace
 
     def run(self):
         """
@@ -48,24 +64,19 @@ class TransactionGenerator(Thread):
 
         i = 0
         while operating:
-            # tenta pegar o semáforo de produção da fila de transações
-            self.bank.queue_sem_prod.acquire()
-            operating = banks[self.bank._id].operating
-            if (operating == False):
-                break
             # Cria nova transação e coloca na fila de transações
-            origin = (self.bank._id, randint(0, len(self.bank.accounts) - 1))
-            destination_bank = randint(0, 5)
-            destination = (destination_bank, randint(
-                0, len(self.bank.accounts) - 1))
-            amount = randint(100, 100000)
+            origin, destination, amount = self.workload(self.rng, self.bank)
             new_transaction = Transaction(
-                i, origin, destination, amount, currency=Currency(destination_bank+1))
-            banks[self.bank._id].transaction_queue_put(new_transaction)
-            # libera o semáforo para os consumidores
-            self.bank.queue_sem_cons.release()
+                i, origin, destination, amount, currency=Currency(destination[0]+1))
+            # bloqueia enquanto a fila estiver cheia; falha (e acorda imediatamente) se o
+            # banco parar de aceitar transações
+            if not banks[self.bank._id].transaction_queue_put(new_transaction):
+                break
+            if self.trace is not None:
+                self.trace.record(new_transaction)
             i += 1
-            time.sleep(0.2 * time_unit)
+            sleep_units(0.2)
+            operating = self.bank.operating and self.bank.accepting
 
         # print(self.name, self.is_alive())
         # for i in self.bank.transaction_queue:
@@ -73,3 +84,90 @@ class TransactionGenerator(Thread):
 
         LOGGER.info(
             f"O TransactionGenerator {self._id} do banco {self.bank._id} foi finalizado.")
+
+
+class ReplayGenerator(ActorThread):
+    """
+    Reproduz as transferências de um trace (ver utils/trace.py) que têm origem em um banco,
+    na ordem e no ritmo em que foram gravadas.
+    Se você adicionar novos atributos ou métodos, lembre-se de atualizar essa docstring.
+
+    ...
+
+    Atributos
+    ---------
+    _id : int
+        Identificador do gerador de transações.
+    bank: Bank
+        Banco de origem das transferências reproduzidas.
+    path: str
+        Arquivo do trace.
+    speed: float
+        Fator aplicado ao ritmo gravado (2.0 reproduz duas vezes mais rápido); 0 reproduz
+        na velocidade máxima, limitada apenas pela fila do banco.
+    replayed: int
+        Número de transações inseridas na fila do banco.
+    skipped: int
+        Número de transferências ignoradas por envolverem contas ou bancos inexistentes.
+
+    Métodos
+    -------
+    run():
+        Insere as transferências do trace na fila do banco até o trace acabar ou o banco
+        parar de aceitar transações.
+    """
+
+    def __init__(self, _id: int, bank: Bank, path: str, speed: float = 1.0):
+        ActorThread.__init__(self)
+        self._id = _id
+        self.bank = bank
+        self.path = path
+        self.speed = speed
+        self.replayed = 0
+        self.skipped = 0
+
+    def _valid(self, origin, destination) -> bool:
+        return (origin[1] < len(self.bank.accounts) and destination[0] < len(banks)
+                and destination[1] < len(banks[destination[0]].accounts))
+
+    def run(self):
+        LOGGER.info(f"Inicializado ReplayGenerator para o Banco Nacional {self.bank._id} "
+                    f"(trace {self.path})")
+        started_ns = monotonic_ns()
+        batch: List[Transaction] = []
+        with TraceReader(self.path) as reader:
+            for (_, destination_bank, origin_account, destination_account, currency,
+                 amount, timestamp_ns) in reader.records(self.bank._id):
+                if not (self.bank.operating and self.bank.accepting):
+                    break
+                origin = (self.bank._id, origin_account)
+                destination = (destination_bank, destination_account)
+                if not self._valid(origin, destination):
+                    self.skipped += 1
+                    continue
+                if self.speed:
+                    # espera o instante gravado (escalado por `speed`) da transferência
+                    delay_ns = timestamp_ns / self.speed - (monotonic_ns() - started_ns)
+                    if delay_ns > 0:
+                        sleep(delay_ns / 1e9)
+                transaction = Transaction(self.replayed + len(batch), origin, destination,
+                                          amount, currency=Currency(currency))
+                batch.append(transaction)
+                if self.speed and not self._put(batch):
+                    break
+                if len(batch) >= replay_batch_size and not self._put(batch):
+                    break
+            else:
+                self._put(batch)
+
+        LOGGER.info(
+            f"O ReplayGenerator {self._id} do banco {self.bank._id} foi finalizado "
+            f"({self.replayed} transações reproduzidas, {self.skipped} ignoradas).")
+
+    def _put(self, batch: List[Transaction]) -> bool:
+        # insere `batch` na fila do banco; False se o banco parou de aceitar transações
+        inserted = self.bank.transaction_queue_put_batch(batch) if batch else 0
+        self.replayed += inserted
+        complete = inserted == len(batch)
+        batch.clear()
+        return complete
@@ -0,0 +1,97 @@
+from random import Random
+from typing import Callable, Dict, Optional, Tuple
+
+from globals import *
+from payment_system.bank import Bank
+
+# Cargas de trabalho dos TransactionGenerators.
+# Uma carga de trabalho é uma função que, a partir do gerador de números aleatórios do
+# TransactionGenerator e do banco de origem, sorteia a próxima transferência:
+# (conta de origem, conta de destino, valor em centavos). Com um `Random` semeado, a
+# sequência de transferências de cada gerador é reproduzível.
+# A moeda da transferência é sempre a do banco de destino (ver TransactionGenerator).
+
+Transfer = Tuple[Tuple[int, int], Tuple[int, int], int]
+Workload = Callable[[Random, Bank], Transfer]
+
+# Faixa dos valores das transferências "normais"
+min_amount = 100
+max_amount = 100000
+
+# hot_account: número de contas quentes por banco e fração das transferências que as usam
+hot_accounts = 4
+hot_fraction = 0.8
+
+# cross_border_heavy: fração das transferências para outros bancos
+cross_border_fraction = 0.9
+
+# overdraft_heavy: faixa dos valores (acima do saldo inicial típico das contas)
+overdraft_min_amount = 50000
+overdraft_max_amount = 200000
+
+
+def _account(rng: Random, bank: Bank) -> int:
+    return rng.randint(0, len(bank.accounts) - 1)
+
+
+def uniform(rng: Random, bank: Bank) -> Transfer:
+    """
+    Origem, banco de destino, conta de destino e valor uniformes (a carga original).
+    """
+    origin = (bank._id, _account(rng, bank))
+    destination_bank = rng.randint(0, len(banks) - 1)
+    destination = (destination_bank, _account(rng, banks[destination_bank]))
+    return origin, destination, rng.randint(min_amount, max_amount)
+
+
+def hot_account(rng: Random, bank: Bank) -> Transfer:
+    """
+    Como `uniform`, mas `hot_fraction` das origens e dos destinos são uma das primeiras
+    `hot_accounts` contas do banco: poucas contas (e listras de mutexes) muito disputadas.
+    """
+    def pick(target: Bank) -> int:
+        if rng.random() < hot_fraction:
+            return rng.randint(0, min(hot_accounts, len(target.accounts)) - 1)
+        return _account(rng, target)
+
+    destination_bank = rng.randint(0, len(banks) - 1)
+    return ((bank._id, pick(bank)), (destination_bank, pick(banks[destination_bank])),
+            rng.randint(min_amount, max_amount))
+
+
+def cross_border_heavy(rng: Random, bank: Bank) -> Transfer:
+    """
+    Como `uniform`, mas `cross_border_fraction` das transferências vão para outro banco
+    (câmbio e reservas em moeda estrangeira em quase todas as transações).
+    """
+    destination_bank = bank._id
+    if len(banks) > 1 and rng.random() < cross_border_fraction:
+        destination_bank = rng.choice([i for i in range(len(banks)) if i != bank._id])
+    return ((bank._id, _account(rng, bank)),
+            (destination_bank, _account(rng, banks[destination_bank])),
+            rng.randint(min_amount, max_amount))
+
+
+def overdraft_heavy(rng: Random, bank: Bank) -> Transfer:
+    """
+    Como `uniform`, mas com valores altos: a maioria das transferências usa cheque
+    especial ou falha por falta de limite.
+    """
+    origin, destination, _ = uniform(rng, bank)
+    return origin, destination, rng.randint(overdraft_min_amount, overdraft_max_amount)
+
+
+def generator_rng(seed: Optional[int], bank_id: int) -> Random:
+    """
+    Retorna o gerador de números aleatórios do TransactionGenerator do banco `bank_id`:
+    semeado a partir de `seed` (uma sequência diferente por banco), ou não semeado.
+    """
+    return Random() if seed is None else Random(f"{seed}:{bank_id}")
+
+
+WORKLOADS: Dict[str, Workload] = {
+    "uniform": uniform,
+    "hot_account": hot_account,
+    "cross_border_heavy": cross_border_heavy,
+    "overdraft_heavy": overdraft_heavy,
+}
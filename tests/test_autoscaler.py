@@ -0,0 +1,24 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payment_system.autoscaler import Autoscaler
+from payment_system.bank import Bank
+from utils.currency import Currency
+from utils.metrics import render_prometheus
+
+
+def test_samples_expose_decisions_and_workers():
+    banks = [Bank(_id=i, currency=currency) for i, currency in enumerate(Currency)]
+    autoscaler = Autoscaler(banks, 1, 4, target_latency=0.5)
+    autoscaler._counters[2]["scale_up"] = 3
+    samples = autoscaler.samples()
+    assert ("payment_autoscaler_decisions_total", {"bank": "2", "action": "scale_up"},
+            3) in samples
+    assert ("payment_autoscaler_target_queue_wait_seconds", {}, 0.5) in samples
+    # os processadores criados ainda não foram iniciados
+    assert ("payment_autoscaler_workers", {"bank": "0"}, 0) in samples
+    text = render_prometheus(samples)
+    assert "# TYPE payment_autoscaler_decisions_total counter" in text
+    assert "# TYPE payment_autoscaler_workers gauge" in text
+    assert 'payment_autoscaler_decisions_total{bank="2",action="scale_up"} 3' in text
@@ -0,0 +1,22 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payment_system.bank import Bank
+from utils.currency import Currency
+
+
+def test_new_accounts_validates_lengths():
+    bank = Bank(_id=0, currency=Currency.USD)
+    assert bank.new_accounts(3, [1, 2, 3], [0, 5, 0]) == range(0, 3)
+    assert bank.new_accounts(2) == range(3, 5)
+    with pytest.raises(ValueError, match="len\\(balances\\) must be n"):
+        bank.new_accounts(3, [1, 2])
+    with pytest.raises(ValueError, match="len\\(overdraft_limits\\) must be n"):
+        bank.new_accounts(3, [1, 2, 3], [0])
+    with pytest.raises(ValueError, match="len\\(overdraft_limits\\) must be n"):
+        bank.new_accounts(2, None, [0, 0, 0])
+    # nenhuma conta foi criada pelas chamadas inválidas
+    assert len(bank.accounts) == 5
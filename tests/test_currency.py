@@ -0,0 +1,49 @@
+import os, sys, threading
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.currency import Currency, RateTable
+from utils.money import convert
+
+
+def test_bulk_convert_matches_scalar_path():
+    """
+    `RateTable.convert` converte cada valor exatamente como a conversão escalar
+    (`pair` + utils.money.convert), para todos os pares de moedas.
+    """
+    rates = RateTable()
+    rng = Random(1)
+    amounts = [0, 1, 99, 100, 101] + [rng.randint(1, 10 ** 9) for _ in range(200)]
+    for f in Currency:
+        for t in Currency:
+            _, fixed_rate = rates.pair(f, t)
+            assert rates.convert(f, t, amounts) == [convert(a, fixed_rate) for a in amounts]
+
+
+def test_bulk_convert_uses_a_single_table_version():
+    """
+    Com atualizações concorrentes alternando entre duas taxas, cada array convertido usa
+    uma só delas: nunca uma mistura das duas versões da matriz.
+    """
+    rates = RateTable()
+    pair = (Currency.USD, Currency.JPY)
+    versions = (141.94, 150.0)
+    amounts = [10 ** 6] * 2000
+    stop = threading.Event()
+
+    def updater():
+        i = 0
+        while not stop.is_set():
+            rates.update({pair: versions[i % 2]})
+            i += 1
+
+    thread = threading.Thread(target=updater)
+    thread.start()
+    try:
+        for _ in range(200):
+            converted = rates.convert(*pair, amounts)
+            assert len(set(converted)) == 1
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,70 @@
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from globals import banks
+from payment_system.bank import Bank
+from payment_system.international import InternationalPipeline
+from payment_system.settlement import is_international
+from utils.currency import RATES, Currency
+from utils.money import EXCHANGE_FEE_BP, OVERDRAFT_FEE_BP, convert, fee
+from utils.transaction import Transaction, TransactionStatus
+
+
+def _run_stage(pipeline: InternationalPipeline, stage: str) -> None:
+    # executa a etapa sobre tudo o que está na fila dela, sem iniciar os workers
+    queue = pipeline.queues[stage]
+    while not queue.empty():
+        batch = queue.get_many(pipeline.batch_size)
+        pipeline.handle(stage, batch)
+        queue.task_done(len(batch))
+
+
+def test_failed_exchange_is_compensated():
+    """
+    Se o câmbio falha por falta de reservas em moeda estrangeira, a compensação devolve a
+    origem exatamente ao estado anterior (saldo, reservas e taxas) e o destino nunca é
+    creditado; a transação termina FAILED e sai da fila do banco de origem.
+    """
+    banks[:] = [Bank(_id=i, currency=currency) for i, currency in enumerate(Currency)]
+    try:
+        for bank in banks:
+            for reserve in bank.reserves:
+                reserve.deposit(10 ** 8)
+            # a conta 0 precisa do cheque especial para a transferência
+            bank.new_accounts(2, [1000, 0], [50000, 0])
+        origin, destination = banks[0], banks[1]
+        amount = 20000
+        transaction = Transaction(0, (0, 0), (1, 1), amount, currency=destination.currency)
+        assert is_international(transaction)
+
+        # reservas em EUR do banco de origem abaixo do valor convertido
+        taxes = fee(amount, OVERDRAFT_FEE_BP) + fee(amount, EXCHANGE_FEE_BP)
+        converted = convert(amount - taxes, RATES.pair(origin.currency, destination.currency)[1])
+        fx_reserve = origin.reserves[destination.currency]
+        fx_reserve.withdraw(fx_reserve.balance - (converted - 1))
+
+        before = ([reserve.balance for reserve in origin.reserves],
+                  origin.accounts[0].balance, destination.accounts[1].balance)
+        origin.transaction_queue_put(transaction)
+        assert origin.transaction_queue_get_batch(1) == [transaction]
+
+        pipeline = InternationalPipeline(workers_per_stage=1)
+        assert pipeline.submit(transaction)
+        _run_stage(pipeline, "debit")
+        # depois do débito, o valor está retido nas reservas em moeda nacional
+        assert origin.accounts[0].balance == 1000 - amount
+        assert transaction.taxes == taxes
+        _run_stage(pipeline, "fx")
+
+        assert pipeline.queues["credit"].empty()
+        assert transaction.status == TransactionStatus.FAILED
+        assert transaction.taxes == 0
+        assert ([reserve.balance for reserve in origin.reserves],
+                origin.accounts[0].balance, destination.accounts[1].balance) == before
+        assert fx_reserve.balance == converted - 1
+        assert pipeline.counters()["compensated"] == 1
+        # a transação foi confirmada na fila do banco de origem
+        assert origin.drain(0)
+    finally:
+        banks.clear()
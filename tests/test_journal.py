@@ -0,0 +1,88 @@
+import os, sys, tempfile, threading
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from globals import banks
+from payment_system import journal
+from payment_system.bank import Bank
+from payment_system.settlement import settle_batch
+from payment_system.sharded import money_supply
+from utils.currency import Currency
+from utils.transaction import Transaction
+
+
+def _new_banks():
+    return [Bank(_id=i, currency=currency) for i, currency in enumerate(Currency)]
+
+
+def _settle_random(seed: int, n: int) -> None:
+    rng = Random(seed)
+    for i in range(n):
+        batch = []
+        for _ in range(rng.randint(1, 8)):
+            origin = (rng.randrange(len(banks)), rng.randrange(20))
+            destination = (rng.randrange(len(banks)), rng.randrange(20))
+            batch.append(Transaction(i, origin, destination, rng.randint(100, 100000),
+                                     currency=Currency(destination[0] + 1)))
+        settle_batch(batch)
+        if i % 25 == 0:
+            # além da thread de flush: garante quadros cortando liquidações de outras threads
+            journal.current().flush()
+
+
+def test_every_frame_prefix_conserves_money():
+    """
+    Com group commits concorrentes às liquidações, recuperar o journal até o fim de
+    qualquer quadro reaplica liquidações inteiras: o total de cada moeda não muda.
+    """
+    path = os.path.join(tempfile.mkdtemp(), "journal.wal")
+    wal = journal.Journal(path, fsync=False)
+    banks[:] = _new_banks()
+    rng = Random(1)
+    try:
+        for bank in banks:
+            wal.attach(bank)
+            for reserve in bank.reserves:
+                reserve.deposit(rng.randint(10 ** 6, 10 ** 8))
+            balances = [rng.randint(0, 50000) for _ in range(20)]
+            bank.new_accounts(len(balances), balances, balances)
+        expected = money_supply(banks)
+        setup_lsn = wal.flush()
+        journal.use(wal)
+
+        stop = threading.Event()
+
+        def flusher():
+            while not stop.is_set():
+                wal.flush()
+
+        threads = [threading.Thread(target=_settle_random, args=(seed, 300))
+                   for seed in range(4)]
+        flush_thread = threading.Thread(target=flusher)
+        flush_thread.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop.set()
+        flush_thread.join()
+        wal.close()
+        assert money_supply(banks) == expected
+
+        with open(path, "rb") as f:
+            data = f.read()
+        frames = [(end, lsn) for _, end, lsn in journal._frames(path, memoryview(data))]
+        assert len(frames) > 40
+        prefix = f"{path}.prefix"
+        for end, lsn in frames:
+            if lsn < setup_lsn:
+                continue
+            with open(prefix, "wb") as f:
+                f.write(data[:end])
+            recovered = _new_banks()
+            journal.replay(prefix, recovered)
+            assert money_supply(recovered) == expected, f"quadro terminando no LSN {lsn}"
+    finally:
+        journal.use(None)
+        banks.clear()
@@ -0,0 +1,103 @@
+import os, sys
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from globals import banks
+from payment_system.bank import Bank
+from payment_system.settlement import settle_batch
+from payment_system.sharded import money_supply
+from utils.currency import RATES, Currency
+from utils.money import (EXCHANGE_FEE_BP, OVERDRAFT_FEE_BP, RATE_SCALE, convert, fee,
+                         rate_to_fixed)
+from utils.transaction import Transaction, TransactionStatus
+
+
+def test_fee_rounds_half_up():
+    # exatamente meio centavo arredonda para cima
+    assert fee(50, EXCHANGE_FEE_BP) == 1        # 0,5
+    assert fee(150, EXCHANGE_FEE_BP) == 2       # 1,5
+    assert fee(10, OVERDRAFT_FEE_BP) == 1       # 0,5
+    assert fee(30, OVERDRAFT_FEE_BP) == 2       # 1,5
+    # logo abaixo e logo acima de meio centavo
+    assert fee(49, EXCHANGE_FEE_BP) == 0        # 0,49
+    assert fee(51, EXCHANGE_FEE_BP) == 1        # 0,51
+    assert fee(149, EXCHANGE_FEE_BP) == 1       # 1,49
+    assert fee(12345, OVERDRAFT_FEE_BP) == 617  # 617,25
+
+
+def test_fee_of_zero_and_negative_amounts():
+    assert fee(0, EXCHANGE_FEE_BP) == 0
+    assert fee(0, OVERDRAFT_FEE_BP) == 0
+    # "half-up" arredonda em direção a +infinito: -0,5 -> 0 e -1,5 -> -1
+    assert fee(-50, EXCHANGE_FEE_BP) == 0
+    assert fee(-150, EXCHANGE_FEE_BP) == -1
+    assert fee(-151, EXCHANGE_FEE_BP) == -2
+    assert fee(-12345, OVERDRAFT_FEE_BP) == -617
+
+
+def test_rates_are_exact_in_fixed_point():
+    assert rate_to_fixed(0.0069) == 6900
+    assert rate_to_fixed(141.94) == 141_940_000
+    assert rate_to_fixed(1) == RATE_SCALE
+
+
+def test_convert_rounds_down_between_jpy_and_usd():
+    _, jpy_to_usd = RATES.pair(Currency.JPY, Currency.USD)
+    _, usd_to_jpy = RATES.pair(Currency.USD, Currency.JPY)
+    assert jpy_to_usd == 7000
+    assert usd_to_jpy == 141_940_000
+    # 1 iene vale 0,007 centavo de dólar: abaixo de 143 ienes, nada é convertido
+    assert convert(1, jpy_to_usd) == 0
+    assert convert(142, jpy_to_usd) == 0          # 0,994
+    assert convert(143, jpy_to_usd) == 1          # 1,001
+    assert convert(285, jpy_to_usd) == 1          # 1,995
+    assert convert(286, jpy_to_usd) == 2          # 2,002
+    assert convert(1, usd_to_jpy) == 141          # 141,94
+    assert convert(99, usd_to_jpy) == 14052       # 14052,06
+    # ida e volta nunca cria dinheiro
+    for amount in range(1, 2000):
+        assert convert(convert(amount, usd_to_jpy), jpy_to_usd) <= amount
+        assert convert(convert(amount, jpy_to_usd), usd_to_jpy) <= amount
+    assert convert(0, usd_to_jpy) == 0
+
+
+def test_reserve_totals_stay_exact_over_many_conversions():
+    """
+    Milhares de transferências internacionais: cada moeda conserva o total exato (em
+    centavos), e a reserva em moeda estrangeira perde exatamente o que os destinos
+    receberam, convertido com arredondamento para baixo.
+    """
+    rng = Random(11)
+    banks[:] = [Bank(_id=i, currency=currency) for i, currency in enumerate(Currency)]
+    try:
+        for bank in banks:
+            for reserve in bank.reserves:
+                reserve.deposit(10 ** 12)
+            balances = [rng.randint(0, 10 ** 6) for _ in range(10)]
+            bank.new_accounts(len(balances), balances, balances)
+        expected = money_supply(banks)
+        fx_before = {(bank._id, reserve.currency): reserve.balance
+                     for bank in banks for reserve in bank.reserves}
+
+        credited = {}
+        for i in range(5000):
+            origin = (rng.randrange(6), rng.randrange(10))
+            destination = ((origin[0] + rng.randint(1, 5)) % 6, rng.randrange(10))
+            # valores pequenos, em que o arredondamento pesa mais
+            transaction = Transaction(i, origin, destination, rng.randint(1, 500),
+                                      currency=Currency(destination[0] + 1))
+            before = banks[destination[0]].accounts[destination[1]].balance
+            if settle_batch([transaction]) == [TransactionStatus.SUCCESSFUL]:
+                received = banks[destination[0]].accounts[destination[1]].balance - before
+                _, fixed_rate = RATES.pair(banks[origin[0]].currency, transaction.currency)
+                assert received == convert(transaction.amount - transaction.taxes, fixed_rate)
+                key = (origin[0], transaction.currency)
+                credited[key] = credited.get(key, 0) + received
+
+        assert money_supply(banks) == expected
+        for key, total in credited.items():
+            bank_id, currency = key
+            assert fx_before[key] - banks[bank_id].reserves[currency].balance == total
+    finally:
+        banks.clear()
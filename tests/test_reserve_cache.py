@@ -0,0 +1,124 @@
+import os, sys, tempfile, threading
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from globals import banks
+from payment_system import journal, reserve_cache, snapshot
+from payment_system.bank import Bank
+from payment_system.reserve_cache import ReserveCache
+from payment_system.settlement import settle_batch
+from payment_system.sharded import money_supply
+from utils.currency import Currency
+from utils.transaction import Transaction
+
+
+def _new_banks():
+    return [Bank(_id=i, currency=currency) for i, currency in enumerate(Currency)]
+
+
+def _settle_international(cache: ReserveCache, seed: int, n: int) -> None:
+    rng = Random(seed)
+    for i in range(n):
+        batch = []
+        for _ in range(rng.randint(1, 8)):
+            origin = (rng.randrange(len(banks)), rng.randrange(20))
+            destination = ((origin[0] + rng.randint(1, len(banks) - 1)) % len(banks),
+                           rng.randrange(20))
+            batch.append(Transaction(i, origin, destination, rng.randint(100, 100000),
+                                     currency=Currency(destination[0] + 1)))
+        settle_batch(batch, cache)
+
+
+def _recover(directory: str, path: str):
+    recovered = _new_banks()
+    journal.replay(path, recovered, from_lsn=snapshot.restore(directory, recovered))
+    return recovered
+
+
+def test_shared_reserve_plus_slices_equals_initial():
+    """
+    Reposições, débitos e devolução de uma fatia: a reserva compartilhada mais a fatia
+    (mais o que foi usado no câmbio) é sempre o saldo inicial da reserva.
+    """
+    bank = Bank(_id=0, currency=Currency.USD)
+    reserve = bank.reserves[Currency.EUR]
+    reserve.deposit(10 ** 6)
+    cache = ReserveCache(slice_fraction=0.1)
+    for amount in (50000, 30000, 90000, 400000, 10 ** 7):
+        with reserve.lock:
+            assert cache.reserves_to_lock([(reserve, amount)]) in ([reserve], [])
+            ok = cache.withdraw(reserve, amount)
+            cache.pass_finished()
+        assert ok == (amount != 10 ** 7)
+        assert reserve.balance + cache.held() + cache.spent == 10 ** 6
+        assert cache.pulled == cache.spent + cache.returned + cache.held()
+    cache.release()
+    assert cache.held() == 0
+    assert reserve.balance + cache.spent == 10 ** 6
+
+
+def test_slices_reconcile_with_reserves_journal_and_snapshots():
+    """
+    O dinheiro retirado das reservas compartilhadas pelos ReserveCaches nunca some: com
+    fatias retidas, o total de cada moeda (contando as fatias) é o inicial, e o journal e um
+    checkpoint (tirado com os processadores rodando) recuperam todo o dinheiro; depois de
+    `release`, nada fica retido.
+    """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "journal.wal")
+    wal = journal.Journal(path, fsync=False)
+    banks[:] = _new_banks()
+    rng = Random(3)
+    try:
+        for bank in banks:
+            wal.attach(bank)
+            for reserve in bank.reserves:
+                reserve.deposit(rng.randint(10 ** 6, 10 ** 8))
+            balances = [rng.randint(0, 50000) for _ in range(20)]
+            bank.new_accounts(len(balances), balances, balances)
+        journal.use(wal)
+        expected = money_supply(banks)
+        checkpointer = snapshot.Checkpointer(os.path.join(directory, "snapshots"), banks, wal)
+
+        caches = [ReserveCache() for _ in range(4)]
+        threads = [threading.Thread(target=_settle_international, args=(cache, seed, 200))
+                   for seed, cache in enumerate(caches)]
+        for thread in threads:
+            thread.start()
+        for _ in range(5):
+            checkpointer.take()
+        for thread in threads:
+            thread.join()
+
+        # no meio da execução: fatias ainda retidas
+        held = sum(cache.held() for cache in caches)
+        assert held > 0
+        assert sum(reserve_cache.outstanding().values()) == held
+        for cache in caches:
+            assert cache.pulled == cache.spent + cache.returned + cache.held()
+        supply = money_supply(banks)
+        for bank in banks:
+            for reserve in bank.reserves:
+                supply[reserve.currency] += reserve_cache.outstanding().get(reserve.key, 0)
+        assert supply == expected
+
+        # uma queda agora: o último checkpoint e o journal posterior a ele devolvem as
+        # fatias às reservas (antes e depois de um checkpoint com fatias retidas)
+        _settle_international(caches[0], 99, 20)
+        wal.flush()
+        assert money_supply(_recover(checkpointer.directory, path)) == expected
+        checkpointer.take()
+        _settle_international(caches[1], 98, 20)
+        wal.flush()
+        assert money_supply(_recover(checkpointer.directory, path)) == expected
+
+        for cache in caches:
+            cache.release()
+        assert reserve_cache.outstanding() == {}
+        assert money_supply(banks) == expected
+        wal.close()
+        assert money_supply(_recover(checkpointer.directory, path)) == expected
+    finally:
+        journal.use(None)
+        banks.clear()
@@ -0,0 +1,92 @@
+import os, sys
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from globals import banks
+from payment_system.account import lock_accounts
+from payment_system.bank import Bank
+from payment_system.settlement import Ledger, accounts_for, settle_batch, settle_transaction
+from utils.currency import Currency
+from utils.transaction import Transaction, TransactionStatus
+
+
+def _new_banks(rng: Random):
+    created = []
+    for i, currency in enumerate(Currency):
+        bank = Bank(_id=i, currency=currency)
+        for reserve in bank.reserves:
+            # reservas pequenas: parte do câmbio falha por falta de reservas
+            reserve.deposit(rng.randint(10 ** 4, 10 ** 6))
+        balances = [rng.randint(0, 20000) for _ in range(8)]
+        limits = [rng.randint(0, 10000) for _ in range(8)]
+        bank.new_accounts(len(balances), balances, limits)
+        created.append(bank)
+    return created
+
+
+def _copy(originals):
+    # bancos novos com os mesmos saldos e limites
+    copies = []
+    for original in originals:
+        bank = Bank(_id=original._id, currency=original.currency)
+        for reserve, copied in zip(original.reserves, bank.reserves):
+            copied.deposit(reserve.balance)
+        bank.new_accounts(len(original.accounts), list(original.accounts._balances),
+                          list(original.accounts._limits))
+        copies.append(bank)
+    return copies
+
+
+def _transactions(rng: Random):
+    transactions = []
+    for i in range(400):
+        # poucas origens repetidas: as contas passam do limite do cheque especial
+        origin = (rng.randrange(6), rng.randrange(3))
+        destination = (rng.randrange(6), rng.randrange(8))
+        transactions.append(Transaction(i, origin, destination, rng.randint(100, 15000),
+                                        currency=Currency(destination[0] + 1)))
+    return transactions
+
+
+def _state():
+    return ([list(bank.accounts._balances) for bank in banks],
+            [[reserve.balance for reserve in bank.reserves] for bank in banks])
+
+
+def test_batches_match_sequential_settlement():
+    """
+    Liquidar em blocos (`settle_batch`) produz os mesmos status, taxas, saldos e reservas
+    que liquidar as mesmas transações uma a uma, inclusive as falhas por saldo/limite e
+    por reservas insuficientes.
+    """
+    rng = Random(7)
+    initial = _new_banks(rng)
+    seed = rng.random()
+    try:
+        banks[:] = _copy(initial)
+        sequential = _transactions(Random(seed))
+        statuses = []
+        for transaction in sequential:
+            ledger = Ledger()
+            with lock_accounts(*accounts_for(transaction)):
+                status = settle_transaction(ledger, transaction)
+                ledger.commit()
+            statuses.append(status)
+        expected = _state()
+
+        banks[:] = _copy(initial)
+        batched = _transactions(Random(seed))
+        batch_statuses = []
+        for start in range(0, len(batched), 23):
+            batch_statuses += settle_batch(batched[start:start + 23])
+
+        assert batch_statuses == statuses
+        assert [t.taxes for t in batched] == [t.taxes for t in sequential]
+        assert _state() == expected
+        assert statuses.count(TransactionStatus.FAILED) > 20
+        assert statuses.count(TransactionStatus.SUCCESSFUL) > 20
+        # há contas de origem que terminam usando o cheque especial
+        assert any(balance < 0 for balances in expected[0] for balance in balances)
+    finally:
+        banks.clear()
@@ -0,0 +1,88 @@
+import os, sys, tempfile
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payment_system import snapshot
+from payment_system.account import dirty_page_bits
+from payment_system.bank import Bank
+from utils.currency import Currency
+
+
+def _new_banks():
+    return [Bank(_id=i, currency=currency) for i, currency in enumerate(Currency)]
+
+
+def _state(banks):
+    return ([list(bank.accounts._balances) for bank in banks],
+            [list(bank.accounts._limits) for bank in banks],
+            [[reserve.balance for reserve in bank.reserves] for bank in banks])
+
+
+def test_full_and_delta_checkpoints_restore():
+    """
+    Um checkpoint completo seguido de um incremental (com contas alteradas em poucas
+    páginas e contas novas) restaura, em bancos recém-criados, os mesmos saldos, limites e
+    reservas, e o LSN do último checkpoint. Um arquivo temporário deixado por uma gravação
+    interrompida é ignorado.
+    """
+    directory = tempfile.mkdtemp()
+    rng = Random(5)
+    banks = _new_banks()
+    for bank in banks:
+        for reserve in bank.reserves:
+            reserve.deposit(rng.randint(10 ** 6, 10 ** 8))
+        n = 3 << dirty_page_bits
+        balances = [rng.randint(0, 50000) for _ in range(n)]
+        bank.new_accounts(n, balances, balances)
+
+    checkpointer = snapshot.Checkpointer(directory, banks)
+    full = checkpointer.take()
+    assert full.endswith(".full")
+
+    for bank in banks:
+        for index in rng.sample(range(1 << dirty_page_bits), 10):
+            bank.accounts[index].balance -= rng.randint(1, 1000)
+        bank.accounts[len(bank.accounts) - 1].overdraft_limit = 123
+        bank.reserves[Currency.USD].withdraw(777)
+        bank.new_account(42, 0)
+    delta = checkpointer.take()
+    assert delta.endswith(".delta")
+    # a segunda página de contas não mudou e não é copiada
+    assert os.path.getsize(delta) < os.path.getsize(full)
+
+    # gravação interrompida de um checkpoint seguinte
+    with open(os.path.join(directory, f"{checkpointer._sequence:010d}.delta.tmp"), "wb") as f:
+        f.write(b"PAYSNAP1 incompleto")
+
+    restored = _new_banks()
+    assert snapshot.restore(directory, restored) == 0
+    assert _state(restored) == _state(banks)
+
+
+def test_restore_returns_checkpoint_lsn():
+    """
+    O LSN devolvido por `restore` é o do journal cortado no último checkpoint.
+    """
+    class _Journal:
+        lsn = 0
+
+        def cut(self):
+            self.lsn += 100
+            return self.lsn
+
+        def compact(self, lsn):
+            pass
+
+    directory = tempfile.mkdtemp()
+    banks = _new_banks()
+    for bank in banks:
+        bank.new_accounts(3, [1, 2, 3], [0, 0, 0])
+    checkpointer = snapshot.Checkpointer(directory, banks, _Journal())
+    checkpointer.take()
+    banks[0].accounts[1].balance = 20
+    checkpointer.take()
+    restored = _new_banks()
+    assert snapshot.restore(directory, restored) == 200
+    assert list(restored[0].accounts._balances) == [1, 20, 3]
+    assert snapshot.restore(tempfile.mkdtemp(), _new_banks()) == 0
@@ -0,0 +1,66 @@
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import trace
+from utils.currency import Currency
+from utils.trace import TraceReader, TraceWriter
+from utils.transaction import Transaction
+
+
+def _transactions(n: int):
+    return [Transaction(i, (i % 6, i * 7 + 1), ((i + 1) % 6, 2 ** 32 - 1 - i),
+                        (-1) ** i * (i * 1000 + 1), currency=Currency((i + 1) % 6 + 1))
+            for i in range(n)]
+
+
+def test_write_read_roundtrip(monkeypatch):
+    """
+    Registros gravados por TraceWriter são lidos de volta por TraceReader com o layout
+    <HHIIB7xqq (36 bytes), inclusive através de várias janelas de leitura.
+    """
+    assert trace._RECORD.format == "<HHIIB7xqq"
+    assert trace._RECORD.size == 36
+    monkeypatch.setattr(trace, "trace_window_records", 3)
+    path = os.path.join(tempfile.mkdtemp(), "trace.bin")
+    transactions = _transactions(10)
+    writer = TraceWriter(path)
+    for transaction in transactions:
+        writer.record(transaction)
+    writer.close()
+    assert os.path.getsize(path) == trace._HEADER.size + 10 * trace._RECORD.size
+
+    with TraceReader(path) as reader:
+        assert len(reader) == 10
+        records = list(reader.records())
+        assert [record[:6] for record in records] == [
+            (t.origin[0], t.destination[0], t.origin[1], t.destination[1], t.currency.value,
+             t.amount) for t in transactions]
+        # instantes não negativos, em ordem de gravação
+        assert all(0 <= a[6] <= b[6] for a, b in zip(records, records[1:]))
+        assert list(reader.records(bank_id=2)) == [r for r in records if r[0] == 2]
+        needed = {}
+        for t in transactions:
+            for bank, account in (t.origin, t.destination):
+                needed[bank] = max(needed.get(bank, 0), account + 1)
+        assert reader.accounts_needed() == needed
+
+
+def test_close_with_open_iterator(monkeypatch):
+    """
+    Fechar o reader com um iterador de `records` ainda aberto (no meio de uma janela) não
+    levanta BufferError, e o iterador termina.
+    """
+    monkeypatch.setattr(trace, "trace_window_records", 4)
+    path = os.path.join(tempfile.mkdtemp(), "trace.bin")
+    writer = TraceWriter(path)
+    for transaction in _transactions(10):
+        writer.record(transaction)
+    writer.close()
+
+    reader = TraceReader(path)
+    records = reader.records()
+    next(records)
+    next(records)
+    reader.close()
+    assert list(records) == []
@@ -0,0 +1,214 @@
+from collections import deque
+from typing import Any, Iterable, List, Optional
+
+from utils import clock
+from utils.lockprof import make_lock
+
+
+class BoundedQueue:
+    """
+    Uma fila FIFO limitada, protegida por um único mutex, com operações em lote.
+    Substitui a combinação Lock + Queue + dois semáforos usada anteriormente pelo Bank:
+    produtores e consumidores esperam em variáveis de condição associadas ao mesmo mutex,
+    de modo que inserir ou retirar N elementos custa uma única aquisição do mutex.
+
+    Ciclo de vida: a fila começa aceitando inserções. `stop_accepting()` rejeita novas
+    inserções, mas as retiradas continuam até a fila esvaziar (ela fica "exhausted").
+    `close()` encerra também as retiradas. Ambas as transições acordam todas as threads
+    bloqueadas na fila, que então veem o novo estado e retornam (funcionam como um
+    sentinela entregue a todos os produtores e consumidores de uma só vez).
+    Como em queue.Queue, cada elemento retirado e processado deve ser confirmado com
+    `task_done()`, e `join()` espera todos os elementos inseridos serem confirmados.
+    As condições e os timeouts vêm do relógio da simulação (utils/clock.py).
+    O mutex é criado com `make_lock(name)` (ver utils/lockprof.py).
+
+    ...
+
+    Atributos
+    ---------
+    maxsize : int
+        Capacidade máxima da fila.
+    accepting : bool
+        Indica se a fila ainda aceita inserções.
+    closed : bool
+        Indica se a fila foi fechada (nenhuma inserção/retirada é mais aceita).
+
+    Métodos
+    -------
+    put(item, timeout: Optional[float] = None) -> bool:
+        Insere um elemento, bloqueando enquanto a fila estiver cheia.
+    put_many(items, timeout: Optional[float] = None) -> int:
+        Insere vários elementos, bloqueando enquanto a fila estiver cheia. Retorna quantos foram inseridos.
+    get_many(max_n: int, timeout: Optional[float] = None) -> List:
+        Retira até `max_n` elementos, bloqueando enquanto a fila estiver vazia.
+    unget(items) -> None:
+        Devolve elementos ao início da fila (ignora a capacidade e o fechamento).
+    task_done(n: int = 1) -> None:
+        Confirma o processamento de `n` elementos retirados da fila.
+    join(timeout: Optional[float] = None) -> bool:
+        Espera todos os elementos inseridos serem confirmados.
+    drain() -> List:
+        Retira e retorna todos os elementos da fila sem bloquear (descartando-os).
+    stop_accepting() -> None:
+        Passa a rejeitar inserções e acorda todas as threads bloqueadas na fila.
+    close() -> None:
+        Fecha a fila e acorda todas as threads bloqueadas nela.
+    exhausted() -> bool:
+        Indica se nenhum elemento ainda poderá ser retirado da fila.
+    qsize() -> int:
+        Número de elementos na fila.
+    empty() -> bool:
+        Indica se a fila está vazia.
+    """
+
+    def __init__(self, maxsize: int, name: str = "queue"):
+        self.maxsize = maxsize
+        self.accepting = True
+        self.closed = False
+        self._items = deque()
+        self._unfinished = 0
+        self._mutex = make_lock(name)
+        self._not_empty = clock.condition(self._mutex)
+        self._not_full = clock.condition(self._mutex)
+        self._all_done = clock.condition(self._mutex)
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        if deadline is None:
+            return None
+        return max(0.0, deadline - clock.monotonic())
+
+    def put(self, item: Any, timeout: Optional[float] = None) -> bool:
+        """
+        Insere `item` no fim da fila. Retorna False se a fila não aceita mais inserções ou se
+        o `timeout` (em segundos) expirou antes de haver espaço.
+        """
+        return self.put_many((item,), timeout) == 1
+
+    def put_many(self, items: Iterable[Any], timeout: Optional[float] = None) -> int:
+        """
+        Insere os elementos de `items` no fim da fila, na ordem dada, bloqueando enquanto
+        a fila estiver cheia. Retorna a quantidade de elementos efetivamente inseridos
+        (menor que o total se a fila parar de aceitar inserções ou o `timeout` expirar).
+        """
+        pending = deque(items)
+        inserted = 0
+        deadline = None if timeout is None else clock.monotonic() + timeout
+        with self._mutex:
+            while pending and self.accepting:
+                free = self.maxsize - len(self._items)
+                if free <= 0:
+                    remaining = self._remaining(deadline)
+                    if remaining == 0.0:
+                        break
+                    self._not_full.wait(remaining)
+                    continue
+                n = min(free, len(pending))
+                for _ in range(n):
+                    self._items.append(pending.popleft())
+                inserted += n
+                self._unfinished += n
+                self._not_empty.notify(n)
+        return inserted
+
+    def get_many(self, max_n: int, timeout: Optional[float] = None) -> List[Any]:
+        """
+        Retira até `max_n` elementos do início da fila. Bloqueia enquanto a fila estiver
+        vazia; retorna uma lista vazia se a fila estiver "exhausted" (ver `exhausted()`)
+        ou se o `timeout` expirar.
+        """
+        deadline = None if timeout is None else clock.monotonic() + timeout
+        with self._mutex:
+            while not self._items:
+                remaining = self._remaining(deadline)
+                if self._exhausted() or remaining == 0.0:
+                    return []
+                self._not_empty.wait(remaining)
+            if self.closed:
+                return []
+            n = min(max_n, len(self._items))
+            batch = [self._items.popleft() for _ in range(n)]
+            self._not_full.notify(n)
+            return batch
+
+    def unget(self, items: List[Any]) -> None:
+        """
+        Devolve `items` ao início da fila, preservando a ordem original deles. Os elementos
+        continuam pendentes de confirmação (não chame `task_done` para eles).
+        """
+        with self._mutex:
+            self._items.extendleft(reversed(items))
+            self._not_empty.notify(len(items))
+
+    def task_done(self, n: int = 1) -> None:
+        """
+        Confirma que `n` elementos retirados da fila foram processados.
+        """
+        with self._mutex:
+            self._unfinished -= n
+            if self._unfinished <= 0:
+                self._all_done.notify_all()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera (no máximo `timeout` segundos) até que todos os elementos inseridos tenham
+        sido confirmados com `task_done`. Retorna True se não há mais elementos pendentes.
+        """
+        deadline = None if timeout is None else clock.monotonic() + timeout
+        with self._mutex:
+            while self._unfinished > 0:
+                remaining = self._remaining(deadline)
+                if remaining == 0.0:
+                    return False
+                self._all_done.wait(remaining)
+            return True
+
+    def drain(self) -> List[Any]:
+        """
+        Retira e retorna todos os elementos da fila. Eles deixam de contar como pendentes.
+        """
+        with self._mutex:
+            items = list(self._items)
+            self._items.clear()
+            self._unfinished -= len(items)
+            self._not_full.notify_all()
+            if self._unfinished <= 0:
+                self._all_done.notify_all()
+            return items
+
+    def stop_accepting(self) -> None:
+        """
+        Passa a rejeitar inserções. Produtores bloqueados retornam imediatamente e
+        consumidores bloqueados retornam assim que a fila esvaziar.
+        """
+        with self._mutex:
+            self.accepting = False
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def close(self) -> None:
+        """
+        Fecha a fila: inserções passam a falhar, retiradas retornam listas vazias e todas
+        as threads bloqueadas em `put_many`/`get_many` são acordadas.
+        """
+        with self._mutex:
+            self.accepting = False
+            self.closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def _exhausted(self) -> bool:
+        return self.closed or (not self.accepting and not self._items)
+
+    def exhausted(self) -> bool:
+        """
+        Indica se nenhum elemento ainda poderá ser retirado da fila: ela foi fechada, ou
+        não aceita mais inserções e está vazia.
+        """
+        return self._exhausted()
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
@@ -0,0 +1,335 @@
+import heapq, itertools, threading, time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from globals import *
+
+# Relógio da simulação.
+# Todo código que espera ou mede o tempo simulado (latências de processamento, intervalo
+# entre transações, timeouts das filas, carimbos de tempo das transações) passa por este
+# módulo em vez de usar `time`/`datetime` diretamente. Há dois backends:
+#   * RealClock: tempo real (time.sleep, time.monotonic, time.perf_counter_ns, datetime.now);
+#   * VirtualClock: simulação de eventos discretos. O tempo só avança quando todos os
+#     atores (threads da simulação) estão bloqueados em `sleep` ou esperando uma condição
+#     do relógio; ele salta então direto para o próximo evento (o menor prazo pendente).
+#     Uma simulação longa termina em segundos, com a mesma ordem dos eventos e latências
+#     medidas em tempo simulado.
+# As durações são em segundos (simulados, no VirtualClock); `sleep_units` converte a
+# partir da unidade de tempo da simulação configurada no backend.
+# O backend deve ser escolhido com `use()` antes de criar bancos e threads: as filas
+# criam as suas condições com `condition()` na construção.
+# Threads da simulação devem herdar de `ActorThread` (ou, no caso da thread principal,
+# rodar dentro de `actor()`), para que o VirtualClock saiba quantos atores existem.
+# Uma thread que não é ator e usa o relógio é tratada como ator durante a espera.
+
+
+class RealClock:
+    """
+    Relógio de tempo real.
+
+    ...
+
+    Atributos
+    ---------
+    time_unit : float
+        Valor, em segundos, da unidade de tempo da simulação.
+    """
+
+    def __init__(self, time_unit: float = time_unit):
+        self.time_unit = time_unit
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def monotonic_ns(self) -> int:
+        return time.perf_counter_ns()
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def condition(self, lock: threading.Lock) -> threading.Condition:
+        return threading.Condition(lock)
+
+    def enter(self) -> None:
+        pass
+
+    def bind(self) -> None:
+        pass
+
+    def unbind(self) -> None:
+        pass
+
+    def exit(self) -> None:
+        pass
+
+
+class _Waiter:
+    __slots__ = ("fired", "timed_out")
+
+    def __init__(self):
+        self.fired = False
+        self.timed_out = False
+
+
+class VirtualClock:
+    """
+    Relógio virtual de eventos discretos. Conta os atores registrados e os bloqueados;
+    quando todos estão bloqueados, avança o tempo até o menor prazo pendente e acorda
+    quem o atingiu. Atores acordados voltam a contar como ativos imediatamente, de modo
+    que o tempo só volta a avançar depois que todos eles bloquearem de novo.
+
+    ...
+
+    Atributos
+    ---------
+    time_unit : float
+        Valor, em segundos simulados, da unidade de tempo da simulação.
+    start : datetime
+        Data/hora correspondente ao instante zero do relógio.
+    """
+
+    def __init__(self, time_unit: float = time_unit, start: Optional[datetime] = None):
+        self.time_unit = time_unit
+        self.start = start or datetime.now()
+        self._now = 0.0
+        self._mutex = threading.Lock()
+        self._wakeup = threading.Condition(self._mutex)
+        # (prazo, sequência, waiter); entradas de waiters já acordados são ignoradas
+        self._timers = []
+        self._seq = itertools.count()
+        self._actors = 0
+        self._blocked = 0
+        self._local = threading.local()
+
+    def monotonic(self) -> float:
+        return self._now
+
+    def monotonic_ns(self) -> int:
+        return round(self._now * 1_000_000_000)
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=self._now)
+
+    def enter(self) -> None:
+        with self._mutex:
+            self._actors += 1
+
+    def bind(self) -> None:
+        self._local.actor = True
+
+    def unbind(self) -> None:
+        self._local.actor = False
+
+    def exit(self) -> None:
+        with self._mutex:
+            self._actors -= 1
+            self._advance()
+
+    @contextmanager
+    def _as_actor(self) -> Iterator[None]:
+        if getattr(self._local, "actor", False):
+            yield
+            return
+        self.enter()
+        self.bind()
+        try:
+            yield
+        finally:
+            self.unbind()
+            self.exit()
+
+    def _block(self, timeout: Optional[float]) -> _Waiter:
+        # o chamador possui self._mutex
+        waiter = _Waiter()
+        self._blocked += 1
+        if timeout is not None:
+            heapq.heappush(self._timers,
+                           (self._now + max(0.0, timeout), next(self._seq), waiter))
+        self._advance()
+        return waiter
+
+    def _fire(self, waiter: _Waiter, timed_out: bool) -> None:
+        # o chamador possui self._mutex
+        waiter.fired = True
+        waiter.timed_out = timed_out
+        self._blocked -= 1
+        self._wakeup.notify_all()
+
+    def _advance(self) -> None:
+        # o chamador possui self._mutex
+        while self._actors > 0 and self._blocked >= self._actors and self._timers:
+            deadline, _, waiter = heapq.heappop(self._timers)
+            if waiter.fired:
+                continue
+            self._now = max(self._now, deadline)
+            self._fire(waiter, timed_out=True)
+            # acorda de uma vez todos os que têm o mesmo prazo
+            while self._timers and self._timers[0][0] <= self._now:
+                _, _, waiter = heapq.heappop(self._timers)
+                if not waiter.fired:
+                    self._fire(waiter, timed_out=True)
+
+    def _await(self, waiter: _Waiter) -> None:
+        # o chamador possui self._mutex
+        while not waiter.fired:
+            self._wakeup.wait()
+
+    def sleep(self, seconds: float) -> None:
+        with self._as_actor():
+            with self._mutex:
+                self._await(self._block(seconds))
+
+    def condition(self, lock: threading.Lock) -> "VirtualCondition":
+        return VirtualCondition(self, lock)
+
+
+class VirtualCondition:
+    """
+    Variável de condição cujas esperas contam como bloqueio para o VirtualClock e cujos
+    timeouts são medidos em tempo simulado. Mesma interface usada de threading.Condition.
+    """
+
+    def __init__(self, clock: VirtualClock, lock: threading.Lock):
+        self._clock = clock
+        self._lock = lock
+        self._waiters = deque()
+
+    def __enter__(self):
+        return self._lock.__enter__()
+
+    def __exit__(self, *args):
+        return self._lock.__exit__(*args)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        # o chamador possui self._lock
+        clock = self._clock
+        with clock._as_actor():
+            with clock._mutex:
+                waiter = clock._block(timeout)
+            self._waiters.append(waiter)
+            self._lock.release()
+            try:
+                with clock._mutex:
+                    clock._await(waiter)
+            finally:
+                self._lock.acquire()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+        return not waiter.timed_out
+
+    def notify(self, n: int = 1) -> None:
+        # o chamador possui self._lock
+        clock = self._clock
+        with clock._mutex:
+            while n > 0 and self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.fired:
+                    clock._fire(waiter, timed_out=False)
+                    n -= 1
+
+    def notify_all(self) -> None:
+        self.notify(len(self._waiters))
+
+
+_backend = RealClock()
+
+
+def use(backend) -> None:
+    """
+    Passa a usar `backend` (RealClock ou VirtualClock) como relógio da simulação.
+    """
+    global _backend
+    _backend = backend
+
+
+def backend():
+    return _backend
+
+
+def sleep(seconds: float) -> None:
+    _backend.sleep(seconds)
+
+
+def sleep_units(units: float) -> None:
+    """
+    Espera `units` unidades de tempo da simulação.
+    """
+    _backend.sleep(units * _backend.time_unit)
+
+
+def monotonic() -> float:
+    return _backend.monotonic()
+
+
+def monotonic_ns() -> int:
+    """
+    Instante monotônico em nanossegundos, com a maior resolução disponível (para medir
+    latências; `monotonic` é usado para prazos).
+    """
+    return _backend.monotonic_ns()
+
+
+def now() -> datetime:
+    return _backend.now()
+
+
+def condition(lock: threading.Lock):
+    return _backend.condition(lock)
+
+
+def enter_actor() -> None:
+    """
+    Registra a thread atual como ator da simulação (ver `exit_actor`).
+    """
+    _backend.enter()
+    _backend.bind()
+
+
+def exit_actor() -> None:
+    _backend.unbind()
+    _backend.exit()
+
+
+@contextmanager
+def actor() -> Iterator[None]:
+    """
+    Registra a thread atual como ator da simulação enquanto o bloco executa.
+    """
+    enter_actor()
+    try:
+        yield
+    finally:
+        exit_actor()
+
+
+class ActorThread(threading.Thread):
+    """
+    Thread da simulação: é registrada como ator no relógio ao ser iniciada (antes de
+    começar a executar, para que o tempo não avance sem ela) e sai ao terminar `run`.
+    """
+
+    def start(self) -> None:
+        clock = _backend
+        clock.enter()
+        run = self.run
+
+        def run_as_actor():
+            clock.bind()
+            try:
+                run()
+            finally:
+                clock.exit()
+
+        self.run = run_as_actor
+        try:
+            threading.Thread.start(self)
+        except BaseException:
+            clock.exit()
+            raise
@@ -1,6 +1,9 @@
 from enum import Enum
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
 
 from globals import *
+from utils.money import convert, rate_to_fixed
 
 
 class Currency(Enum):
@@ -16,82 +19,83 @@ class Currency(Enum):
     BRL = 6
 
 
+# Taxas de câmbio padrão: _DEFAULT_RATES[f.value - 1][t.value - 1] converte de `f` para `t`.
+_DEFAULT_RATES = (
+    #  USD     EUR     GBP     JPY     CHF     BRL
+    (1,      0.98,   0.85,   141.94, 0.98,   5.35),   # USD
+    (1.02,   1,      0.87,   145.46, 0.98,   5.47),   # EUR
+    (1.18,   1.15,   1,      167.41, 1.13,   6.30),   # GBP
+    (0.0070, 0.0069, 0.0060, 1,      0.0068, 0.038),  # JPY
+    (1.04,   1.02,   0.89,   148.07, 1,      5.57),   # CHF
+    (0.19,   0.18,   0.16,   26.59,  0.18,   1),      # BRL
+)
+
+
+class RateTable:
+    """
+    Uma matriz 6x6 de taxas de câmbio indexada por `Currency.value`, mantida também em
+    ponto fixo (partes por milhão, ver utils/money.py) para a conversão de valores inteiros.
+    As leituras não usam locks: a matriz é uma tupla imutável e cada atualização cria
+    uma nova matriz (copy-on-write) que substitui a anterior com uma única atribuição.
+    Leitores concorrentes veem sempre a matriz antiga ou a nova, nunca uma mistura.
+
+    ...
+
+    Métodos
+    -------
+    rate(f: Currency, t: Currency) -> float:
+        Taxa de câmbio de `f` para `t`.
+    pair(f: Currency, t: Currency) -> Tuple[float, int]:
+        Taxa de câmbio de `f` para `t` e a mesma taxa em partes por milhão, lidas da mesma
+        matriz (uma atualização concorrente não separa as duas).
+    convert(f: Currency, t: Currency, amounts: Iterable[int]) -> List[int]:
+        Converte vários valores (em centavos) de `f` para `t` com uma única leitura da matriz.
+    update(rates: Dict[Tuple[Currency, Currency], float]) -> None:
+        Atualiza atomicamente as taxas dos pares informados.
+    snapshot() -> Tuple[Tuple[float, ...], ...]:
+        Retorna a matriz de taxas vigente.
+    """
+
+    def __init__(self, rates=_DEFAULT_RATES):
+        # serializa apenas os escritores; leitores nunca travam
+        self._write_lock = Lock()
+        self._publish(rates)
+
+    def _publish(self, rates) -> None:
+        # as duas matrizes são trocadas juntas em uma única atribuição
+        floats = tuple(tuple(row) for row in rates)
+        fixed = tuple(tuple(rate_to_fixed(rate) for rate in row) for row in floats)
+        self._tables = (floats, fixed)
+
+    def rate(self, f: Currency, t: Currency) -> float:
+        return self._tables[0][f.value - 1][t.value - 1]
+
+    def pair(self, f: Currency, t: Currency) -> Tuple[float, int]:
+        floats, fixed = self._tables
+        return floats[f.value - 1][t.value - 1], fixed[f.value - 1][t.value - 1]
+
+    def convert(self, f: Currency, t: Currency, amounts: Iterable[int]) -> List[int]:
+        # a taxa é lida uma única vez: todo o array usa a mesma versão da matriz
+        fixed_rate = self._tables[1][f.value - 1][t.value - 1]
+        return [convert(amount, fixed_rate) for amount in amounts]
+
+    def update(self, rates: Dict[Tuple[Currency, Currency], float]) -> None:
+        with self._write_lock:
+            table = [list(row) for row in self._tables[0]]
+            for (f, t), rate in rates.items():
+                table[f.value - 1][t.value - 1] = rate
+            self._publish(table)
+
+    def snapshot(self) -> Tuple[Tuple[float, ...], ...]:
+        return self._tables[0]
+
+
+# Tabela de câmbio global usada pelos PaymentProcessors
+RATES = RateTable()
+
+
 def get_exchange_rate(f: Currency, t: Currency) -> float:
-    if f == Currency.USD:
-        if t == Currency.USD:
-            return 1
-        elif t == Currency.EUR:
-            return 0.98
-        elif t == Currency.GBP:
-            return 0.85
-        elif t == Currency.JPY:
-            return 141.94
-        elif t == Currency.CHF:
-            return 0.98
-        elif t == Currency.BRL:
-            return 5.35
-    elif f == Currency.EUR:
-        if t == Currency.USD:
-            return 1.02
-        elif t == Currency.EUR:
-            return 1
-        elif t == Currency.GBP:
-            return 0.87
-        elif t == Currency.JPY:
-            return 145.46
-        elif t == Currency.CHF:
-            return 0.98
-        elif t == Currency.BRL:
-            return 5.47
-    elif f == Currency.GBP:
-        if t == Currency.USD:
-            return 1.18
-        elif t == Currency.EUR:
-            return 1.15
-        elif t == Currency.GBP:
-            return 1
-        elif t == Currency.JPY:
-            return 167.41
-        elif t == Currency.CHF:
-            return 1.13
-        elif t == Currency.BRL:
-            return 6.30
-    elif f == Currency.JPY:
-        if t == Currency.USD:
-            return 0.0070
-        elif t == Currency.EUR:
-            return 0.0069
-        elif t == Currency.GBP:
-            return 0.0060
-        elif t == Currency.JPY:
-            return 1
-        elif t == Currency.CHF:
-            return 0.0068
-        elif t == Currency.BRL:
-            return 0.038
-    elif f == Currency.CHF:
-        if t == Currency.USD:
-            return 1.04
-        elif t == Currency.EUR:
-            return 1.02
-        elif t == Currency.GBP:
-            return 0.89
-        elif t == Currency.JPY:
-            return 148.07
-        elif t == Currency.CHF:
-            return 1
-        elif t == Currency.BRL:
-            return 5.57
-    else:
-        if t == Currency.USD:
-            return 0.19
-        elif t == Currency.EUR:
-            return 0.18
-        elif t == Currency.GBP:
-            return 0.16
-        elif t == Currency.JPY:
-            return 26.59
-        elif t == Currency.CHF:
-            return 0.18
-        elif t == Currency.BRL:
-            return 1
+    """
+    Mantida por compatibilidade: consulta a tabela global `RATES`.
+    """
+    return RATES.rate(f, t)
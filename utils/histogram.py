@@ -0,0 +1,119 @@
+from threading import Lock, local
+from typing import Dict, Iterable, List
+
+# Histogramas de latência.
+# Os valores (inteiros, em nanossegundos) são agrupados em baldes log-lineares, como em um
+# HDR histogram: cada potência de 2 é dividida em 2**sub_bucket_bits baldes iguais, de
+# modo que o erro relativo de um percentil é menor que 2**-sub_bucket_bits (< 1% com o
+# padrão), para valores de 1 ns a horas, com alguns milhares de baldes.
+# Registrar um valor é O(1) e não usa mutex compartilhado: cada thread soma em um vetor de
+# contagens próprio, e a leitura soma os vetores de todas as threads (como utils.metrics).
+
+# Número de bits de precisão de cada balde
+histogram_sub_bucket_bits = 7
+
+
+class Histogram:
+    """
+    Histograma log-linear de valores inteiros não negativos, registrados por várias threads.
+
+    ...
+
+    Atributos
+    ---------
+    sub_bucket_bits : int
+        Bits de precisão: cada potência de 2 é dividida em 2**sub_bucket_bits baldes.
+
+    Métodos
+    -------
+    record(value: int) -> None:
+        Registra `value` no vetor da thread atual.
+    merge(other: Histogram) -> None:
+        Soma as contagens de `other` (com os mesmos `sub_bucket_bits`) ao vetor da thread atual.
+    counts() -> List[int]:
+        Contagens de cada balde, somadas entre todas as threads.
+    count() -> int:
+        Número de valores registrados.
+    percentile(p: float) -> int:
+        Valor aproximado abaixo do qual estão `p`% dos valores registrados.
+    percentiles(ps: Iterable[float]) -> Dict[float, int]:
+        Vários percentis a partir de uma única leitura.
+    """
+
+    def __init__(self, sub_bucket_bits: int = histogram_sub_bucket_bits):
+        self.sub_bucket_bits = sub_bucket_bits
+        self._sub_buckets = 1 << sub_bucket_bits
+        self._cells: List[List[int]] = []
+        self._local = local()
+        self._lock = Lock()
+
+    def _index(self, value: int) -> int:
+        # valores menores que 2 * sub_buckets têm um balde por valor; acima disso, o balde
+        # guarda os `sub_bucket_bits + 1` bits mais significativos do valor
+        shift = max(0, value.bit_length() - self.sub_bucket_bits - 1)
+        return shift * self._sub_buckets + (value >> shift)
+
+    def _value(self, index: int) -> int:
+        # ponto médio do intervalo de valores do balde `index`
+        shift = max(0, index // self._sub_buckets - 1)
+        low = (index - shift * self._sub_buckets) << shift
+        return low + ((1 << shift) >> 1)
+
+    def _cell(self) -> List[int]:
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = self._local.cell = []
+            with self._lock:
+                self._cells.append(cell)
+        return cell
+
+    def record(self, value: int) -> None:
+        cell = self._cell()
+        index = self._index(max(0, value))
+        if index >= len(cell):
+            cell.extend([0] * (index + 1 - len(cell)))
+        cell[index] += 1
+
+    def merge(self, other: "Histogram") -> None:
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError("histograms must have the same sub_bucket_bits")
+        cell = self._cell()
+        counts = other.counts()
+        if len(counts) > len(cell):
+            cell.extend([0] * (len(counts) - len(cell)))
+        for index, n in enumerate(counts):
+            cell[index] += n
+
+    def counts(self) -> List[int]:
+        with self._lock:
+            cells = list(self._cells)
+        merged = [0] * max((len(cell) for cell in cells), default=0)
+        for cell in cells:
+            for index, n in enumerate(list(cell)):
+                merged[index] += n
+        return merged
+
+    def count(self) -> int:
+        return sum(self.counts())
+
+    def percentile(self, p: float) -> int:
+        return self.percentiles([p])[p]
+
+    def percentiles(self, ps: Iterable[float]) -> Dict[float, int]:
+        """
+        Retorna, para cada `p` de `ps`, o valor do balde que contém o valor de posição
+        ceil(p% do total) (0 se nada foi registrado).
+        """
+        counts = self.counts()
+        total = sum(counts)
+        result = {}
+        for p in sorted(ps):
+            rank = max(1, -(-total * p // 100))
+            seen = 0
+            result[p] = 0
+            for index, n in enumerate(counts):
+                seen += n
+                if total and seen >= rank:
+                    result[p] = self._value(index)
+                    break
+        return result
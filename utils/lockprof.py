@@ -0,0 +1,203 @@
+import os, sys, threading, time
+from typing import Dict, List, Optional, Tuple
+
+from utils.logger import LOGGER
+from utils.metrics import Counter, enable_lock_timing
+
+# Profiler de contenção dos mutexes.
+# Os mutexes do sistema (listras de contas e reservas, filas dos bancos e do pipeline,
+# contadores do pool/autoscaler) são criados com `make_lock(nome)`. Com o profiler
+# desligado (padrão), `make_lock` retorna um threading.Lock comum: nenhum custo depois da
+# criação. Ligado (variável de ambiente PAYMENT_LOCKPROF=1 ou `enable()` antes de criar
+# bancos e threads), retorna um ProfiledLock, que registra por nome (vários mutexes podem
+# compartilhar um nome, como as listras de um banco):
+#   * aquisições e aquisições disputadas (o mutex estava ocupado);
+#   * tempo total esperando e segurando o mutex;
+#   * os pontos de chamada (pilha resumida) das `lockprof_worst_waiters` piores esperas.
+# As contagens usam utils.metrics.Counter (uma célula por thread). `report()` printa os
+# mutexes ordenados pelo tempo total de espera.
+# As esperas de variáveis de condição (wait) não contam como espera pelo mutex: só a
+# readquisição depois de acordar. Ligar o profiler também liga a medição de LOCK_WAIT_NS
+# em `lock_accounts` (ver utils/metrics.py).
+
+# Número de piores esperas guardadas por nome
+lockprof_worst_waiters = 5
+
+# Número de frames (fora dos módulos de sincronização) guardados por ponto de chamada
+lockprof_stack_depth = 3
+
+_enabled = os.environ.get("PAYMENT_LOCKPROF", "") not in ("", "0")
+if _enabled:
+    enable_lock_timing()
+
+# módulos cujos frames são pulados ao registrar o ponto de chamada
+_skipped_files = (__file__, threading.__file__, "contextlib.py", "bounded_queue.py",
+                  "clock.py")
+
+
+def enable() -> None:
+    """
+    Liga o profiler para os mutexes criados a partir de agora.
+    """
+    global _enabled
+    _enabled = True
+    enable_lock_timing()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+class LockStats:
+    """
+    Estatísticas de todos os ProfiledLocks com um mesmo nome.
+
+    ...
+
+    Atributos
+    ---------
+    name : str
+        Nome dos mutexes.
+    acquisitions, contended, wait_ns, hold_ns : Counter
+        Aquisições, aquisições disputadas, tempo esperando e tempo segurando (em ns).
+    worst : List[Tuple[int, str]]
+        As piores esperas (em ns) e os seus pontos de chamada, da pior para a melhor.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.acquisitions = Counter()
+        self.contended = Counter()
+        self.wait_ns = Counter()
+        self.hold_ns = Counter()
+        self.worst: List[Tuple[int, str]] = []
+        self._worst_lock = threading.Lock()
+
+    def record_wait(self, wait_ns: int) -> None:
+        self.contended.add()
+        self.wait_ns.add(wait_ns)
+        worst = self.worst
+        if len(worst) >= lockprof_worst_waiters and wait_ns <= worst[-1][0]:
+            return
+        site = _call_site()
+        with self._worst_lock:
+            worst.append((wait_ns, site))
+            worst.sort(key=lambda item: -item[0])
+            del worst[lockprof_worst_waiters:]
+
+
+_stats: Dict[str, LockStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _stats_for(name: str) -> LockStats:
+    with _stats_lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = LockStats(name)
+        return stats
+
+
+def _call_site() -> str:
+    frames = []
+    frame = sys._getframe(2)
+    while frame is not None and len(frames) < lockprof_stack_depth:
+        filename = frame.f_code.co_filename
+        if not filename.endswith(_skipped_files):
+            frames.append(f"{os.path.basename(filename)}:{frame.f_lineno} "
+                          f"{frame.f_code.co_name}")
+        frame = frame.f_back
+    return " <- ".join(frames)
+
+
+class ProfiledLock:
+    """
+    Mutex (mesma interface de threading.Lock) que registra aquisições, espera e tempo
+    segurando em `stats`.
+    """
+
+    __slots__ = ("stats", "_lock", "_held_since", "_owner")
+
+    def __init__(self, stats: LockStats):
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._held_since = 0
+        self._owner = 0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(False):
+            acquired = True
+        elif not blocking:
+            return False
+        else:
+            started = time.perf_counter_ns()
+            acquired = self._lock.acquire(True, timeout)
+            if acquired:
+                self.stats.record_wait(time.perf_counter_ns() - started)
+        if acquired:
+            self.stats.acquisitions.add()
+            self._owner = threading.get_ident()
+            self._held_since = time.perf_counter_ns()
+        return acquired
+
+    def release(self) -> None:
+        self.stats.hold_ns.add(time.perf_counter_ns() - self._held_since)
+        self._owner = 0
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def _is_owned(self) -> bool:
+        # usado por threading.Condition (sem ele, a condição testaria a posse adquirindo
+        # o mutex, o que contaria como aquisição)
+        return self._lock.locked() and self._owner == threading.get_ident()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def make_lock(name: str):
+    """
+    Retorna um mutex para `name`: um ProfiledLock com o profiler ligado, ou um
+    threading.Lock comum.
+    """
+    if not _enabled:
+        return threading.Lock()
+    return ProfiledLock(_stats_for(name))
+
+
+def stats() -> List[LockStats]:
+    """
+    Estatísticas de cada nome, ordenadas pelo tempo total de espera (da maior para a menor).
+    """
+    with _stats_lock:
+        result = list(_stats.values())
+    return sorted(result, key=lambda s: -s.wait_ns.value())
+
+
+def report(top: Optional[int] = 10) -> None:
+    """
+    Printa os `top` mutexes com maior tempo total de espera e as piores esperas de cada um.
+    """
+    if not _enabled:
+        return
+    LOGGER.info("Contenção dos mutexes (ordenados pelo tempo total de espera):")
+    for s in stats()[:top]:
+        acquisitions = s.acquisitions.value()
+        contended = s.contended.value()
+        if not acquisitions:
+            continue
+        LOGGER.info(
+            f"  {s.name}: {acquisitions} aquisições, "
+            f"{100 * contended / acquisitions:.1f}% disputadas, "
+            f"espera {s.wait_ns.value() / 1e6:.3f}ms "
+            f"(média {s.wait_ns.value() / acquisitions / 1e3:.2f}us), "
+            f"segurado {s.hold_ns.value() / 1e6:.3f}ms "
+            f"(média {s.hold_ns.value() / acquisitions / 1e3:.2f}us)")
+        for wait_ns, site in list(s.worst):
+            LOGGER.info(f"      {wait_ns / 1e6:.3f}ms em {site}")
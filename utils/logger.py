@@ -1,8 +1,117 @@
-import logging, multiprocessing
+import atexit, itertools, logging, multiprocessing, queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
+
+# Pipeline de logs assíncrono:
+#   LOGGER -> QH (enfileira o LogRecord sem formatar, sem I/O)
+#          -> LISTENER (thread própria) -> CH (StreamHandler do console)
+# As threads da simulação nunca fazem I/O de console. O buffer é limitado: com a política
+# "drop" os registros excedentes são descartados (e contados); com "block" quem loga
+# espera haver espaço. Mensagens do caminho crítico são marcadas com `extra=HOT` e podem
+# ser amostradas por nível (ver `set_sampling`).
+# Use o estilo LOGGER.info("... %s", valor, extra=HOT) no caminho crítico: a mensagem só é
+# formatada pela thread do listener, e mensagens de níveis desabilitados não custam nada.
+# Passe valores imutáveis como argumentos, pois a formatação acontece depois.
+
+# Capacidade do buffer de logs
+log_buffer_size = 10_000
+
+# Marca de mensagens do caminho crítico (sujeitas à amostragem)
+HOT = {"hot_path": True}
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Deixa passar apenas 1 a cada N mensagens do caminho crítico, com N configurável por nível.
+    Mensagens sem a marca HOT nunca são amostradas.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._every: Dict[int, int] = {}
+        self._counters: Dict[int, itertools.count] = {}
+
+    def set_every(self, level: int, every: int) -> None:
+        self._every[level] = every
+        self._counters[level] = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "hot_path", False):
+            return True
+        every = self._every.get(record.levelno, 1)
+        if every <= 1:
+            return True
+        return next(self._counters[record.levelno]) % every == 0
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler com buffer limitado e política de descarte ("drop") ou bloqueio ("block").
+    Não formata a mensagem na thread que loga: o LogRecord é repassado intacto ao listener.
+    """
+
+    def __init__(self, maxsize: int, policy: str = "drop"):
+        super().__init__(queue.Queue(maxsize))
+        self.policy = policy
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.policy == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
 
 # Configura logger
 LOGGER = multiprocessing.get_logger()
 CH = logging.StreamHandler()
 formatter = logging.Formatter("%(asctime)s.%(msecs)03d [%(levelname)s] %(message)s", "%H:%M:%S")
 CH.setFormatter(formatter)
-LOGGER.addHandler(CH)
+SAMPLER = SamplingFilter()
+QH = BoundedQueueHandler(log_buffer_size)
+QH.addFilter(SAMPLER)
+LOGGER.addHandler(QH)
+LISTENER = QueueListener(QH.queue, CH, respect_handler_level=True)
+LISTENER.start()
+_stopped = False
+
+
+def set_sampling(level: int, every: int) -> None:
+    """
+    Passa a emitir apenas 1 a cada `every` mensagens HOT do nível `level`.
+    """
+    SAMPLER.set_every(level, every)
+
+
+def set_overflow_policy(policy: str) -> None:
+    """
+    Define o que fazer quando o buffer de logs está cheio: "drop" ou "block".
+    """
+    if policy not in ("drop", "block"):
+        raise ValueError(f"unknown log overflow policy: {policy}")
+    QH.policy = policy
+
+
+def stop_logging() -> None:
+    """
+    Esvazia o buffer de logs e encerra a thread do listener. Chamada automaticamente
+    ao término do programa.
+    """
+    global _stopped
+    if _stopped:
+        return
+    _stopped = True
+    LISTENER.stop()
+    if QH.dropped:
+        CH.handle(LOGGER.makeRecord(LOGGER.name, logging.WARNING, __file__, 0,
+                                    "%d mensagens de log descartadas (buffer cheio)",
+                                    (QH.dropped,), None))
+
+
+atexit.register(stop_logging)
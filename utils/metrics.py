@@ -0,0 +1,232 @@
+import json, os, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread, local
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Métricas da simulação.
+# Contadores incrementados no caminho crítico por várias threads não usam um mutex
+# compartilhado: cada thread soma em uma célula própria, e a leitura soma todas as
+# células (o valor lido pode não incluir incrementos concorrentes à leitura).
+#
+# As métricas são lidas por coletores registrados com `register_collector`: funções que
+# retornam amostras (nome, rótulos, valor) no momento da leitura. Assim, nada é calculado
+# no caminho crítico só para ser exportado. As amostras são expostas durante a execução
+# por um endpoint HTTP no formato texto do Prometheus (MetricsServer) e/ou por um arquivo
+# JSON reescrito periodicamente (SnapshotWriter).
+# Por convenção do Prometheus, métricas terminadas em "_total" são contadores e as demais
+# são gauges.
+
+
+class Counter:
+    """
+    Contador somado por várias threads sem disputa: uma célula por thread, somadas na leitura.
+
+    ...
+
+    Métodos
+    -------
+    add(n: int = 1) -> None:
+        Soma `n` à célula da thread atual.
+    value() -> int:
+        Soma de todas as células.
+    """
+
+    def __init__(self):
+        self._cells: List[List[int]] = []
+        self._local = local()
+        self._lock = Lock()
+
+    def add(self, n: int = 1) -> None:
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = self._local.cell = [0]
+            with self._lock:
+                self._cells.append(cell)
+        cell[0] += n
+
+    def value(self) -> int:
+        with self._lock:
+            return sum(cell[0] for cell in self._cells)
+
+
+# Número de mutexes de contas adquiridos (por `lock_accounts`)
+LOCK_ACQUISITIONS = Counter()
+
+# Tempo total (em nanossegundos, tempo real) esperando pelos mutexes de contas (em
+# `lock_accounts`). Só é medido com `enable_lock_timing()`; senão fica em zero.
+LOCK_WAIT_NS = Counter()
+
+# Se True, `lock_accounts` mede a espera pelos mutexes em LOCK_WAIT_NS. Desligado por
+# padrão (são dois relógios lidos por passada de locks): ligado pelo benchmark
+# (benchmarks/load_test.py) e pelo profiler de contenção (utils/lockprof.py)
+lock_timing = False
+
+# Número de transações liquidadas (por `settle_batch`)
+SETTLED_TRANSACTIONS = Counter()
+
+# Centavos retirados das reservas compartilhadas, debitados pelo câmbio e devolvidos pelos
+# ReserveCaches (ver payment_system/reserve_cache.py)
+RESERVES_PULLED = Counter()
+RESERVES_SPENT = Counter()
+RESERVES_RETURNED = Counter()
+
+
+def enable_lock_timing() -> None:
+    """
+    Liga a medição do tempo de espera pelos mutexes de contas (LOCK_WAIT_NS).
+    """
+    global lock_timing
+    lock_timing = True
+
+
+# Uma amostra: (nome da métrica, rótulos, valor)
+Sample = Tuple[str, Dict[str, str], float]
+
+_collectors: List[Callable[[], Iterable[Sample]]] = []
+
+
+def register_collector(collector: Callable[[], Iterable[Sample]]) -> None:
+    """
+    Registra `collector`, chamado a cada leitura das métricas.
+    """
+    _collectors.append(collector)
+
+
+def _global_samples() -> List[Sample]:
+    return [("payment_lock_acquisitions_total", {}, LOCK_ACQUISITIONS.value()),
+            ("payment_lock_wait_seconds_total", {}, LOCK_WAIT_NS.value() / 1e9),
+            ("payment_settled_transactions_total", {}, SETTLED_TRANSACTIONS.value()),
+            ("payment_reserve_cache_pulled_total", {}, RESERVES_PULLED.value()),
+            ("payment_reserve_cache_spent_total", {}, RESERVES_SPENT.value()),
+            ("payment_reserve_cache_returned_total", {}, RESERVES_RETURNED.value())]
+
+
+def collect() -> List[Sample]:
+    """
+    Lê todas as métricas: os contadores globais e as amostras de cada coletor registrado.
+    """
+    samples = _global_samples()
+    for collector in list(_collectors):
+        samples.extend(collector())
+    return samples
+
+
+def render_prometheus(samples: Iterable[Sample]) -> str:
+    """
+    Formata `samples` no formato texto de exposição do Prometheus (as amostras de uma
+    mesma métrica ficam juntas, sob uma única linha TYPE).
+    """
+    grouped: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        grouped.setdefault(sample[0], []).append(sample)
+    lines = []
+    for name, group in grouped.items():
+        lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        for _, labels, value in group:
+            if labels:
+                rendered = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{name}{{{rendered}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_prometheus(collect()).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # os acessos não vão para o log da simulação
+        pass
+
+
+class MetricsServer:
+    """
+    Endpoint HTTP local (GET /metrics) com as métricas no formato texto do Prometheus.
+    Atende em uma thread daemon, fora do relógio da simulação.
+
+    ...
+
+    Atributos
+    ---------
+    address : Tuple[str, int]
+        Endereço (host, porta) em que o servidor atende.
+
+    Métodos
+    -------
+    start() -> None:
+        Começa a atender requisições.
+    stop() -> None:
+        Para de atender e libera a porta.
+    """
+
+    def __init__(self, port: int, host: str = "127.0.0.1"):
+        self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self.address = self._server.server_address[:2]
+        self._thread = Thread(target=self._server.serve_forever, name="MetricsServer",
+                              daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+class SnapshotWriter(Thread):
+    """
+    Thread que reescreve, a cada `interval` segundos (tempo real), um arquivo JSON com
+    todas as amostras. O arquivo é substituído atomicamente, de modo que um leitor nunca
+    vê uma escrita pela metade.
+
+    ...
+
+    Atributos
+    ---------
+    path : str
+        Caminho do arquivo de snapshot.
+    interval : float
+        Intervalo entre snapshots, em segundos.
+
+    Métodos
+    -------
+    write() -> None:
+        Escreve um snapshot imediatamente.
+    stop() -> None:
+        Escreve um último snapshot e encerra a thread.
+    """
+
+    def __init__(self, path: str, interval: float = 1.0):
+        Thread.__init__(self, name="MetricsSnapshot", daemon=True)
+        self.path = path
+        self.interval = interval
+        self._stopped = Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.write()
+
+    def write(self) -> None:
+        snapshot = {"timestamp": time.time(),
+                    "samples": [{"name": name, "labels": labels, "value": value}
+                                for name, labels, value in collect()]}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, self.path)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+        self.write()
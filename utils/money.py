@@ -0,0 +1,54 @@
+from decimal import Decimal
+
+# Representação monetária de ponto fixo.
+#
+# Todos os valores (saldos, limites, valores de transações e taxas) são inteiros em
+# unidades menores da moeda (centavos). Não há floats no caminho de liquidação: as taxas
+# percentuais são expressas em pontos-base e as taxas de câmbio em partes por milhão.
+#
+# Regras de arredondamento:
+#   * taxas (cheque especial e câmbio): arredondamento "half-up" para o centavo mais próximo;
+#   * conversão de câmbio: arredondamento para baixo (o banco nunca paga fração de centavo).
+
+# 1 ponto-base = 0,01%
+BASIS_POINTS = 10_000
+
+# Taxa cobrada sobre transferências que usam cheque especial (5%)
+OVERDRAFT_FEE_BP = 500
+
+# Taxa cobrada sobre transferências internacionais (1%)
+EXCHANGE_FEE_BP = 100
+
+# Escala das taxas de câmbio em ponto fixo (partes por milhão)
+RATE_SCALE = 1_000_000
+
+
+def fee(amount: int, basis_points: int) -> int:
+    """
+    Retorna a taxa de `basis_points` sobre `amount`, arredondada "half-up".
+    """
+    return (amount * basis_points + BASIS_POINTS // 2) // BASIS_POINTS
+
+
+def rate_to_fixed(rate: float) -> int:
+    """
+    Converte uma taxa de câmbio decimal para partes por milhão, sem erro de float
+    (0.0069 -> 6900).
+    """
+    return int(Decimal(str(rate)) * RATE_SCALE)
+
+
+def convert(amount: int, fixed_rate: int) -> int:
+    """
+    Converte `amount` usando uma taxa em partes por milhão, arredondando para baixo.
+    """
+    return amount * fixed_rate // RATE_SCALE
+
+
+def format_amount(amount: int, currency_name: str) -> str:
+    """
+    Formata um valor em centavos para exibição (ex.: -123456 -> "-1,234.56 USD").
+    """
+    units, cents = divmod(abs(amount), 100)
+    sign = "-" if amount < 0 else ""
+    return f"{sign}{units:,d}.{cents:02d} {currency_name}"
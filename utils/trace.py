@@ -0,0 +1,160 @@
+import mmap, struct
+from typing import Dict, Iterator, Optional, Tuple
+from weakref import WeakSet
+
+from utils import clock
+from utils.lockprof import make_lock
+from utils.transaction import Transaction
+
+# Traces de transações.
+# Um trace é o fluxo de transferências de uma execução, gravado em registros binários de
+# tamanho fixo, para ser reproduzido depois (ver ReplayGenerator em
+# payment_system/transaction_generator.py):
+#   cabeçalho: magic, tamanho do registro
+#   registro: banco de origem, banco de destino, conta de origem, conta de destino,
+#             moeda, valor (centavos), instante (ns desde o início da captura, no relógio
+#             da simulação)
+# A leitura mapeia o arquivo com mmap e decodifica os registros com struct.iter_unpack
+# direto do mapeamento, em janelas de `trace_window_records` registros: nada é copiado
+# para um buffer intermediário e só as páginas da janela atual precisam estar em memória,
+# de modo que um trace pode ser maior que a RAM. As views do mapeamento são liberadas ao
+# fim de cada janela, e `close()` encerra os iteradores ainda abertos antes de desfazer o
+# mapeamento (um mmap com views exportadas não pode ser fechado).
+
+# Número de registros decodificados por janela na leitura
+trace_window_records = 4096
+
+# Tamanho (em bytes) do buffer de escrita antes de gravá-lo no arquivo
+trace_buffer_size = 1 << 20
+
+_MAGIC = b"PAYTRACE"
+_HEADER = struct.Struct("<8sI4x")
+_RECORD = struct.Struct("<HHIIB7xqq")
+
+# (banco de origem, banco de destino, conta de origem, conta de destino, moeda, valor,
+# instante em ns)
+TraceRecord = Tuple[int, int, int, int, int, int, int]
+
+
+class TraceWriter:
+    """
+    Grava as transações de uma execução em um trace. Pode ser usado por várias threads.
+
+    ...
+
+    Atributos
+    ---------
+    path : str
+        Arquivo do trace.
+    records : int
+        Número de transações gravadas.
+
+    Métodos
+    -------
+    record(transaction: Transaction) -> None:
+        Anexa uma transação ao trace.
+    close() -> None:
+        Grava o buffer restante e fecha o arquivo.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = 0
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(_MAGIC, _RECORD.size))
+        self._buffer = bytearray()
+        self._lock = make_lock("trace.writer")
+        self._started_ns = clock.monotonic_ns()
+
+    def record(self, transaction: Transaction) -> None:
+        record = _RECORD.pack(
+            transaction.origin[0], transaction.destination[0], transaction.origin[1],
+            transaction.destination[1], transaction.currency.value, transaction.amount,
+            max(0, transaction.created_ns - self._started_ns))
+        with self._lock:
+            self._buffer += record
+            self.records += 1
+            if len(self._buffer) >= trace_buffer_size:
+                self._file.write(self._buffer)
+                self._buffer.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+            self._file.close()
+
+
+class TraceReader:
+    """
+    Lê um trace por meio de um mmap. Use como gerenciador de contexto.
+
+    ...
+
+    Atributos
+    ---------
+    path : str
+        Arquivo do trace.
+
+    Métodos
+    -------
+    records(bank_id: Optional[int] = None) -> Iterator[TraceRecord]:
+        Registros do trace, em ordem (só os do banco de origem `bank_id`, se informado).
+    accounts_needed() -> Dict[int, int]:
+        Para cada banco, o número de contas que ele precisa ter para liquidar o trace.
+    close() -> None:
+        Encerra os iteradores de `records` ainda abertos e desfaz o mapeamento do arquivo.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, record_size = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or record_size != _RECORD.size:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a compatible transaction trace")
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        self._iterators = WeakSet()
+
+    def __enter__(self) -> "TraceReader":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return (len(self._mmap) - _HEADER.size) // _RECORD.size
+
+    def records(self, bank_id: Optional[int] = None) -> Iterator[TraceRecord]:
+        iterator = self._records(bank_id)
+        self._iterators.add(iterator)
+        return iterator
+
+    def _records(self, bank_id: Optional[int]) -> Iterator[TraceRecord]:
+        window = trace_window_records * _RECORD.size
+        end = _HEADER.size + len(self) * _RECORD.size
+        with memoryview(self._mmap) as view:
+            for start in range(_HEADER.size, end, window):
+                with view[start:min(start + window, end)] as chunk:
+                    records = _RECORD.iter_unpack(chunk)
+                    try:
+                        for record in records:
+                            if bank_id is None or record[0] == bank_id:
+                                yield record
+                    finally:
+                        # o iterador exporta `chunk`: precisa sair antes da liberação
+                        del records
+
+    def accounts_needed(self) -> Dict[int, int]:
+        needed: Dict[int, int] = {}
+        for origin_bank, destination_bank, origin, destination, *_ in self.records():
+            needed[origin_bank] = max(needed.get(origin_bank, 0), origin + 1)
+            needed[destination_bank] = max(needed.get(destination_bank, 0), destination + 1)
+        return needed
+
+    def close(self) -> None:
+        for iterator in list(self._iterators):
+            iterator.close()
+        self._mmap.close()
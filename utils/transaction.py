@@ -1,10 +1,11 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from enum import Enum
 from typing import Optional, Tuple
 
 from utils.currency import Currency
 from utils.logger import LOGGER
+from utils import clock
 
 
 class TransactionStatus(Enum):
@@ -34,15 +35,22 @@ class Transaction:
     destination : Tuple[int, int]
         Uma tupla contendo o identificador do banco e da conta destino.
     amount : int
-        Valor a ser transferido.
+        Valor a ser transferido, em centavos da moeda do banco de origem.
     currency : Currency
         Moeda a ser transferida.
+    exchange_fee : float
+        Taxa de câmbio aplicada (1 para transações nacionais).
+    taxes : int
+        Taxas cobradas (cheque especial e câmbio), em centavos da moeda de origem.
     status : TransactionStatus
         Status da transação bancária.
     created_at : datetime
         Timestamp do momento de criação da transação bancária (quando ela é requisitada pelo cliente).
     completed_at : datetime
         Timestamp do momento em que a transação é finalizada (seja status FAILED ou SUCCESSFUL).
+    created_ns, enqueued_ns, dequeued_ns, started_ns, completed_ns : int
+        Instantes (clock.monotonic_ns) da criação, da entrada na fila do banco, da retirada
+        da fila, do início do processamento e da finalização (0 enquanto não ocorreram).
 
     Métodos
     -------
@@ -55,11 +63,18 @@ class Transaction:
     destination: Tuple[int, int] 
     amount: int
     currency: Currency
-    exchange_fee: int = 0
+    exchange_fee: float = 0
     taxes: int = 0
     status: TransactionStatus = TransactionStatus.PENDING
-    created_at: datetime = datetime.now()
+    # default_factory: o valor padrão é calculado para cada transação (e não uma única vez,
+    # na importação do módulo)
+    created_at: datetime = field(default_factory=clock.now)
     completed_at: Optional[datetime] = None
+    created_ns: int = field(default_factory=clock.monotonic_ns, repr=False, compare=False)
+    enqueued_ns: int = field(default=0, repr=False, compare=False)
+    dequeued_ns: int = field(default=0, repr=False, compare=False)
+    started_ns: int = field(default=0, repr=False, compare=False)
+    completed_ns: int = field(default=0, repr=False, compare=False)
 
     def set_status(self, status: TransactionStatus) -> None:
         """
@@ -68,7 +83,8 @@ class Transaction:
         ATENÇÃO: NÃO É PERMITIDO ALTERAR ESSE MÉTODO!
         """
         self.status = status
-        self.completed_at = datetime.now()
+        self.completed_at = clock.now()
+        self.completed_ns = clock.monotonic_ns()
 
 
     def get_processing_time(self) -> Optional[timedelta]: